@@ -39,7 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     "recordings",
 ]
-from decouple import config
+from decouple import Csv, config
 
 CLIENT_ID = config("CLIENT_ID")
 SECRET = config("SECRET")
@@ -48,6 +48,131 @@ API_VERSION = config("API_VERSION")
 OPENAI_API_KEY = config("OPENAI_API_KEY")
 BITRIX24_API_URL= config("BITRIX24_API_URL")
 BITRIX24_API_URL1= config("BITRIX24_API_URL1")
+EIGHTX8_API_URL = config("EIGHTX8_API_URL", default="https://api.8x8.com")  # Overridden by the offline benchmark
+
+# 8x8 OAuth token caching
+TOKEN_REFRESH_MARGIN = config("TOKEN_REFRESH_MARGIN", default=60, cast=int)  # Seconds before expiry to refresh
+TOKEN_SHARED_CACHE = config("TOKEN_SHARED_CACHE", default=False, cast=bool)  # Share token via Django cache
+REGIONS_CACHE_TTL = config("REGIONS_CACHE_TTL", default=3600, cast=int)
+OBJECTS_PAGE_SIZE = config("OBJECTS_PAGE_SIZE", default=100, cast=int)  # Objects per find_objects page
+
+# 8x8 bulk download jobs
+BULK_CHUNK_SIZE = config("BULK_CHUNK_SIZE", default=50, cast=int)  # Objects per bulk download job
+BULK_MAX_IN_FLIGHT = config("BULK_MAX_IN_FLIGHT", default=4, cast=int)  # Concurrent bulk download jobs
+BULK_POLL_INITIAL = config("BULK_POLL_INITIAL", default=1, cast=float)  # First status poll delay (seconds)
+BULK_POLL_MAX = config("BULK_POLL_MAX", default=15, cast=float)
+BULK_POLL_TIMEOUT = config("BULK_POLL_TIMEOUT", default=600, cast=float)
+REGION_WORKERS = config("REGION_WORKERS", default=4, cast=int)  # Regions synced concurrently
+PIPELINE_QUEUE_SIZE = config("PIPELINE_QUEUE_SIZE", default=4, cast=int)  # Chunks waiting for a bulk download
+PIPELINE_MAX_READY_ZIPS = config("PIPELINE_MAX_READY_ZIPS", default=2, cast=int)  # Downloaded ZIPs queued per later stage
+PIPELINE_PREPARE_WORKERS = config("PIPELINE_PREPARE_WORKERS", default=2, cast=int)  # ZIPs extracted/hashed at once
+PIPELINE_UPLOAD_WORKERS = config("PIPELINE_UPLOAD_WORKERS", default=2, cast=int)  # ZIPs uploaded to Bitrix24 at once
+SYNC_LEASE_SECONDS = config("SYNC_LEASE_SECONDS", default=1800, cast=int)  # How long a run may hold a recording
+SYNC_MAX_ATTEMPTS = config("SYNC_MAX_ATTEMPTS", default=3, cast=int)  # Attempts before a recording is given up on
+SYNC_RETRY_BACKOFF = config("SYNC_RETRY_BACKOFF", default=300, cast=int)  # Seconds before the first retry, doubling
+SYNC_SWEEP_OVERLAP = config("SYNC_SWEEP_OVERLAP", default=3600, cast=int)  # Seconds each sweep re-lists before the last one
+
+# Downloaded ZIP handling
+DOWNLOAD_CHUNK_SIZE = config("DOWNLOAD_CHUNK_SIZE", default=1024 * 1024, cast=int)  # Bytes per read/write
+ZIP_STREAMING = config("ZIP_STREAMING", default=True, cast=bool)  # Upload straight from the ZIP, no extraction
+ZIP_SPOOL_MAX_BYTES = config("ZIP_SPOOL_MAX_BYTES", default=16 * 1024 * 1024, cast=int)  # In-memory limit per member
+CLEANUP_DOWNLOADS = config("CLEANUP_DOWNLOADS", default=True, cast=bool)  # Delete ZIPs once synced
+
+# On-disk LRU cache of recordings served by /recordings/recording/<id>/ (0 bytes disables it)
+RECORDING_CACHE_DIR = config("RECORDING_CACHE_DIR", default=str(BASE_DIR / "recording_cache"))
+RECORDING_CACHE_MAX_BYTES = config("RECORDING_CACHE_MAX_BYTES", default=1024 * 1024 * 1024, cast=int)
+RECORDING_CACHE_MAX_AGE = config("RECORDING_CACHE_MAX_AGE", default=7 * 24 * 3600, cast=int)  # Seconds since last use
+RECORDING_CACHE_ON_SYNC = config("RECORDING_CACHE_ON_SYNC", default=False, cast=bool)  # Also copy synced audio into the cache
+RECORDING_FETCH_RETRY_AFTER = config("RECORDING_FETCH_RETRY_AFTER", default=10, cast=int)  # Seconds, on a cache miss
+
+# Background sync jobs (run with `manage.py run_sync_worker`)
+SYNC_JOB_POLL_INTERVAL = config("SYNC_JOB_POLL_INTERVAL", default=2, cast=float)  # Idle queue check (seconds)
+SYNC_JOB_HEARTBEAT = config("SYNC_JOB_HEARTBEAT", default=30, cast=float)
+SYNC_JOB_STALE_AFTER = config("SYNC_JOB_STALE_AFTER", default=300, cast=float)  # Requeue jobs silent this long
+SYNC_BATCH_WINDOW = config("SYNC_BATCH_WINDOW", default=2, cast=float)  # Seconds webhook notifications are collected
+SYNC_BATCH_MAX = config("SYNC_BATCH_MAX", default=100, cast=int)  # Recordings synced together by one worker run
+WEBHOOK_SECRET = config("WEBHOOK_SECRET", default="")  # Expected in the X-Webhook-Token header; unset refuses webhooks
+
+# Pooled HTTP client shared by the 8x8 and Bitrix24 calls
+HTTP_POOL_MAXSIZE = config("HTTP_POOL_MAXSIZE", default=20, cast=int)  # Keep-alive connections per host
+HTTP_POOL_BLOCK = config("HTTP_POOL_BLOCK", default=False, cast=bool)
+HTTP_CONNECT_TIMEOUT = config("HTTP_CONNECT_TIMEOUT", default=10, cast=float)
+HTTP_READ_TIMEOUT = config("HTTP_READ_TIMEOUT", default=120, cast=float)
+HTTP_RETRIES = config("HTTP_RETRIES", default=3, cast=int)  # Retries for idempotent calls, 429 and 5xx
+HTTP_RETRY_BACKOFF = config("HTTP_RETRY_BACKOFF", default=0.5, cast=float)  # First backoff (seconds), doubles
+HTTP_RETRY_MAX_DELAY = config("HTTP_RETRY_MAX_DELAY", default=30, cast=float)
+HTTP_BREAKER_THRESHOLD = config("HTTP_BREAKER_THRESHOLD", default=5, cast=int)  # Consecutive failures to open
+HTTP_BREAKER_RESET = config("HTTP_BREAKER_RESET", default=30, cast=float)  # Seconds before a trial call
+
+# Bitrix24 Disk upload folder
+BITRIX24_STORAGE_ID = config("BITRIX24_STORAGE_ID", default=1, cast=int)
+BITRIX24_FOLDER_LAYOUT = config("BITRIX24_FOLDER_LAYOUT", default="")  # e.g. "Recordings/%Y-%m-%d" or "Recordings/{agent}"
+BITRIX24_FOLDER_AGENT_TAGS = config("BITRIX24_FOLDER_AGENT_TAGS", default="agentName,agentId", cast=Csv())  # 8x8 tags naming the agent
+BITRIX24_FOLDER_CACHE_TTL = config("BITRIX24_FOLDER_CACHE_TTL", default=3600, cast=int)
+BITRIX24_FOLDER_SHARED_CACHE = config("BITRIX24_FOLDER_SHARED_CACHE", default=False, cast=bool)
+
+# Bitrix24 REST limits (leaky bucket: 2 requests/s, bursts of 50) and upload concurrency
+BITRIX24_RATE_LIMIT = config("BITRIX24_RATE_LIMIT", default=2, cast=float)
+BITRIX24_RATE_BURST = config("BITRIX24_RATE_BURST", default=50, cast=int)
+BITRIX24_LIMIT_RETRIES = config("BITRIX24_LIMIT_RETRIES", default=5, cast=int)  # Retries on QUERY_LIMIT_EXCEEDED
+BITRIX24_UPLOAD_CONCURRENCY = config("BITRIX24_UPLOAD_CONCURRENCY", default=4, cast=int)
+
+# Upload files this large or larger in chunks that are retried on their own and resume after a failure.
+# Off by default: it assumes the portal's uploadUrl appends POSTs that carry a Content-Range header,
+# which Bitrix24 does not document. Check on a test portal before turning it on; if the first chunk
+# comes back as a finished file, the upload falls back to one request per file.
+BITRIX24_CHUNKED_UPLOAD = config("BITRIX24_CHUNKED_UPLOAD", default=False, cast=bool)
+BITRIX24_CHUNKED_UPLOAD_THRESHOLD = config("BITRIX24_CHUNKED_UPLOAD_THRESHOLD", default=8 * 1024 * 1024, cast=int)
+BITRIX24_UPLOAD_CHUNK_SIZE = config("BITRIX24_UPLOAD_CHUNK_SIZE", default=4 * 1024 * 1024, cast=int)
+BITRIX24_UPLOAD_RESUME_TTL = config("BITRIX24_UPLOAD_RESUME_TTL", default=3600, cast=int)  # Seconds an upload URL is reused
+
+# Matching recordings to CRM entities
+BITRIX24_RECORDING_FIELD = config("BITRIX24_RECORDING_FIELD", default="UF_CRM_123456")  # Custom lead field for the file
+# Custom fields are defined per entity type; a contact or deal is only attached to when its field is set
+BITRIX24_CONTACT_RECORDING_FIELD = config("BITRIX24_CONTACT_RECORDING_FIELD", default="")
+BITRIX24_DEAL_RECORDING_FIELD = config("BITRIX24_DEAL_RECORDING_FIELD", default="")
+BITRIX24_ENTITY_FALLBACK = config("BITRIX24_ENTITY_FALLBACK", default=True, cast=bool)  # Try contacts/deals when no lead
+PHONE_DEFAULT_REGION = config("PHONE_DEFAULT_REGION", default="US")  # Used with the optional phonenumbers package
+PHONE_DEFAULT_COUNTRY_CODE = config("PHONE_DEFAULT_COUNTRY_CODE", default="1")
+PHONE_CACHE_TTL = config("PHONE_CACHE_TTL", default=3600, cast=int)
+PHONE_NEGATIVE_TTL = config("PHONE_NEGATIVE_TTL", default=300, cast=int)  # How long "no match" is remembered
+PHONE_CACHE_SIZE = config("PHONE_CACHE_SIZE", default=10000, cast=int)
+
+# Metrics (/recordings/metrics/) and slow-stage logging
+METRICS_SLOW_STAGE_SECONDS = config("METRICS_SLOW_STAGE_SECONDS", default=60, cast=float)  # Logged to recordings.slow
+METRICS_SNAPSHOT_TTL = config("METRICS_SNAPSHOT_TTL", default=3600, cast=float)  # Forget workers silent this long
+
+# Re-encoding recordings before upload (needs ffmpeg)
+TRANSCODE_RECORDINGS = config("TRANSCODE_RECORDINGS", default=False, cast=bool)
+TRANSCODE_FORMAT = config("TRANSCODE_FORMAT", default="opus")  # "opus" (Ogg) or "mp3", always mono
+TRANSCODE_BITRATE = config("TRANSCODE_BITRATE", default="24k")
+TRANSCODE_EXTENSIONS = config("TRANSCODE_EXTENSIONS", default=".wav", cast=Csv())  # Which recordings to re-encode
+TRANSCODE_WORKERS = config("TRANSCODE_WORKERS", default=2, cast=int)  # Encoder processes
+
+# Call transcription and AI feedback
+TRANSCRIBE_RECORDINGS = config("TRANSCRIBE_RECORDINGS", default=False, cast=bool)  # Add AI feedback comments
+TRANSCRIPTION_BACKEND = config("TRANSCRIPTION_BACKEND", default="recordings.services.transcription.OpenAIWhisperBackend")
+TRANSCRIPTION_MODEL = config("TRANSCRIPTION_MODEL", default="whisper-1")
+TRANSCRIPTION_CONCURRENCY = config("TRANSCRIPTION_CONCURRENCY", default=4, cast=int)  # Parallel API calls
+TRANSCRIPTION_RATE_LIMIT = config("TRANSCRIPTION_RATE_LIMIT", default=0.8, cast=float)  # API calls per second
+TRANSCRIPTION_MAX_BYTES = config("TRANSCRIPTION_MAX_BYTES", default=24 * 1024 * 1024, cast=int)  # API limit is 25 MB
+TRANSCRIPTION_SEGMENT_OVERLAP = config("TRANSCRIPTION_SEGMENT_OVERLAP", default=2, cast=float)  # Seconds
+TRANSCRIPTION_DOWNMIX = config("TRANSCRIPTION_DOWNMIX", default=True, cast=bool)  # 16 kHz mono before upload (ffmpeg)
+TRANSCRIPTION_BITRATE = config("TRANSCRIPTION_BITRATE", default="32k")
+FFMPEG_BINARY = config("FFMPEG_BINARY", default="ffmpeg")
+ANALYSIS_MODEL = config("ANALYSIS_MODEL", default="gpt-4")
+ANALYSIS_CONCURRENCY = config("ANALYSIS_CONCURRENCY", default=4, cast=int)  # Parallel analysis calls
+ANALYSIS_MAX_CHARS = config("ANALYSIS_MAX_CHARS", default=20000, cast=int)  # ~5k tokens, fits gpt-4's 8k context
+ANALYSIS_OVERFLOW = config("ANALYSIS_OVERFLOW", default="truncate")  # "truncate" or "summarize" long transcripts
+
+# Transcript search (/recordings/search/)
+SEARCH_PAGE_SIZE = config("SEARCH_PAGE_SIZE", default=20, cast=int)
+SEARCH_MAX_PAGE_SIZE = config("SEARCH_MAX_PAGE_SIZE", default=100, cast=int)
+SEARCH_MATERIALIZE_LIMIT = config("SEARCH_MATERIALIZE_LIMIT", default=20000, cast=int)  # Matches collected up front
+SEARCH_COUNT_LIMIT = config("SEARCH_COUNT_LIMIT", default=500, cast=int)  # Matches counted; more is reported as "500+"
+SEARCH_MIN_PREFIX = config("SEARCH_MIN_PREFIX", default=3, cast=int)  # Letters a ``word*`` search needs
+SEARCH_MAX_PREFIX_TERMS = config("SEARCH_MAX_PREFIX_TERMS", default=50, cast=int)  # Words a ``word*`` may stand for
+SEARCH_PREFIX_CACHE_TTL = config("SEARCH_PREFIX_CACHE_TTL", default=60, cast=int)  # Seconds prefix expansions are reused
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
@@ -131,3 +256,19 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+LOG_LEVEL = config("LOG_LEVEL", default="INFO")
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "plain": {"format": "%(asctime)s %(levelname)s %(name)s %(message)s"},
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": "plain"},
+    },
+    "loggers": {
+        "recordings": {"handlers": ["console"], "level": LOG_LEVEL},
+    },
+}
@@ -1,3 +1,47 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import (
+    MetricsSnapshot, Recording, SyncCheckpoint, SyncJob, Transcript, TranscriptAnalysis, UploadSession,
+)
+
+
+@admin.register(Recording)
+class RecordingAdmin(admin.ModelAdmin):
+    list_display = ("object_id", "region", "phone_number", "status", "created_time", "attached_at")
+    list_filter = ("status", "region")
+    search_fields = ("object_id", "phone_number", "bitrix_entity_id")
+
+
+@admin.register(SyncJob)
+class SyncJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "object_id", "status", "found", "downloaded", "uploaded", "failed", "created_at", "run_after", "finished_at")
+    list_filter = ("status",)
+
+
+@admin.register(SyncCheckpoint)
+class SyncCheckpointAdmin(admin.ModelAdmin):
+    list_display = ("key", "position", "finished", "updated_at")
+
+
+@admin.register(Transcript)
+class TranscriptAdmin(admin.ModelAdmin):
+    list_display = ("recording", "phone_number", "entity_id", "call_time", "sentiment", "score")
+    list_filter = ("sentiment",)
+    search_fields = ("phone_number", "entity_id")
+    raw_id_fields = ("recording",)
+
+
+@admin.register(TranscriptAnalysis)
+class TranscriptAnalysisAdmin(admin.ModelAdmin):
+    list_display = ("content_hash", "model", "sentiment", "score", "created_at")
+    list_filter = ("sentiment", "model")
+
+
+@admin.register(MetricsSnapshot)
+class MetricsSnapshotAdmin(admin.ModelAdmin):
+    list_display = ("worker", "updated_at")
+
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ("key", "offset", "size", "created_at", "updated_at")
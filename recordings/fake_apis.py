@@ -0,0 +1,333 @@
+"""Local stand-ins for the 8x8 storage API and the Bitrix24 REST API.
+
+Used by the ``benchmark_pipeline`` command to run the real sync pipeline
+offline. One HTTP server answers both APIs: 8x8 under ``/8x8`` and Bitrix24
+under ``/bitrix``, with configurable latency, rate limiting, error injection
+and synthetic ZIPs of recordings.
+"""
+import io
+import json
+import logging
+import random
+import re
+import struct
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from .services.ledger import parse_8x8_time
+
+logger = logging.getLogger(__name__)
+
+BITRIX_PREFIX = "/bitrix"
+EIGHTX8_PREFIX = "/8x8"
+
+# One ``field<op>value`` clause of an 8x8 filter; ``=in=`` takes a parenthesized, comma-separated list
+FILTER_CLAUSE = re.compile(r"(\w+)(==|=in=|>=|<)(\([^)]*\)|[^,]*)")
+
+
+def synthetic_wav(seed, size):
+    """A valid mono 8 kHz 16-bit WAV of about ``size`` bytes whose samples depend on ``seed``."""
+    frames = random.Random(seed).randbytes(max(size - 44, 2) // 2 * 2)
+    header = b"RIFF" + struct.pack("<I", 36 + len(frames)) + b"WAVEfmt " + struct.pack(
+        "<IHHIIHH", 16, 1, 1, 8000, 16000, 2, 16
+    ) + b"data" + struct.pack("<I", len(frames))
+    return header + frames
+
+
+class FakeApis:
+    """Generates ``recordings`` call recordings spread over ``regions`` and serves them.
+
+    ``latency`` seconds (±50% jitter) are added to every call, ``error_rate``
+    of calls fail with a 500, Bitrix24 answers QUERY_LIMIT_EXCEEDED above
+    ``bitrix_rate_limit`` calls per second (0 disables), bulk downloads take
+    ``bulk_delay`` seconds to become ready (``bulk_state`` and
+    ``bulk_retry_after`` make them fail or hint a poll interval) and
+    ``lead_ratio`` of the phone numbers match a lead. Without
+    ``chunked_uploads`` the upload URL ignores Content-Range and stores every
+    request as a whole file. 8x8 calls need a bearer token from the fake token
+    endpoint (see ``revoke_tokens``).
+    """
+
+    def __init__(self, recordings=10, regions=("us-east", "us-west"), latency=0.0, error_rate=0.0,
+                 bitrix_rate_limit=0, bulk_delay=0.5, recording_bytes=32 * 1024, lead_ratio=0.9, seed=0,
+                 chunked_uploads=True):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.bulk_delay = bulk_delay
+        self.recording_bytes = recording_bytes
+        self.lead_ratio = lead_ratio
+        self.chunked_uploads = chunked_uploads
+        self.regions = list(regions)
+        self.bitrix_rate_limit = bitrix_rate_limit
+        self._allowance, self._allowance_at = float(bitrix_rate_limit), time.monotonic()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._bulk = {}
+        self._uploads = {}  # Upload ID -> bytes received so far, for chunked uploads
+        self._next_id = 1
+        self.root_folder_id = str(self._new_id())  # Unlike the storage ID, so the two can't be mixed up
+        self._folders = {self.root_folder_id: (None, "")}  # Folder ID -> (parent ID, name)
+        self.calls = {}
+        self.reject_tokens = False  # Answer 401 even to fresh tokens
+        self.bulk_state = None  # E.g. "FAILED": what every bulk download job reports instead of its progress
+        self.bulk_retry_after = None  # Seconds suggested to pollers of unfinished bulk download jobs
+        self._tokens = set()
+        self.bytes_uploaded = 0
+
+        start = datetime.now(timezone.utc) - timedelta(days=1)
+        self.objects = {region: [] for region in self.regions}
+        for i in range(recordings):
+            created = start + timedelta(seconds=i)
+            name = f"{created:%Y%m%d-%H%M%S}_+1555{i:07d}_call.wav"
+            self.objects[self.regions[i % len(self.regions)]].append({
+                "id": f"obj-{i:07d}",
+                "objectName": name,
+                "type": "callcenterrecording",
+                "objectState": "AVAILABLE",
+                "createdTime": int(created.timestamp() * 1000),
+                "size": recording_bytes,
+                "tags": [{"key": "agentName", "value": f"Agent {i % 5}"}],
+            })
+
+    # Server lifecycle
+
+    def start(self, host="127.0.0.1", port=0):
+        """Serve on a background thread; returns the base URL."""
+        apis = self
+
+        class Handler(_Handler):
+            fake = apis
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://{host}:{self.server.server_address[1]}"
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _new_id(self):
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    def folder_path(self, folder_id):
+        """The path of a Disk folder below the storage root, e.g. "Recordings/2024-03-01"."""
+        names = []
+        while folder_id in self._folders and self._folders[folder_id][0] is not None:
+            folder_id, name = self._folders[folder_id]
+            names.append(name)
+        return "/".join(reversed(names))
+
+    def count(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    # 8x8 storage API
+
+    def filter_objects(self, region, filter_query):
+        """Apply the subset of the 8x8 filter syntax the pipeline uses."""
+        objects = self.objects.get(region, [])
+        for field, op, value in FILTER_CLAUSE.findall(filter_query or ""):
+            if op == "=in=":
+                wanted = set(value.strip("()").split(","))
+                objects = [obj for obj in objects if obj.get(field) in wanted]
+            elif op == "==":
+                objects = [obj for obj in objects if str(obj.get(field)) == value]
+            elif field == "createdTime":
+                limit = int(parse_8x8_time(value).timestamp() * 1000)
+                keep = (lambda t: t >= limit) if op == ">=" else (lambda t: t < limit)
+                objects = [obj for obj in objects if keep(obj["createdTime"])]
+        return objects
+
+    def revoke_tokens(self):
+        """Make every access token issued so far answer 401, like an expired or revoked 8x8 token."""
+        with self._lock:
+            self._tokens.clear()
+
+    def handle_8x8(self, method, path, query, body, headers=None):
+        if path == "/oauth/v2/token":
+            token = f"fake-token-{self._new_id()}"
+            with self._lock:
+                self._tokens.add(token)
+            return 200, {"access_token": token, "expires_in": 1800}
+        token = (headers or {}).get("Authorization", "").removeprefix("Bearer ")
+        if token not in self._tokens or self.reject_tokens:
+            return 401, {"error": "invalid_token"}
+
+        match = re.match(r"/storage/([^/]+)/v3/(.*)", path)
+        if not match:
+            return 404, {"error": "not found"}
+        region, rest = match.groups()
+
+        if rest == "regions":
+            return 200, self.regions
+        if rest == "objects":
+            objects = self.filter_objects(region, query.get("filter", [""])[0])
+            page, size = int(query.get("page", [0])[0]), int(query.get("size", [100])[0])
+            content = objects[page * size:(page + 1) * size]
+            return 200, {"content": content, "last": (page + 1) * size >= len(objects)}
+        if rest == "bulk/download/start" and method == "POST":
+            self.count("8x8 bulk start")
+            object_ids = set(json.loads(body or b"[]"))
+            zip_name = f"bulk-{region}-{self._new_id()}.zip"
+            with self._lock:
+                self._bulk[zip_name] = (
+                    [obj for obj in self.objects[region] if obj["id"] in object_ids],
+                    time.monotonic() + self.bulk_delay,
+                )
+            return 200, {"zipName": zip_name}
+        if rest.startswith("bulk/download/status/"):
+            entry = self._bulk.get(rest.rsplit("/", 1)[1])
+            if entry is None:
+                return 404, {"error": "unknown zip"}
+            if self.bulk_state:
+                return 200, {"status": self.bulk_state}
+            if time.monotonic() >= entry[1]:
+                return 200, {"status": "DONE"}
+            status = {"status": "IN_PROGRESS"}
+            if self.bulk_retry_after is not None:
+                status["retryAfter"] = self.bulk_retry_after
+            return 200, status
+        if rest.startswith("bulk/download/"):
+            entry = self._bulk.get(rest.rsplit("/", 1)[1])
+            if entry is None:
+                return 404, {"error": "unknown zip"}
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zf:
+                for obj in entry[0]:
+                    zf.writestr(obj["objectName"], synthetic_wav(obj["id"], self.recording_bytes))
+            return 200, buffer.getvalue()
+        return 404, {"error": "not found"}
+
+    # Bitrix24 REST API
+
+    def _over_limit(self):
+        """Token bucket like the portal's: ``bitrix_rate_limit`` calls per second, bursts of as many."""
+        if not self.bitrix_rate_limit:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(
+                self.bitrix_rate_limit, self._allowance + (now - self._allowance_at) * self.bitrix_rate_limit
+            )
+            self._allowance_at = now
+            if self._allowance < 1:
+                return True
+            self._allowance -= 1
+            return False
+
+    def _has_lead(self, phone):
+        return random.Random(phone).random() < self.lead_ratio
+
+    def _batch_command(self, command):
+        method, _, query = command.partition("?")
+        params = {unquote(k): v[0] for k, v in parse_qs(query).items()}
+        self.count(method)
+        if method == "crm.duplicate.findbycomm":
+            phone = params.get("values[0]", "")
+            return {"LEAD": [self._new_id()]} if self._has_lead(phone) else []
+        if method.endswith(".list"):
+            return []
+        if method.endswith(".update"):
+            return True
+        return self._new_id()
+
+    def _receive_upload(self, upload_id, body, headers):
+        """Accept a whole file, or one ``Content-Range`` chunk of it; a file ID once it is complete."""
+        with self._lock:
+            self.bytes_uploaded += len(body)
+        match = re.match(r"bytes (\d+)-(\d+)/(\d+)", headers.get("Content-Range") or "")
+        if not match or not self.chunked_uploads:
+            return 200, {"result": {"ID": str(self._new_id())}}
+        start, end, total = map(int, match.groups())
+        with self._lock:
+            received = self._uploads.get(upload_id, 0)
+            if start > received:
+                return 416, {"error": "WRONG_RANGE", "error_description": f"Expected offset {received}"}
+            self._uploads[upload_id] = max(received, end + 1)
+            done = self._uploads[upload_id] >= total
+        return 200, {"result": {"ID": str(self._new_id())} if done else {}}
+
+    def handle_bitrix(self, method, path, query, body, headers=None):
+        name = path.strip("/").removesuffix(".json")
+        if name == "batch":
+            commands = json.loads(body or b"{}").get("cmd", {})
+            results = {key: self._batch_command(command) for key, command in commands.items()}
+            return 200, {"result": {"result": results, "result_error": []}}
+        if name == "disk.storage.get":
+            return 200, {"result": {"ID": "1", "NAME": "Shared drive", "ROOT_OBJECT_ID": self.root_folder_id}}
+        if name.startswith("disk.folder."):
+            params = json.loads(body or b"{}")
+            parent_id = str(params.get("id"))
+            if parent_id not in self._folders:
+                return 404, {"error": "ERROR_NOT_FOUND", "error_description": f"Folder {parent_id} not found"}
+            if name == "disk.folder.getchildren":
+                wanted = params.get("filter", {}).get("NAME")
+                children = [
+                    {"ID": folder_id, "NAME": folder_name, "TYPE": "folder"}
+                    for folder_id, (parent, folder_name) in list(self._folders.items())
+                    if parent == parent_id and folder_name == wanted
+                ]
+                return 200, {"result": children}
+            if name == "disk.folder.addsubfolder":
+                folder_id = str(self._new_id())
+                self._folders[folder_id] = (parent_id, params["data"]["NAME"])
+                return 200, {"result": {"ID": folder_id}}
+            if name == "disk.folder.uploadfile":
+                return 200, {"result": {"uploadUrl": f"{self.base_url}{BITRIX_PREFIX}/upload/{self._new_id()}"}}
+        if name == "disk.file.delete":
+            return 200, {"result": True}
+        if name.startswith("upload/"):
+            return self._receive_upload(name, body, headers or {})
+        return 404, {"error": "ERROR_METHOD_NOT_FOUND"}
+
+    def handle(self, method, url, body, headers=None):
+        """Route one request; returns ``(status, payload)`` where payload is JSON-able or bytes."""
+        parts = urlsplit(url)
+        query = parse_qs(parts.query)
+        if self.latency:
+            time.sleep(self.latency * self._random.uniform(0.5, 1.5))
+        if self.error_rate and self._random.random() < self.error_rate:
+            return 500, {"error": "injected failure"}
+
+        if parts.path.startswith(EIGHTX8_PREFIX):
+            path = parts.path[len(EIGHTX8_PREFIX):]
+            self.count(f"8x8 {path.split('/v3/')[-1].split('/')[0] if '/v3/' in path else path}")
+            return self.handle_8x8(method, path, query, body, headers)
+
+        if parts.path.startswith(BITRIX_PREFIX):
+            path = parts.path[len(BITRIX_PREFIX):]
+            self.count(f"bitrix {path.strip('/').split('/')[0]}")
+            if self._over_limit():
+                return 503, {"error": "QUERY_LIMIT_EXCEEDED", "error_description": "Too many requests"}
+            return self.handle_bitrix(method, path, query, body, headers)
+        return 404, {"error": "not found"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real APIs
+    disable_nagle_algorithm = True  # Headers and body are separate writes, don't add delayed-ACK stalls
+    fake = None
+
+    def _serve(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        status, payload = self.fake.handle(self.command, self.path, body, self.headers)
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/zip" if isinstance(payload, bytes) else "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = _serve
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
@@ -0,0 +1,240 @@
+import json
+import logging
+import os
+import re
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from recordings.fake_apis import FakeApis
+from recordings.models import Recording, SyncCheckpoint, SyncJob
+from recordings.services import api_service, bitrix_client, bitrix_folders, crm_lookup, http_client, metrics
+from recordings.services.rate_limit import TokenBucket
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+def _rss_bytes():
+    """Current resident set size, or the peak so far where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _disk_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # Removed while we were looking
+    return total
+
+
+class ResourceMonitor(threading.Thread):
+    """Samples RSS and the disk used under ``path`` until stopped, keeping the peaks."""
+
+    def __init__(self, path, interval=0.1):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.peak_rss = _rss_bytes()
+        self.peak_disk = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak_rss = max(self.peak_rss, _rss_bytes())
+            self.peak_disk = max(self.peak_disk, _disk_bytes(self.path))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the sync pipeline offline against local 8x8 and Bitrix24 stand-ins, "
+        "reporting recordings/sec, per-stage p50/p99, peak RSS and disk usage."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10,1000,10000", help="Comma-separated recording counts to run.")
+        parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every API call (±50%%).")
+        parser.add_argument(
+            "--error-rate", type=float, default=0.0,
+            help="Fraction of API calls that fail with a 500. Uploads and attach batches are not idempotent and "
+                 "not retried, so their recordings are reported as failed (a later sweep retries them).",
+        )
+        parser.add_argument(
+            "--bitrix-rate-limit", type=float, default=0,
+            help="Bitrix24 calls per second before QUERY_LIMIT_EXCEEDED (0: unlimited, client limiter off).",
+        )
+        parser.add_argument("--bulk-delay", type=float, default=0.5, help="Seconds until a bulk download is ready.")
+        parser.add_argument("--recording-bytes", type=int, default=32 * 1024, help="Size of each synthetic WAV.")
+        parser.add_argument("--lead-ratio", type=float, default=0.9, help="Fraction of numbers that match a lead.")
+        parser.add_argument(
+            "--fail-below", type=float, default=0,
+            help="Exit with an error when any run syncs fewer recordings/sec than this.",
+        )
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options["sizes"].split(",") if size.strip()]
+        workdir = tempfile.mkdtemp(prefix="recordings-benchmark-")
+        cwd = os.getcwd()
+        pipeline_logger = logging.getLogger("recordings")
+        log_level = pipeline_logger.level
+        if options["verbosity"] < 2:
+            pipeline_logger.setLevel(logging.WARNING)
+
+        # Never touch the real ledger: run against a throwaway test database
+        if connection.vendor == "sqlite":
+            connection.settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(workdir, "benchmark.sqlite3")
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        limiter = bitrix_client.limiter
+        try:
+            reports = [self._run(size, options, workdir) for size in sizes]
+        finally:
+            bitrix_client.limiter = limiter
+            os.chdir(cwd)
+            http_client.close_sessions()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            pipeline_logger.setLevel(log_level)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(reports, indent=2))
+        else:
+            for report in reports:
+                self._print_report(report)
+
+        # Every generated recording must be found, and without injected errors also synced
+        lost = [
+            r for r in reports
+            if r["summary"]["found"] != r["recordings"]
+            or (not options["error_rate"] and r["summary"]["attached"] + r["summary"]["no_lead"] != r["recordings"])
+        ]
+        if lost:
+            raise CommandError(
+                "Recordings went missing: "
+                + ", ".join(
+                    f"{r['summary']['found']} of {r['recordings']} found, "
+                    f"{r['summary']['attached'] + r['summary']['no_lead']} synced" for r in lost
+                )
+            )
+
+        slow = [r for r in reports if r["recordings_per_second"] < options["fail_below"]]
+        if slow:
+            raise CommandError(
+                "Throughput below --fail-below: "
+                + ", ".join(f"{r['recordings']} recordings at {r['recordings_per_second']}/s" for r in slow)
+            )
+
+    def _reset(self):
+        Recording.objects.all().delete()
+        SyncJob.objects.all().delete()
+        SyncCheckpoint.objects.all().delete()  # Each size starts with a full sweep
+        api_service._regions_cache.clear()
+        api_service.token_manager.invalidate()
+        crm_lookup.clear_cache()
+        bitrix_folders.invalidate()
+        http_client.reset_stats()
+        metrics.registry.clear()
+
+    def _run(self, size, options, workdir):
+        self._reset()
+        rate = options["bitrix_rate_limit"]
+        bitrix_client.limiter = TokenBucket(rate=rate, capacity=rate) if rate else TokenBucket(rate=1e9, capacity=1e9)
+
+        fake = FakeApis(
+            recordings=size,
+            latency=options["latency"],
+            error_rate=options["error_rate"],
+            bitrix_rate_limit=rate,
+            bulk_delay=options["bulk_delay"],
+            recording_bytes=options["recording_bytes"],
+            lead_ratio=options["lead_ratio"],
+        )
+        base_url = fake.start()
+        rundir = os.path.join(workdir, f"run-{size}")
+        os.makedirs(rundir)
+        os.chdir(rundir)  # Bulk ZIPs and extracted files land in the working directory
+
+        samples = defaultdict(list)
+        listener = lambda stage, seconds: samples[stage].append(seconds)  # noqa: E731
+        metrics.add_listener(listener)
+        monitor = ResourceMonitor(rundir)
+        monitor.start()
+        try:
+            with override_settings(
+                EIGHTX8_API_URL=f"{base_url}/8x8",
+                BITRIX24_API_URL=f"{base_url}/bitrix",
+                TRANSCRIBE_RECORDINGS=False,
+                TRANSCODE_RECORDINGS=False,
+                RECORDING_CACHE_DIR=os.path.join(workdir, f"cache-{size}"),  # Not the real cache, nor the disk peak
+            ):
+                started = time.perf_counter()
+                result = api_service.fetch_and_download_call_recordings()
+                elapsed = time.perf_counter() - started
+        finally:
+            monitor.stop()
+            metrics.remove_listener(listener)
+            fake.stop()
+
+        return {
+            "recordings": size,
+            "seconds": round(elapsed, 3),
+            "recordings_per_second": round(size / elapsed, 2) if elapsed else 0.0,
+            "peak_rss_mib": round(monitor.peak_rss / 2**20, 1),
+            "peak_disk_mib": round(monitor.peak_disk / 2**20, 1),
+            "uploaded_mib": round(fake.bytes_uploaded / 2**20, 1),
+            "summary": result["summary"],
+            "failures": dict(Counter(
+                re.sub(r"https?://[^/\s]+|/\d+", "", error)  # Group by the failed call, not by ID or port
+                for error in Recording.objects.filter(status=Recording.Status.FAILED).values_list("error", flat=True)
+            ).most_common()),
+            "stages": {
+                stage: {
+                    "count": len(values),
+                    "p50_ms": round(_percentile(values, 0.5) * 1000, 2),
+                    "p99_ms": round(_percentile(values, 0.99) * 1000, 2),
+                    "total_s": round(sum(values), 3),
+                }
+                for stage, values in sorted(samples.items())
+            },
+            "api_calls": dict(sorted(fake.calls.items())),
+        }
+
+    def _print_report(self, report):
+        summary = report["summary"]
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{report['recordings']} recordings: {report['recordings_per_second']}/s "
+            f"({report['seconds']}s), peak RSS {report['peak_rss_mib']} MiB, "
+            f"peak disk {report['peak_disk_mib']} MiB, uploaded {report['uploaded_mib']} MiB"
+        ))
+        self.stdout.write(
+            f"  found {summary['found']}, attached {summary['attached']}, no lead {summary['no_lead']}, "
+            f"duplicate {summary['duplicate']}, failed {summary['failed']}"
+        )
+        for reason, count in report["failures"].items():
+            self.stdout.write(f"    {count} failed: {reason}")
+        for stage, stats in report["stages"].items():
+            self.stdout.write(
+                f"  {stage:<12} n={stats['count']:<6} p50={stats['p50_ms']:>9.2f}ms "
+                f"p99={stats['p99_ms']:>9.2f}ms total={stats['total_s']:.2f}s"
+            )
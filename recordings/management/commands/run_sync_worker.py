@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recordings.services import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued recording sync and fetch jobs (started by the /recordings/ endpoints)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty.")
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.SYNC_JOB_POLL_INTERVAL,
+            help="Seconds to wait between queue checks when idle.",
+        )
+
+    def handle(self, *args, **options):
+        worker = jobs.worker_name()
+        self.stdout.write(f"Sync worker {worker} started")
+
+        while True:
+            jobs.requeue_stale_jobs()
+            job = jobs.claim_next_job(worker)
+            if job is None:
+                if options["once"]:
+                    return
+                time.sleep(options["poll_interval"])
+                continue
+
+            batch = jobs.claim_batch(job, worker)
+            self.stdout.write(f"Running {job}" + (f" with {len(batch)} batched jobs" if batch else ""))
+            jobs.run_job(job, batch)
+            job.refresh_from_db()
+            self.stdout.write(f"Finished {job}")
@@ -0,0 +1,150 @@
+import subprocess
+import sys
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone as django_timezone
+
+from recordings.models import SyncCheckpoint
+from recordings.services import api_service, ledger
+
+
+def _parse_time(value):
+    """``argparse`` type for --since/--until: an ISO 8601 date or date-time (UTC unless given)."""
+    parsed = ledger.parse_day_or_time(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+def _parse_shard(value):
+    """``argparse`` type for --shard: ``i/N`` with 0 <= i < N."""
+    index, _, count = value.partition("/")
+    index, count = int(index), int(count)
+    if not 0 <= index < count:
+        raise ValueError(value)
+    return index, count
+
+
+class Command(BaseCommand):
+    help = (
+        "Sync call recordings from 8x8 to Bitrix24 in this process, e.g. to backfill a date range. "
+        "Runs on several processes or hosts can share a backlog with --shard, and a backfill resumes "
+        "from its checkpoint after a crash."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", type=_parse_time, help="Sync recordings created from this date or time.")
+        parser.add_argument(
+            "--until", type=_parse_time,
+            help="Sync recordings created before this date or time (default: now). Needs --since.",
+        )
+        parser.add_argument(
+            "--region", action="append", dest="regions",
+            help="Only sync this 8x8 region (repeatable; default: all of them).",
+        )
+        parser.add_argument(
+            "--shard", type=_parse_shard,
+            help="Only sync the object IDs in shard i of N, written i/N (e.g. one per host).",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=1,
+            help="Split the work over this many processes, each taking a sub-shard.",
+        )
+        parser.add_argument(
+            "--slice-hours", type=float, default=24,
+            help="Sync a backfill in slices of this many hours, checkpointing after each.",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="Name of the checkpoint to resume from and update (default: derived from the arguments).",
+        )
+
+    def handle(self, *args, **options):
+        if options["until"] and not options["since"]:
+            raise CommandError("--until needs --since")
+        if options["workers"] < 1 or options["slice_hours"] <= 0:
+            raise CommandError("--workers and --slice-hours must be positive")
+
+        if options["workers"] > 1:
+            return self._spawn_workers(options)
+        if not options["since"]:
+            # Incremental sweep from each region's sweep checkpoint (see ledger.sweep_since)
+            self._report(self._sync(options))
+            return
+        self._backfill(options)
+
+    def _sync(self, options, since=None, until=None):
+        try:
+            return api_service.fetch_and_download_call_recordings(
+                since=since, until=until, regions=options["regions"], shard=options["shard"],
+            )
+        except Exception as e:
+            raise CommandError(f"Sync failed: {e}") from e
+
+    def _checkpoint_key(self, options):
+        if options["checkpoint"]:
+            return options["checkpoint"]
+        regions = ",".join(sorted(options["regions"] or ())) or "all"
+        shard = "{}/{}".format(*options["shard"]) if options["shard"] else "all"
+        return f"backfill since={ledger.format_8x8_time(options['since'])} regions={regions} shard={shard}"
+
+    def _backfill(self, options):
+        until = options["until"] or django_timezone.now()
+        key = self._checkpoint_key(options)
+        checkpoint = SyncCheckpoint.objects.filter(key=key).first()
+        position = options["since"]
+        if checkpoint and checkpoint.position > position:
+            position = checkpoint.position
+            self.stdout.write(f"Resuming {key} from {position:%Y-%m-%d %H:%M:%S}")
+
+        step = timedelta(hours=options["slice_hours"])
+        while position < until:
+            end = min(position + step, until)
+            self.stdout.write(f"Syncing {position:%Y-%m-%d %H:%M:%S} to {end:%Y-%m-%d %H:%M:%S}")
+            result = self._sync(options, since=position, until=end)
+            self._report(result)
+            if any("error" in summary for summary in result["regions"].values()):
+                raise CommandError(f"A region failed, {key} stays at {position:%Y-%m-%d %H:%M:%S}; rerun to resume")
+            position = end
+            SyncCheckpoint.objects.update_or_create(
+                key=key, defaults={"position": position, "finished": position >= until},
+            )
+        self.stdout.write(self.style.SUCCESS(f"Backfill {key} done up to {until:%Y-%m-%d %H:%M:%S}"))
+
+    def _spawn_workers(self, options):
+        """Run ``--workers`` copies of this command, each on its own sub-shard of ``--shard``."""
+        index, count = options["shard"] or (0, 1)
+        workers = options["workers"]
+        base = [sys.executable, str(settings.BASE_DIR / "manage.py"), "sync_recordings", "--workers", "1"]
+        if options["since"]:
+            # Pin --until so the workers (and a resumed run) agree on the range
+            until = options["until"] or django_timezone.now()
+            base += ["--since", options["since"].isoformat(), "--until", until.isoformat()]
+        for region in options["regions"] or ():
+            base += ["--region", region]
+        base += ["--slice-hours", str(options["slice_hours"]), "--verbosity", str(options["verbosity"])]
+
+        processes = []
+        for k in range(workers):
+            shard = f"{index + k * count}/{count * workers}"  # A sub-shard of index/count
+            command = base + ["--shard", shard]
+            if options["checkpoint"]:
+                command += ["--checkpoint", f"{options['checkpoint']} shard={shard}"]
+            processes.append((shard, subprocess.Popen(command)))
+
+        failed = [shard for shard, process in processes if process.wait() != 0]
+        if failed:
+            raise CommandError(f"Workers for shards {', '.join(failed)} failed; rerun to resume them")
+        self.stdout.write(self.style.SUCCESS(f"All {workers} workers finished"))
+
+    def _report(self, result):
+        summary = result["summary"]
+        self.stdout.write(
+            f"  found {summary['found']}, skipped {summary['skipped']}, attached {summary['attached']}, "
+            f"no lead {summary['no_lead']}, duplicate {summary['duplicate']}, failed {summary['failed']}"
+        )
+        for region, region_summary in result["regions"].items():
+            if "error" in region_summary:
+                self.stderr.write(f"  {region}: {region_summary['error']}")
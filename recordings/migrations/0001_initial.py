@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Recording',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.CharField(max_length=64, unique=True)),
+                ('region', models.CharField(max_length=32)),
+                ('object_name', models.CharField(blank=True, max_length=255)),
+                ('phone_number', models.CharField(blank=True, max_length=32)),
+                ('size', models.BigIntegerField(blank=True, null=True)),
+                ('checksum', models.CharField(blank=True, max_length=64)),
+                ('created_time', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('downloaded', 'Downloaded'), ('uploaded', 'Uploaded'), ('attached', 'Attached'), ('no_lead', 'No matching lead'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('error', models.TextField(blank=True)),
+                ('bitrix_file_id', models.CharField(blank=True, max_length=32)),
+                ('bitrix_lead_id', models.CharField(blank=True, max_length=32)),
+                ('found_at', models.DateTimeField(auto_now_add=True)),
+                ('downloaded_at', models.DateTimeField(blank=True, null=True)),
+                ('uploaded_at', models.DateTimeField(blank=True, null=True)),
+                ('attached_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['region', 'created_time'], name='recordings__region_e10aa1_idx'), models.Index(fields=['status'], name='recordings__status_a2963b_idx'), models.Index(fields=['phone_number'], name='recordings__phone_n_de4a21_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recordings', '0002_syncjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recording',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
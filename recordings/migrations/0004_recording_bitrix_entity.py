@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:27
+
+from django.db import migrations, models
+
+
+def mark_existing_as_leads(apps, schema_editor):
+    # Before contacts/deals were supported every attached recording belonged to a lead
+    Recording = apps.get_model('recordings', 'Recording')
+    Recording.objects.exclude(bitrix_entity_id='').update(bitrix_entity_type='lead')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recordings', '0003_recording_attempts'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='recording',
+            old_name='bitrix_lead_id',
+            new_name='bitrix_entity_id',
+        ),
+        migrations.AddField(
+            model_name='recording',
+            name='bitrix_entity_type',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.RunPython(mark_existing_as_leads, migrations.RunPython.noop),
+    ]
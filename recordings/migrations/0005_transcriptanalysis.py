@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recordings', '0004_recording_bitrix_entity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranscriptAnalysis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('model', models.CharField(max_length=64)),
+                ('sentiment', models.CharField(max_length=16)),
+                ('score', models.FloatField(blank=True, null=True)),
+                ('feedback', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recordings', '0005_transcriptanalysis'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recording',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('downloaded', 'Downloaded'), ('uploaded', 'Uploaded'), ('attached', 'Attached'), ('no_lead', 'No matching lead'), ('duplicate', 'Duplicate audio'), ('failed', 'Failed')], default='pending', max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='recording',
+            index=models.Index(fields=['checksum'], name='recordings__checksu_91f48a_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recordings', '0006_recording_duplicate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncjob',
+            name='run_after',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recordings', '0010_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Transcript',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone_number', models.CharField(blank=True, max_length=32)),
+                ('entity_type', models.CharField(blank=True, max_length=16)),
+                ('entity_id', models.CharField(blank=True, max_length=32)),
+                ('call_time', models.DateTimeField(blank=True, null=True)),
+                ('text', models.TextField()),
+                ('sentiment', models.CharField(blank=True, max_length=16)),
+                ('score', models.FloatField(blank=True, null=True)),
+                ('feedback', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('recording', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='transcript', to='recordings.recording')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['call_time'], name='recordings__call_ti_099d1d_idx'), models.Index(fields=['phone_number', 'call_time'], name='recordings__phone_n_67f408_idx'), models.Index(fields=['entity_id', 'call_time'], name='recordings__entity__7b56cf_idx'), models.Index(fields=['sentiment', 'call_time'], name='recordings__sentime_9d972c_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:47
+
+from django.db import migrations
+
+# FTS5 index over Transcript.text and .feedback, with prefix indexes so
+# ``word*`` searches stay fast. It is an external-content table, so the
+# triggers keep it in step with recordings_transcript.
+CREATE_FTS = [
+    """
+    CREATE VIRTUAL TABLE recordings_transcript_fts USING fts5(
+        text, feedback,
+        content='recordings_transcript', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+    )
+    """,
+    """
+    CREATE TRIGGER recordings_transcript_fts_insert AFTER INSERT ON recordings_transcript BEGIN
+        INSERT INTO recordings_transcript_fts(rowid, text, feedback) VALUES (new.id, new.text, new.feedback);
+    END
+    """,
+    """
+    CREATE TRIGGER recordings_transcript_fts_delete AFTER DELETE ON recordings_transcript BEGIN
+        INSERT INTO recordings_transcript_fts(recordings_transcript_fts, rowid, text, feedback)
+        VALUES ('delete', old.id, old.text, old.feedback);
+    END
+    """,
+    """
+    CREATE TRIGGER recordings_transcript_fts_update AFTER UPDATE ON recordings_transcript BEGIN
+        INSERT INTO recordings_transcript_fts(recordings_transcript_fts, rowid, text, feedback)
+        VALUES ('delete', old.id, old.text, old.feedback);
+        INSERT INTO recordings_transcript_fts(rowid, text, feedback) VALUES (new.id, new.text, new.feedback);
+    END
+    """,
+    "INSERT INTO recordings_transcript_fts(recordings_transcript_fts) VALUES ('rebuild')",
+]
+
+DROP_FTS = [
+    "DROP TRIGGER IF EXISTS recordings_transcript_fts_update",
+    "DROP TRIGGER IF EXISTS recordings_transcript_fts_delete",
+    "DROP TRIGGER IF EXISTS recordings_transcript_fts_insert",
+    "DROP TABLE IF EXISTS recordings_transcript_fts",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != "sqlite":
+            return  # Other databases fall back to plain lookups (see services/transcripts.py)
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recordings', '0011_transcript'),
+    ]
+
+    operations = [
+        migrations.RunPython(_run(CREATE_FTS), _run(DROP_FTS)),
+    ]
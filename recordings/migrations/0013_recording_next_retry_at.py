@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recordings', '0012_transcript_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recording',
+            name='next_retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recordings', '0013_recording_next_retry_at'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='syncjob',
+            name='unique_active_sync_job',
+        ),
+        migrations.AddField(
+            model_name='syncjob',
+            name='kind',
+            field=models.CharField(choices=[('sync', 'Sync'), ('fetch', 'Fetch')], default='sync', max_length=16),
+        ),
+        migrations.AddConstraint(
+            model_name='syncjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('kind', 'object_id'), name='unique_active_sync_job'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:41
+
+from django.db import migrations
+
+# Read-only view of the words in recordings_transcript_fts, used to expand
+# ``word*`` searches into the (few) words they stand for. A prefix query that
+# FTS5 resolves itself merges the whole doclist of every matching word on
+# each lookup, which is what made prefix searches take seconds.
+CREATE_VOCAB = [
+    "CREATE VIRTUAL TABLE recordings_transcript_fts_vocab USING fts5vocab(recordings_transcript_fts, 'row')",
+]
+
+DROP_VOCAB = [
+    "DROP TABLE IF EXISTS recordings_transcript_fts_vocab",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != "sqlite":
+            return  # Other databases fall back to plain lookups (see services/transcripts.py)
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recordings', '0014_syncjob_kind'),
+    ]
+
+    operations = [
+        migrations.RunPython(_run(CREATE_VOCAB), _run(DROP_VOCAB)),
+    ]
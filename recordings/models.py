@@ -1,3 +1,208 @@
 from django.db import models
 
-# Create your models here.
+
+class Recording(models.Model):
+    """Ledger entry for one 8x8 call recording and how far it got through the sync."""
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        DOWNLOADED = "downloaded", "Downloaded"
+        UPLOADED = "uploaded", "Uploaded"
+        ATTACHED = "attached", "Attached"
+        NO_LEAD = "no_lead", "No matching lead"
+        DUPLICATE = "duplicate", "Duplicate audio"
+        FAILED = "failed", "Failed"
+
+    # Statuses a sweep no longer asks 8x8 for; failed ones get a separate retry pass
+    DONE_STATUSES = (Status.ATTACHED, Status.NO_LEAD, Status.DUPLICATE, Status.FAILED)
+
+    object_id = models.CharField(max_length=64, unique=True)
+    region = models.CharField(max_length=32)
+    object_name = models.CharField(max_length=255, blank=True)
+    phone_number = models.CharField(max_length=32, blank=True)
+    size = models.BigIntegerField(null=True, blank=True)
+    checksum = models.CharField(max_length=64, blank=True)  # SHA-256 of the audio, used to skip duplicates
+    created_time = models.DateTimeField(null=True, blank=True)  # When 8x8 created the recording
+
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)  # Failed attempts, retried up to SYNC_MAX_ATTEMPTS
+    next_retry_at = models.DateTimeField(null=True, blank=True)  # A failed recording is not retried before this
+    bitrix_file_id = models.CharField(max_length=32, blank=True)
+    bitrix_entity_type = models.CharField(max_length=16, blank=True)  # lead, contact or deal
+    bitrix_entity_id = models.CharField(max_length=32, blank=True)
+
+    # Set while a sync run works on the recording, so concurrent runs skip it
+    leased_by = models.CharField(max_length=128, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+
+    found_at = models.DateTimeField(auto_now_add=True)
+    downloaded_at = models.DateTimeField(null=True, blank=True)
+    uploaded_at = models.DateTimeField(null=True, blank=True)
+    attached_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["region", "created_time"]),
+            models.Index(fields=["status"]),
+            models.Index(fields=["phone_number"]),
+            models.Index(fields=["checksum"]),
+        ]
+
+    def __str__(self):
+        return f"{self.object_id} ({self.status})"
+
+
+class SyncCheckpoint(models.Model):
+    """How far a ``sync_recordings`` backfill or a region's regular sweeps got, so the next run continues from there."""
+
+    key = models.CharField(max_length=255, unique=True)
+    position = models.DateTimeField()  # Everything created before this has been synced
+    finished = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key} at {self.position}"
+
+
+class SyncJob(models.Model):
+    """A queued run of the sync pipeline, executed by the ``run_sync_worker`` command.
+
+    A fetch job instead downloads one recording into the recording cache.
+    """
+
+    class Kind(models.TextChoices):
+        SYNC = "sync", "Sync"
+        FETCH = "fetch", "Fetch"  # Download one recording for /recordings/recording/<id>/
+
+    class Status(models.TextChoices):
+        QUEUED = "queued", "Queued"
+        RUNNING = "running", "Running"
+        DONE = "done", "Done"
+        FAILED = "failed", "Failed"
+
+    ACTIVE_STATUSES = (Status.QUEUED, Status.RUNNING)
+
+    kind = models.CharField(max_length=16, choices=Kind.choices, default=Kind.SYNC)
+    object_id = models.CharField(max_length=64, blank=True)  # Empty for a full sweep
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.QUEUED)
+    worker = models.CharField(max_length=128, blank=True)
+    run_after = models.DateTimeField(null=True, blank=True)  # Webhook jobs wait for others to join their batch
+
+    found = models.PositiveIntegerField(default=0)
+    downloaded = models.PositiveIntegerField(default=0)
+    uploaded = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "created_at"])]
+        constraints = [
+            # At most one queued/running job per target, so duplicate triggers coalesce
+            models.UniqueConstraint(
+                fields=["kind", "object_id"],
+                condition=models.Q(status__in=["queued", "running"]),
+                name="unique_active_sync_job",
+            ),
+        ]
+
+    def __str__(self):
+        kind = "" if self.kind == self.Kind.SYNC else f"{self.kind} "
+        return f"SyncJob {self.pk} {kind}{self.object_id or 'sweep'} ({self.status})"
+
+    def as_dict(self):
+        return {
+            "id": self.pk,
+            "kind": self.kind,
+            "object_id": self.object_id or None,
+            "status": self.status,
+            "found": self.found,
+            "downloaded": self.downloaded,
+            "uploaded": self.uploaded,
+            "failed": self.failed,
+            "error": self.error or None,
+            "result": self.result,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class TranscriptAnalysis(models.Model):
+    """Cached AI analysis of a transcript, keyed by a hash of the transcript and prompt."""
+
+    content_hash = models.CharField(max_length=64, unique=True)
+    model = models.CharField(max_length=64)
+    sentiment = models.CharField(max_length=16)
+    score = models.FloatField(null=True, blank=True)  # -1 (very negative) to 1 (very positive)
+    feedback = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.content_hash[:12]} ({self.sentiment})"
+
+    def as_dict(self):
+        return {"sentiment": self.sentiment, "score": self.score, "feedback": self.feedback}
+
+
+class Transcript(models.Model):
+    """Transcript and AI feedback of a synced recording, searchable through /recordings/search/.
+
+    On SQLite the text and feedback are full-text indexed in the
+    ``recordings_transcript_fts`` FTS5 table, kept in sync by triggers.
+    """
+
+    recording = models.OneToOneField(Recording, on_delete=models.CASCADE, related_name="transcript")
+    phone_number = models.CharField(max_length=32, blank=True)
+    entity_type = models.CharField(max_length=16, blank=True)  # lead, contact or deal
+    entity_id = models.CharField(max_length=32, blank=True)
+    call_time = models.DateTimeField(null=True, blank=True)
+    text = models.TextField()
+    sentiment = models.CharField(max_length=16, blank=True)
+    score = models.FloatField(null=True, blank=True)
+    feedback = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["call_time"]),
+            models.Index(fields=["phone_number", "call_time"]),
+            models.Index(fields=["entity_id", "call_time"]),
+            models.Index(fields=["sentiment", "call_time"]),
+        ]
+
+    def __str__(self):
+        return f"Transcript of {self.recording_id} ({self.sentiment or 'not analyzed'})"
+
+
+class MetricsSnapshot(models.Model):
+    """The latest metrics of a sync worker process, exposed by the web process's metrics endpoint."""
+
+    worker = models.CharField(max_length=128, unique=True)
+    data = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Metrics of {self.worker}"
+
+
+class UploadSession(models.Model):
+    """Progress of a chunked Bitrix24 upload, so an interrupted one resumes instead of restarting."""
+
+    key = models.CharField(max_length=255, unique=True)  # Folder path and upload name
+    upload_url = models.TextField()
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)  # Bytes Bitrix24 has acknowledged
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.offset}/{self.size} bytes)"
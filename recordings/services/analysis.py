@@ -0,0 +1,149 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+from django.conf import settings
+from django.db import IntegrityError, connection
+
+from ..models import TranscriptAnalysis
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+PROMPT_VERSION = "1"  # Bump when the prompt changes so cached results are not reused
+
+SYSTEM_PROMPT = "You are an AI call feedback analyzer and sentiment analysis expert."
+
+ANALYSIS_PROMPT = """
+Analyze this customer service call transcript.
+
+Return only a JSON object with these keys:
+- "sentiment": "Positive", "Neutral" or "Negative"
+- "score": a number from -1 (very negative) to 1 (very positive)
+- "feedback": detailed feedback covering where the agent could improve, whether
+  the agent was polite, clear and helpful, whether the customer's concerns were
+  properly addressed, and suggestions to improve the customer experience.
+
+Transcript:
+{transcript}
+"""
+
+SUMMARY_PROMPT = """
+Summarize this part of a customer service call. Keep what the customer asked
+for, how the agent responded, the tone of both sides and how it ended.
+
+Transcript part:
+{transcript}
+"""
+
+_api_slots = threading.BoundedSemaphore(settings.ANALYSIS_CONCURRENCY)
+
+
+def _chat(prompt):
+    with _api_slots:
+        response = openai.ChatCompletion.create(
+            model=settings.ANALYSIS_MODEL,
+            api_key=settings.OPENAI_API_KEY,
+            messages=[{"role": "system", "content": SYSTEM_PROMPT},
+                      {"role": "user", "content": prompt}],
+        )
+    return response["choices"][0]["message"]["content"]
+
+
+def content_hash(transcript):
+    key = f"{settings.ANALYSIS_MODEL}:{PROMPT_VERSION}:{settings.ANALYSIS_OVERFLOW}:{transcript}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _fit_to_budget(transcript):
+    """Shorten a transcript that would not fit ANALYSIS_MAX_CHARS.
+
+    "truncate" keeps the start and the end of the call, "summarize" summarizes
+    each part concurrently and analyzes the joined summaries.
+    """
+    budget = settings.ANALYSIS_MAX_CHARS
+    if len(transcript) <= budget:
+        return transcript
+
+    if settings.ANALYSIS_OVERFLOW == "summarize":
+        parts = [transcript[i:i + budget] for i in range(0, len(transcript), budget)]
+        with ThreadPoolExecutor(max_workers=settings.ANALYSIS_CONCURRENCY) as executor:
+            summaries = list(executor.map(lambda part: _chat(SUMMARY_PROMPT.format(transcript=part)), parts))
+        return _fit_to_budget("\n\n".join(f"Part {i + 1}: {summary}" for i, summary in enumerate(summaries)))
+
+    half = budget // 2
+    return f"{transcript[:half]}\n[... middle of the call omitted ...]\n{transcript[-half:]}"
+
+
+def _parse(content):
+    """Read the JSON object out of the model's reply, tolerating surrounding prose."""
+    match = re.search(r"\{.*\}", content, re.DOTALL)
+    try:
+        data = json.loads(match.group(0) if match else content)
+    except ValueError:
+        return {"sentiment": "Unknown", "score": None, "feedback": content.strip()}
+
+    try:
+        score = max(-1.0, min(1.0, float(data.get("score"))))
+    except (TypeError, ValueError):
+        score = None
+    return {
+        "sentiment": str(data.get("sentiment", "Unknown"))[:16],
+        "score": score,
+        "feedback": str(data.get("feedback", "")),
+    }
+
+
+def analyze(transcript):
+    """Return ``{"sentiment", "score", "feedback"}`` for a transcript with a single API call.
+
+    Results are cached in the database by content hash, so a recording that
+    is processed again is never billed twice.
+    """
+    return analyze_many([transcript])[0]
+
+
+def analyze_many(transcripts):
+    """Analyze many transcripts, ANALYSIS_CONCURRENCY at a time. Returns results in order.
+
+    Identical transcripts are analyzed once, cached ones not at all. A
+    transcript whose analysis fails gets None.
+    """
+    hashes = [content_hash(transcript) for transcript in transcripts]
+    cached = {
+        analysis.content_hash: analysis.as_dict()
+        for analysis in TranscriptAnalysis.objects.filter(content_hash__in=set(hashes))
+    }
+    pending = {h: t for h, t in zip(hashes, transcripts) if h not in cached}
+
+    def run(item):
+        digest, transcript = item
+        try:
+            with metrics.span("analyze"):
+                result = _parse(_chat(ANALYSIS_PROMPT.format(transcript=_fit_to_budget(transcript))))
+            try:
+                TranscriptAnalysis.objects.create(content_hash=digest, model=settings.ANALYSIS_MODEL, **result)
+            except IntegrityError:
+                pass  # Another worker cached the same transcript first
+            return digest, result
+        except Exception as e:
+            logger.error(f"Error analyzing transcript: {e}", exc_info=True)
+            return digest, None
+        finally:
+            connection.close()
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=settings.ANALYSIS_CONCURRENCY) as executor:
+            cached.update(executor.map(run, pending.items()))
+
+    return [cached.get(digest) for digest in hashes]
+
+
+def format_feedback(result):
+    """Render an analysis as the text posted to the CRM timeline."""
+    score = f" ({result['score']:+.2f})" if result.get("score") is not None else ""
+    return f"Sentiment: {result['sentiment']}{score}\n\nFeedback:\n{result['feedback']}"
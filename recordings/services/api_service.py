@@ -4,81 +4,164 @@ import time
 import logging
 import os
 import zipfile
-import openai
 import re
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from . import analysis, bitrix_batch, bitrix_client, bitrix_folders, bitrix_upload, crm_lookup, http_client, ledger, metrics, pipeline, recording_cache, transcode, transcription, transcripts, zip_stream
+from .auth import TokenManager
+from .cache import TTLCache
+from ..models import Recording
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
 EXTRACTED_FILES_DIR = "extracted_files"  # Folder where extracted files should be stored
+BULK_FAILED_STATES = {"FAILED", "ERROR", "CANCELLED", "EXPIRED"}
 
-def get_access_token():
-    """Fetch an access token from 8x8 API using client credentials."""
-    try:
-        url = "https://api.8x8.com/oauth/v2/token"
-        credentials = f"{settings.CLIENT_ID}:{settings.SECRET}"
-        encoded_credentials = base64.b64encode(credentials.encode()).decode()
+class BulkDownloadError(Exception):
+    """An 8x8 bulk download job failed or did not finish in time."""
 
-        headers = {
-            "Authorization": f"Basic {encoded_credentials}",
-            "Content-Type": "application/x-www-form-urlencoded",
-        }
+@metrics.timed("token")
+def _request_access_token():
+    """Fetch a new access token from 8x8 API using client credentials."""
+    url = f"{settings.EIGHTX8_API_URL}/oauth/v2/token"
+    credentials = f"{settings.CLIENT_ID}:{settings.SECRET}"
+    encoded_credentials = base64.b64encode(credentials.encode()).decode()
+
+    headers = {
+        "Authorization": f"Basic {encoded_credentials}",
+        "Content-Type": "application/x-www-form-urlencoded",
+    }
+
+    data = {"grant_type": "client_credentials"}
+    response = http_client.post(url, headers=headers, data=data, idempotent=True)
+    response.raise_for_status()
+
+    token_data = response.json()
+    return token_data.get("access_token"), int(token_data.get("expires_in", 1800))
 
-        data = {"grant_type": "client_credentials"}
-        response = requests.post(url, headers=headers, data=data)
-        response.raise_for_status()
+token_manager = TokenManager(
+    _request_access_token,
+    refresh_margin=settings.TOKEN_REFRESH_MARGIN,
+    shared_cache_key="8x8:access_token" if settings.TOKEN_SHARED_CACHE else None,
+)
+_regions_cache = TTLCache(ttl=settings.REGIONS_CACHE_TTL, maxsize=1)
 
-        access_token = response.json().get("access_token")
-        print(f"Access Token: {access_token}")  # Print access token for debugging
-        return access_token
+def get_access_token():
+    """Return a cached 8x8 access token, refreshing it ahead of expiry."""
+    try:
+        return token_manager.get_token()
     except Exception as e:
         logger.error(f"Error fetching access token: {e}", exc_info=True)
         raise
 
+def _request_8x8(method, url, token=None, headers=None, **kwargs):
+    """Call an 8x8 endpoint, retrying once with a fresh token on a 401."""
+    token = token or token_manager.get_token()
+    for attempt in range(2):
+        request_headers = {**(headers or {}), "Authorization": f"Bearer {token}"}
+        response = http_client.request(method, url, headers=request_headers, **kwargs)
+        if response.status_code != 401 or attempt:
+            break
+        token_manager.invalidate(token)
+        token = token_manager.get_token()
+
+    response.raise_for_status()
+    return response
+
 def get_my_regions(token):
-    """Retrieve available regions for the 8x8 account."""
+    """Retrieve available regions for the 8x8 account (cached, they rarely change)."""
     try:
-        url = f"https://api.8x8.com/storage/{settings.REGION}/v3/regions"
-        headers = {"Authorization": f"Bearer {token}", "Accept": "application/json"}
+        regions = _regions_cache.get("regions")
+        if regions is not None:
+            return regions
 
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
+        url = f"{settings.EIGHTX8_API_URL}/storage/{settings.REGION}/v3/regions"
+        response = _request_8x8("GET", url, token, headers={"Accept": "application/json"})
 
         regions = response.json()
-        print(f"Regions: {regions}")  # Print regions for debugging
+        _regions_cache.set("regions", regions)
+        logger.debug(f"Regions: {regions}")
         return regions
     except Exception as e:
         logger.error(f"Error fetching regions: {e}", exc_info=True)
         raise
 
-def find_objects(token, region, filter_query):
-    """Find objects in a specific region."""
+@metrics.timed("find")
+def find_objects(token, region, filter_query, page=None, page_size=None):
+    """Find objects in a specific region (one page of results)."""
     try:
-        url = f"https://api.8x8.com/storage/{region}/v3/objects"
-        headers = {"Authorization": f"Bearer {token}", "Accept": "application/json"}
-
+        url = f"{settings.EIGHTX8_API_URL}/storage/{region}/v3/objects"
         params = {"filter": filter_query}
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
+        if page is not None:
+            params.update({"page": page, "size": page_size or settings.OBJECTS_PAGE_SIZE})
+        response = _request_8x8("GET", url, token, headers={"Accept": "application/json"}, params=params)
 
-        print(f"Objects Found: {response.json()}")  # Print found objects for debugging
-        return response.json()
+        result = response.json()
+        logger.debug(f"Objects Found: {len(result.get('content', []))} (page {page})")
+        return result
     except Exception as e:
         logger.error(f"Error finding objects: {e}", exc_info=True)
         raise
 
+def build_filter_query(object_id=None, since=None, until=None):
+    """Build the 8x8 objects filter for one object, a list of objects or a ``createdTime`` window."""
+    if isinstance(object_id, (list, tuple)):
+        return f"id=in=({','.join(object_id)})"
+    if object_id:
+        return f"id=={object_id}"
+
+    filter_query = "type==callcenterrecording,objectState==AVAILABLE"
+    if since:
+        filter_query += f",createdTime>={ledger.format_8x8_time(since)}"
+    if until:
+        filter_query += f",createdTime<{ledger.format_8x8_time(until)}"
+    return filter_query
+
+def iter_object_pages(token, region, filter_query, page_size=None):
+    """Yield each page of matching objects, fetching the next page in the background.
+
+    The caller can start working on (e.g. bulk-downloading) a page while the
+    following one is still in flight.
+    """
+    page_size = page_size or settings.OBJECTS_PAGE_SIZE
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        page = 0
+        future = prefetcher.submit(find_objects, token, region, filter_query, page, page_size)
+        while future is not None:
+            response = future.result()
+            content = response.get("content", [])
+
+            if "last" in response:
+                has_more = not response["last"]
+            elif "totalPages" in response:
+                has_more = page + 1 < response["totalPages"]
+            else:
+                has_more = len(content) >= page_size
+
+            page += 1
+            future = prefetcher.submit(find_objects, token, region, filter_query, page, page_size) if has_more and content else None
+            if content:
+                yield content
+
+def iter_objects(token, region, filter_query, page_size=None):
+    """Yield matching objects one by one across all pages."""
+    for content in iter_object_pages(token, region, filter_query, page_size):
+        yield from content
+
 def create_bulk_download(token, region, object_ids):
     """Create a bulk download job."""
     try:
-        url = f"https://api.8x8.com/storage/{region}/v3/bulk/download/start"
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-
-        response = requests.post(url, headers=headers, json=object_ids)
-        response.raise_for_status()
+        url = f"{settings.EIGHTX8_API_URL}/storage/{region}/v3/bulk/download/start"
+        response = _request_8x8("POST", url, token, json=object_ids)
 
         zip_name = response.json().get("zipName")
-        print(f"Bulk Download Zip Name: {zip_name}")  # Print ZIP name for debugging
+        logger.debug(f"Bulk Download Zip Name: {zip_name}")
         return response.json()
     except Exception as e:
         logger.error(f"Error creating bulk download: {e}", exc_info=True)
@@ -87,41 +170,101 @@ def create_bulk_download(token, region, object_ids):
 def check_download_status(token, region, zip_name):
     """Check the status of a bulk download job."""
     try:
-        url = f"https://api.8x8.com/storage/{region}/v3/bulk/download/status/{zip_name}"
-        headers = {"Authorization": f"Bearer {token}", "Accept": "application/json"}
-
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-
-        print(f"Download Status: {response.json()}")  # Print download status for debugging
-        return response.json()
+        url = f"{settings.EIGHTX8_API_URL}/storage/{region}/v3/bulk/download/status/{zip_name}"
+        response = _request_8x8("GET", url, token, headers={"Accept": "application/json"})
+
+        status = response.json()
+        if "Retry-After" in response.headers:
+            status.setdefault("retryAfter", response.headers["Retry-After"])
+        logger.debug(f"Download Status: {status}")
+        return status
     except Exception as e:
         logger.error(f"Error checking download status: {e}", exc_info=True)
         raise
 
+@metrics.timed("download")
 def download_zip_file(token, region, zip_name):
     """Download a completed bulk download ZIP file and save it."""
+    zip_path = os.path.join(os.getcwd(), zip_name)
     try:
-        url = f"https://api.8x8.com/storage/{region}/v3/bulk/download/{zip_name}"
-        headers = {"Authorization": f"Bearer {token}", "Accept": "application/json"}
-
-        response = requests.get(url, headers=headers, stream=True)
-        response.raise_for_status()
-
-        zip_path = os.path.join(os.getcwd(), zip_name)
+        url = f"{settings.EIGHTX8_API_URL}/storage/{region}/v3/bulk/download/{zip_name}"
+        response = _request_8x8("GET", url, token, headers={"Accept": "application/json"}, stream=True)
 
         with open(zip_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
+            for chunk in response.iter_content(chunk_size=settings.DOWNLOAD_CHUNK_SIZE):
                 f.write(chunk)
+                metrics.add_bytes("download", len(chunk))
 
-        print(f"Downloaded Zip File: {zip_path}")  # Print zip file path for debugging
+        logger.info(f"Downloaded Zip File: {zip_path}")
         return zip_path
     except Exception as e:
         logger.error(f"Error downloading zip file: {e}", exc_info=True)
+        zip_stream.cleanup(zip_path)  # Don't leave a partial ZIP behind
         raise
 
-def extract_zip_file(zip_path):
-    """Extract the downloaded ZIP file and rename MP3 and WAV files."""
+@metrics.timed("bulk_wait")
+def wait_for_bulk_download(token, region, zip_name):
+    """Poll a bulk download job until it is DONE, backing off exponentially.
+
+    Polling starts at BULK_POLL_INITIAL seconds and doubles up to BULK_POLL_MAX,
+    unless the server suggests its own interval. Raises BulkDownloadError when
+    the job fails or BULK_POLL_TIMEOUT runs out.
+    """
+    interval = settings.BULK_POLL_INITIAL
+    deadline = time.monotonic() + settings.BULK_POLL_TIMEOUT
+
+    while True:
+        status = check_download_status(token, region, zip_name)
+        state = status.get("status")
+        if state == "DONE":
+            return status
+        if state in BULK_FAILED_STATES:
+            raise BulkDownloadError(f"Bulk download {zip_name} ended with status {state}")
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise BulkDownloadError(f"Bulk download {zip_name} not ready after {settings.BULK_POLL_TIMEOUT}s")
+
+        try:
+            delay = float(status.get("retryAfter") or interval)
+        except (TypeError, ValueError):
+            delay = interval
+        time.sleep(min(delay, remaining))
+        interval = min(interval * 2, settings.BULK_POLL_MAX)
+
+def _bulk_download_chunk(token, region, object_ids):
+    """Start, await and download one bulk download job. Returns the ZIP path."""
+    with metrics.in_flight("bulk_download"):
+        zip_name = create_bulk_download(token, region, object_ids).get("zipName")
+        if not zip_name:
+            raise BulkDownloadError("Bulk download did not return a zipName")
+        wait_for_bulk_download(token, region, zip_name)
+        return download_zip_file(token, region, zip_name)
+
+def fetch_recording(object_id):
+    """Download one recording from 8x8 into the recording cache and return its cached path.
+
+    Only recordings in the ledger are fetched, from the region it recorded
+    for them. Returns None when the ledger or 8x8 has no such recording.
+    """
+    region = Recording.objects.filter(object_id=object_id).values_list("region", flat=True).first()
+    if not region:
+        return None
+    token = get_access_token()
+    if not next(iter_objects(token, region, build_filter_query(object_id)), None):
+        return None
+    zip_path = _bulk_download_chunk(token, region, [object_id])
+    try:
+        member = next(zip_stream.iter_audio_members(zip_path), None)
+        if member is None:
+            raise BulkDownloadError(f"Bulk download of {object_id} contained no audio")
+        recording_cache.evict()  # Before adding, so the new file survives even a tiny cache
+        return recording_cache.put(object_id, member)
+    finally:
+        zip_stream.cleanup(zip_path)
+
+def extract_zip_file(zip_path, rename=True):
+    """Extract the downloaded ZIP file and (unless ``rename`` is False) rename MP3 and WAV files."""
     try:
         zip_name = os.path.splitext(os.path.basename(zip_path))[0]
         extract_path = os.path.join(EXTRACTED_FILES_DIR, zip_name)
@@ -131,257 +274,658 @@ def extract_zip_file(zip_path):
         with zipfile.ZipFile(zip_path, "r") as zip_ref:
             zip_ref.extractall(extract_path)
 
-        rename_audio_files(extract_path)  # Call function to rename files
+        if rename:
+            rename_audio_files(extract_path)  # Call function to rename files
 
-        print(f"Extracted Files Path: {extract_path}")  # Print extracted files path for debugging
+        logger.debug(f"Extracted Files Path: {extract_path}")
         return extract_path
     except Exception as e:
         logger.error(f"Error extracting zip file: {e}", exc_info=True)
         raise
 
 def rename_audio_files(extract_path):
-    """Rename MP3 and WAV files to keep only the phone number."""
-    for file in os.listdir(extract_path):
+    """Rename MP3 and WAV files to keep only the phone number.
+
+    Several calls with the same number get a numeric suffix instead of
+    overwriting each other.
+    """
+    for file in sorted(os.listdir(extract_path)):
         if file.endswith(".mp3") or file.endswith(".wav"):
             old_path = os.path.join(extract_path, file)
 
             # Extract phone number using regex pattern
             match = re.search(r"\+(\d+)", file)
             if match:
-                phone_number = f"+{match.group(1)}{os.path.splitext(file)[1]}"  # Keep the file extension (.mp3 or .wav)
+                stem, extension = f"+{match.group(1)}", os.path.splitext(file)[1]  # Keep the file extension (.mp3 or .wav)
+                phone_number, n = f"{stem}{extension}", 1
+                while os.path.exists(os.path.join(extract_path, phone_number)) and phone_number != file:
+                    n += 1
+                    phone_number = f"{stem}_{n}{extension}"
                 new_path = os.path.join(extract_path, phone_number)
-                
+
                 os.rename(old_path, new_path)
-                print(f"Renamed: {file} -> {phone_number}")  # Print renamed file for debugging
+                logger.debug(f"Renamed: {file} -> {phone_number}")
 
 def transcribe_audio(file_path):
-    """Transcribe an MP3 file using OpenAI Whisper API."""
+    """Transcribe an MP3 file (path or ZipMember) using the configured transcription backend."""
     try:
-        openai.api_key = settings.OPENAI_API_KEY  
-        with open(file_path, "rb") as audio_file:
-            response = openai.Audio.transcribe("whisper-1", audio_file)
-        
-        transcript = response.get("text", "")
-        print(f"Transcript for {file_path}: {transcript}")
+        transcript = transcription.transcribe(file_path)
+        logger.debug(f"Transcript for {file_path}: {transcript}")
         return transcript
     except Exception as e:
-        print(f"Error transcribing audio: {e}")
+        logger.error(f"Error transcribing audio: {e}")
         raise
 
 def analyze_feedback(transcript):
-    """Analyze call transcript for feedback including sentiment analysis."""
+    """Analyze call transcript for feedback including sentiment analysis (one cached API call)."""
     try:
-        sentiment_prompt = f"""
-        Analyze the sentiment of this call transcript. 
-        Rate it as Positive, Neutral, or Negative and provide reasoning.
-        
-        Transcript:
-        {transcript}
-        """
+        result = analysis.analyze(transcript)
+        if result is None:
+            raise RuntimeError("Transcript analysis failed")
 
-        sentiment_response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[{"role": "system", "content": "You are a sentiment analysis expert."},
-                      {"role": "user", "content": sentiment_prompt}]
-        )
-
-        sentiment = sentiment_response["choices"][0]["message"]["content"]
-        print(f"Sentiment Analysis: {sentiment}")
-
-        feedback_prompt = f"""
-        Provide detailed feedback on this customer service call transcript:
-        - Identify areas where the agent could improve.
-        - Was the agent polite, clear, and helpful?
-        - Were the customer's concerns properly addressed?
-        - Suggestions to improve customer experience.
-
-        Transcript:
-        {transcript}
-        """
-
-        feedback_response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[{"role": "system", "content": "You are an AI call feedback analyzer."},
-                      {"role": "user", "content": feedback_prompt}]
-        )
-
-        feedback = feedback_response["choices"][0]["message"]["content"]
-        print(f"Feedback: {feedback}")
-
-        return f"Sentiment: {sentiment}\n\nFeedback:\n{feedback}"
+        feedback = analysis.format_feedback(result)
+        logger.debug(f"Feedback: {feedback}")
+        return feedback
     except Exception as e:
-        print(f"Error analyzing feedback: {e}")
+        logger.error(f"Error analyzing feedback: {e}")
         raise
-import requests
-from django.conf import settings
 
 def get_storage_id():
     """Retrieve Bitrix24 Storage ID"""
-    storage_url = f"{settings.BITRIX24_API_URL}/disk.storage.get.json"
-    response = requests.get(storage_url, params={"id": 1})  # Default storage ID is usually 1
-    response.raise_for_status()
-    
-    storage_id = response.json().get("result", {}).get("ID")
-    print(f"✅ Retrieved Storage ID: {storage_id}")  # Debugging output
-    
-    return storage_id
-
-
+    return bitrix_folders.get_storage()["ID"]
 
-def get_folder_id():
-    """Retrieves a valid folder ID where MP3 files should be uploaded."""
+def get_folder_id(path=""):
+    """Retrieves a valid folder ID where MP3 files should be uploaded (cached per run)."""
     try:
-        response = requests.get(f"{settings.BITRIX24_API_URL}/disk.storage.get.json", params={"id": 1})  # Assuming storage ID is 1
-        response.raise_for_status()
-        result = response.json()
-        
-        if "result" in result and "ID" in result["result"]:
-            folder_id = result["result"]["ID"]
-            print(f"✅ Folder ID retrieved: {folder_id}")
-            return folder_id
-        else:
-            print("❌ Failed to retrieve folder ID:", result)
-            return None
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Error retrieving folder ID: {e}")
+        folder_id = bitrix_folders.get_folder_id(path)
+        logger.debug(f"✅ Folder ID retrieved: {folder_id}")
+        return folder_id
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        logger.error(f"❌ Error retrieving folder ID: {e}")
         return None
 
-def upload_mp3(mp3_path):
-    """Uploads an MP3 file to Bitrix24 Disk folder."""
-    try:
-        folder_id = get_folder_id()
+def _request_upload_url(folder_path=""):
+    """Request an upload URL for ``folder_path``, resolving the folder again if it was deleted or moved."""
+    upload_url_request = f"{settings.BITRIX24_API_URL}/disk.folder.uploadfile.json"
+    for attempt in range(2):
+        folder_id = get_folder_id(folder_path)
         if not folder_id:
-            print("❌ No valid folder found for uploading.")
-            return None
+            raise bitrix_upload.UploadError("No valid folder found for uploading")
 
-        # 1️⃣ Request an Upload URL from Bitrix24
-        upload_url_request = f"{settings.BITRIX24_API_URL}/disk.folder.uploadfile.json"
         params = {"id": folder_id}  # Uploading to a folder
-        response = requests.post(upload_url_request, json=params)
-        response.raise_for_status()
-
-        upload_info = response.json()
-        if "result" not in upload_info or "uploadUrl" not in upload_info["result"]:
-            print("❌ Failed to get upload URL:", upload_info)
-            return None
-
-        upload_url = upload_info["result"]["uploadUrl"]
-        print(f"✅ Upload URL received: {upload_url}")
-
-        # 2️⃣ Upload the MP3 File
-        with open(mp3_path, "rb") as file_data:
-            files = {"file": ("recording.mp3", file_data, "audio/mpeg")}
-            upload_response = requests.post(upload_url, files=files)
-            upload_response.raise_for_status()
-
-            upload_result = upload_response.json()
-            if "result" not in upload_result or "ID" not in upload_result["result"]:
-                print("❌ File upload failed:", upload_result)
-                return None
+        response = bitrix_client.post(upload_url_request, json=params, idempotent=True)
+        if attempt or not bitrix_folders.is_not_found(response):
+            break
+        bitrix_folders.invalidate()  # Folder was deleted or moved, resolve it again
+    response.raise_for_status()
 
-            file_id = upload_result["result"]["ID"]
-            print(f"✅ File uploaded successfully! File ID: {file_id}")
-            return file_id
+    upload_info = response.json()
+    if "result" not in upload_info or "uploadUrl" not in upload_info["result"]:
+        raise bitrix_upload.UploadError(f"Failed to get upload URL: {upload_info}")
+    logger.debug("✅ Upload URL received")
+    return upload_info["result"]["uploadUrl"]
+
+@metrics.timed("upload")
+def upload_mp3(mp3_path, folder_path=""):
+    """Uploads a recording (a path or a ZipMember) to Bitrix24 Disk folder, typed by its extension.
+
+    Large files go up in resumable chunks (see ``bitrix_upload.upload_file``).
+    Returns the Bitrix24 file ID; raises UploadError or a RequestException
+    when the upload fails.
+    """
+    upload_name = getattr(mp3_path, "upload_name", None) or os.path.basename(mp3_path)
+    with zip_stream.open_audio(mp3_path) as file_data:
+        file_id = bitrix_upload.upload_file(
+            file_data, upload_name, lambda: _request_upload_url(folder_path), key=f"{folder_path}/{upload_name}",
+        )
+    logger.info(f"✅ File uploaded successfully! File ID: {file_id}")
+    return file_id
 
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Error uploading file: {e}")
-        return None
-    
 def attach_file_to_lead(lead_id, file_id):
     """Attach uploaded file to a lead"""
     update_url = f"{settings.BITRIX24_API_URL}/crm.lead.update.json"
     params = {
         "id": lead_id,
         "fields": {
-            "UF_CRM_123456": file_id  # Replace with actual custom field ID in Bitrix24
+            settings.BITRIX24_RECORDING_FIELD: file_id
         }
     }
 
-    response = requests.post(update_url, json=params)
+    response = bitrix_client.post(update_url, json=params)
     response.raise_for_status()
     return response.json()
 
-def upload_mp3_and_feedback_to_bitrix24(mp3_path, phone_number): #, feedback):
+def upload_mp3_and_feedback_to_bitrix24(mp3_path, phone_number, feedback=None):
     """Find lead, upload MP3, and attach to lead in Bitrix24"""
+    return upload_recordings_to_bitrix24([(mp3_path, phone_number, feedback)])
+
+def upload_recordings_to_bitrix24(recordings, folder_path=None, folders=None, file_ids=None, on_uploaded=None):
+    """Find leads (or contacts/deals), upload MP3s, and attach them using batched Bitrix24 calls.
+
+    ``recordings`` is a list of ``(file_path, phone_number, feedback)`` tuples,
+    where ``file_path`` may also be a ZipMember;
+    ``feedback`` may be None. Files go to ``folder_path`` (default: the
+    BITRIX24_FOLDER_LAYOUT folder for today), or to their own folder in
+    ``folders`` (``{file_path: folder path}``). Files already in Bitrix24
+    (``file_ids``, ``{file_path: file ID}``) are only attached, and
+    ``on_uploaded(file_path, file_id)`` is called for each new upload before
+    anything is attached. Returns one result dict per recording with its
+    ``status`` ("attached", "no_lead" or "failed", the latter with an ``error``).
+    """
     try:
-        # 1️⃣ Search for Lead by Phone Number
-        search_url = f"{settings.BITRIX24_API_URL}/crm.lead.list.json"
-        search_params = {"filter": {"PHONE": phone_number}, "select": ["ID"]}
-
-        search_response = requests.post(search_url, json=search_params)
-        search_response.raise_for_status()
-        
-        leads = search_response.json().get("result", [])
-        if not leads:
-            print(f"❌ No lead found for phone number: {phone_number}")
-            return
-        
-        lead_id = leads[0]["ID"]
-        print(f"✅ Lead found: {lead_id}")
-
-        # 2️⃣ Upload MP3 File
-        file_id = upload_mp3(mp3_path)
-        if not file_id:
-            print("❌ MP3 Upload Failed")
-            return
-
-        # 3️⃣ Attach File to Lead
-        attach_file_to_lead(lead_id, file_id)
-        print(f"✅ Successfully attached MP3 file to lead {lead_id}")
-
-        # 4️⃣ Add AI Feedback as a Comment
-        # comment_url = f"{settings.BITRIX24_API_URL}/crm.timeline.comment.add.json"
-        # comment_data = {
-        #     "fields": {
-        #         "ENTITY_ID": lead_id,
-        #         "ENTITY_TYPE": "lead",
-        #         "COMMENT": feedback
-        #     }
-        # }
-
-        # comment_response = requests.post(comment_url, json=comment_data)
-        # comment_response.raise_for_status()
-        # print(f"✅ Successfully uploaded feedback to lead {lead_id}")
-
+        if folder_path is None:
+            folder_path = bitrix_folders.subfolder_path()
+        folders, file_ids = folders or {}, file_ids or {}
+
+        # 1️⃣ Resolve the CRM entity for every phone number (cached, one batch for the rest)
+        with metrics.span("lead_lookup"):
+            entities = crm_lookup.resolve_entities(phone_number for _, phone_number, _ in recordings)
+
+        # 2️⃣ Upload MP3 Files, several at a time (the shared rate limiter keeps within Bitrix24's limits)
+        results, to_upload = [], []
+        for file_path, phone_number, feedback in recordings:
+            result = {"file_path": file_path, "phone_number": phone_number, **(entities.get(phone_number) or {})}
+            results.append(result)
+            if result.get("error"):
+                logger.error(f"❌ {result['error']} for phone number: {phone_number}")
+                result["status"] = "failed"  # Retried later, unlike a recording with no lead
+                continue
+            if not result.get("entity_id"):
+                logger.info(f"❌ No lead found for phone number: {phone_number}")
+                result["status"] = "no_lead"
+                continue
+            if not bitrix_batch.recording_field(result["entity_type"]):
+                # E.g. cached before the entity type's field setting was cleared
+                result["status"] = "failed"
+                result["error"] = f"No recording field configured for {result['entity_type']} entities"
+                logger.error(f"❌ {result['error']} for phone number: {phone_number}")
+                continue
+            to_upload.append((result, feedback))
+
+        def upload(item):
+            file_path = item[0]["file_path"]
+            if file_path in file_ids:
+                item[0]["file_id"] = file_ids[file_path]  # Uploaded by an earlier attempt that failed to attach
+                return item
+            with metrics.in_flight("upload"):
+                try:
+                    item[0]["file_id"] = upload_mp3(file_path, folders.get(file_path, folder_path))
+                except (requests.exceptions.RequestException, bitrix_upload.UploadError) as e:
+                    item[0]["file_id"] = None
+                    item[0]["error"] = f"Upload to Bitrix24 failed: {e}"
+            return item
+
+        attachments = []
+        with ThreadPoolExecutor(max_workers=settings.BITRIX24_UPLOAD_CONCURRENCY) as executor:
+            for result, feedback in executor.map(upload, to_upload):
+                if not result["file_id"]:
+                    logger.error(f"❌ MP3 Upload Failed: {result['file_path']}: {result['error']}")
+                    result["status"] = "failed"
+                    continue
+                if on_uploaded and result["file_path"] not in file_ids:
+                    on_uploaded(result["file_path"], result["file_id"])
+
+                result["status"] = "attached"
+                attachments.append({
+                    "entity_type": result["entity_type"],
+                    "entity_id": result["entity_id"],
+                    "file_id": result["file_id"],
+                    "comment": feedback,
+                    "result": result,
+                })
+
+        # 3️⃣ Attach Files to Leads and add AI Feedback as Comments in batches
+        if attachments:
+            with metrics.span("attach"):
+                _, errors = bitrix_batch.attach_files_and_comments(attachments)
+            for i, item in enumerate(attachments):
+                if f"attach_{i}" in errors:
+                    item["result"]["status"] = "failed"
+                    item["result"]["error"] = str(errors[f"attach_{i}"])
+            attached = sum(1 for item in attachments if item["result"]["status"] == "attached")
+            logger.info(f"✅ Successfully attached {attached} MP3 files to CRM records")
+
+        return results
     except requests.exceptions.RequestException as e:
-        print("❌ Error uploading data to Bitrix24:", e)
+        logger.error(f"❌ Error uploading data to Bitrix24: {e}")
         raise
 
-def fetch_and_download_call_recordings(object_id=None):
-    """Fetch, download, extract, transcribe, and analyze call recordings."""
-    try:
-        token = get_access_token()
-        regions = get_my_regions(token)
-
-        for region in regions:
-            filter_query = f"type==callcenterrecording,objectState==AVAILABLE" if not object_id else f"id=={object_id}"
-            response = find_objects(token, region, filter_query)
-
-            content = response.get("content", [])
-            if content:
-                object_ids = [obj["id"] for obj in content]
-                bulk_download_response = create_bulk_download(token, region, object_ids)
-                zip_name = bulk_download_response.get("zipName")
-
-                for _ in range(20):
-                    if check_download_status(token, region, zip_name).get("status") == "DONE":
-                        break
-                    time.sleep(15)
-
-                zip_path = download_zip_file(token, region, zip_name)
-                extract_path = extract_zip_file(zip_path)
+def _upload_folders(object_for_source):
+    """The BITRIX24_FOLDER_LAYOUT folder of each recording, from its call time and agent."""
+    if not settings.BITRIX24_FOLDER_LAYOUT:
+        return {}
+    return {
+        source: bitrix_folders.subfolder_path(ledger.parse_8x8_time(obj.get("createdTime")), ledger.object_agent(obj))
+        for source, obj in object_for_source.items()
+    }
 
-                rename_audio_files(extract_path)  # Rename files before processing
+def _record_upload_results(results, object_for_source, checksums):
+    """Write per-recording upload outcomes back to the ledger row of each source's object."""
+    handled = set()
+    for result in results:
+        obj = object_for_source.get(result["file_path"])
+        if obj is None:
+            continue
+        handled.add(obj["id"])
+        uploaded = {"bitrix_file_id": result["file_id"]} if result.get("file_id") else {}  # Never forget a file
+        ledger.mark(
+            [obj["id"]],
+            result["status"],
+            checksum=checksums[result["file_path"]],
+            bitrix_entity_type=result.get("entity_type") or "",
+            bitrix_entity_id=result.get("entity_id") or "",
+            error=result.get("error", ""),
+            **uploaded,
+        )
+    return handled
+
+def _add_feedback(recordings):
+    """Transcribe recordings concurrently and attach the AI feedback to each one.
+
+    Returns the recordings with their feedback and ``{source: (transcript,
+    analysis)}`` for the ones that could be transcribed.
+    """
+    texts = transcription.transcribe_many([source for source, _, _ in recordings])
+    analyses = iter(analysis.analyze_many([transcript for transcript in texts if transcript]))
+
+    with_feedback, transcribed = [], {}
+    for (source, phone_number, _), transcript in zip(recordings, texts):
+        result = next(analyses) if transcript else None
+        feedback = analysis.format_feedback(result) if result else None
+        with_feedback.append((source, phone_number, feedback))
+        if transcript:
+            transcribed[source] = (transcript, result)
+    return with_feedback, transcribed
+
+def _save_transcripts(results, object_for_source, transcribed):
+    """Store the transcripts and analyses of a chunk for /recordings/search/, with the CRM entity they went to."""
+    entries = {}
+    for result in results:
+        obj = object_for_source.get(result["file_path"])
+        if obj is None or result["file_path"] not in transcribed:
+            continue
+        text, analyzed = transcribed[result["file_path"]]
+        analyzed = analyzed or {}
+        entries[obj["id"]] = {
+            "phone_number": crm_lookup.normalize_phone(result["phone_number"] or ""),
+            "entity_type": result.get("entity_type") or "",
+            "entity_id": str(result.get("entity_id") or ""),
+            "call_time": ledger.parse_8x8_time(obj.get("createdTime")),
+            "text": text,
+            "sentiment": analyzed.get("sentiment") or "",
+            "score": analyzed.get("score"),
+            "feedback": analyzed.get("feedback") or "",
+        }
+    if entries:
+        transcripts.save(entries)
+
+def _transcode(recordings, workdir, object_for_source, checksums, summary):
+    """Re-encode recordings before upload, keeping the per-source bookkeeping pointed at the new files."""
+    with metrics.span("transcode"):
+        sources, stats = transcode.transcode_many([source for source, _, _ in recordings], workdir)
+    summary["transcoded"] += stats["transcoded"]
+    summary["bytes_saved"] += stats["bytes_before"] - stats["bytes_after"]
+
+    transcoded = []
+    for (source, phone_number, feedback), new_source in zip(recordings, sources):
+        if new_source != source:
+            if source in object_for_source:
+                object_for_source[new_source] = object_for_source.pop(source)
+            checksums[new_source] = checksums.pop(source)  # Duplicates are still detected on the original audio
+        transcoded.append((new_source, phone_number, feedback))
+    return transcoded
+
+def _match_objects(entries, objects):
+    """Pair each ``(source, file name)`` from a ZIP with its 8x8 object.
+
+    Files are matched by object name first and phone number second; a file
+    with no matching object gets None.
+    """
+    by_name = {os.path.basename(obj.get("objectName") or ""): obj for obj in objects}
+    by_phone = {}
+    for obj in objects:
+        by_phone.setdefault(ledger.phone_from_name(obj.get("objectName")), []).append(obj)
+
+    used, matched = set(), []
+    for source, name in entries:
+        obj = by_name.get(name)
+        if obj is None or obj["id"] in used:
+            candidates = [o for o in by_phone.get(ledger.phone_from_name(name), []) if o["id"] not in used]
+            obj = candidates[0] if candidates else None
+        if obj is not None:
+            used.add(obj["id"])
+        matched.append((source, name, obj))
+    return matched
+
+def _cache_recordings(object_for_source):
+    """Keep a copy of freshly downloaded audio in the recording cache for the recording endpoint."""
+    with metrics.span("cache"):
+        for source, obj in object_for_source.items():
+            try:
+                recording_cache.put(obj["id"], source)
+            except OSError as e:
+                logger.warning(f"Could not cache recording {obj['id']}: {e}")
+        recording_cache.evict()
+
+def _chunk_paths(zip_path):
+    """The ZIP of a chunk and the directories it may be extracted and transcoded into."""
+    zip_name = os.path.splitext(os.path.basename(zip_path))[0]
+    return (
+        zip_path,
+        os.path.join(EXTRACTED_FILES_DIR, zip_name),
+        os.path.join(EXTRACTED_FILES_DIR, f"{zip_name}_transcoded"),
+    )
+
+def _cleanup_chunk(zip_path):
+    """Remove a chunk's ZIP and the files extracted or transcoded from it, however the chunk ended.
+
+    Failed recordings are downloaded again when they are retried, so nothing
+    is kept for them. CLEANUP_DOWNLOADS=False keeps everything for debugging.
+    """
+    if settings.CLEANUP_DOWNLOADS:
+        zip_stream.cleanup(*_chunk_paths(zip_path))
+
+def _prepare_chunk(objects, zip_path, summary):
+    """Get the recordings of a downloaded ZIP ready for upload.
+
+    With ZIP_STREAMING the audio is spooled straight out of the archive,
+    otherwise the ZIP is extracted to EXTRACTED_FILES_DIR first. Audio whose SHA-256 was
+    already uploaded (earlier, or earlier in this ZIP) is not uploaded again
+    but set aside to be attached to its own entity, and every
+    file gets a collision-free phone + call time + object ID name. With
+    RECORDING_CACHE_ON_SYNC the original audio is kept in the recording
+    cache, with TRANSCODE_RECORDINGS the audio is re-encoded, with TRANSCRIBE_RECORDINGS
+    the AI feedback is added. Returns the state ``_deliver_chunk`` needs.
+    """
+    _, extract_dir, transcode_dir = _chunk_paths(zip_path)
+    with metrics.span("extract", zip=os.path.basename(zip_path)):
+        # Each file is hashed in the same pass that spools or extracts it
+        if settings.ZIP_STREAMING:
+            members = list(zip_stream.iter_audio_members(zip_path))
+            checksums = {member: member.spool() for member in members}
+            entries = [(member, member.filename) for member in members]
+        else:
+            checksums = zip_stream.extract_audio(zip_path, extract_dir)
+            entries = [(path, os.path.basename(path)) for path in checksums]
+        matched = _match_objects(entries, objects)
+    ledger.mark([obj["id"] for obj in objects], Recording.Status.DOWNLOADED)
+    summary["downloaded"] += len(objects)
+
+    already_uploaded = ledger.attached_checksums(set(checksums.values()))
+
+    recordings, object_for_source, duplicates = [], {}, []
+    for source, name, obj in matched:
+        checksum = checksums.pop(source)
+        original = already_uploaded.get(checksum)
+        duplicate = bool(original) and (obj is None or original != obj["id"])
+        if duplicate:
+            summary["duplicate"] += 1
+            if obj is None:
+                logger.info(f"Skipping duplicate recording {name} (same audio as {original})")
+                continue
+            logger.info(f"Reusing the upload of {original} for {name} (same audio)")
+        else:
+            already_uploaded[checksum] = obj["id"] if obj else name
+
+        if obj is not None:
+            upload_name = ledger.recording_filename(obj, name)
+            if isinstance(source, zip_stream.ZipMember):
+                source.upload_name = upload_name
+            else:
+                renamed = os.path.join(os.path.dirname(source), upload_name)
+                os.rename(source, renamed)
+                source = renamed
+            object_for_source[source] = obj
+        checksums[source] = checksum
+        (duplicates if duplicate else recordings).append((source, ledger.phone_from_name(name), None))
+
+    if settings.RECORDING_CACHE_ON_SYNC and recording_cache.enabled():
+        _cache_recordings(object_for_source)
+
+    if settings.TRANSCODE_RECORDINGS:
+        recordings = _transcode(recordings, transcode_dir, object_for_source, checksums, summary)
+
+    transcribed = {}
+    if settings.TRANSCRIBE_RECORDINGS:
+        recordings, transcribed = _add_feedback(recordings)
+
+    return {
+        "objects": objects,
+        "recordings": recordings,
+        "object_for_source": object_for_source,
+        "checksums": checksums,
+        "duplicates": duplicates,
+        "transcribed": transcribed,
+        "zip_path": zip_path,
+    }
 
-                for file in os.listdir(extract_path):
-                    if file.endswith(".mp3") or file.endswith(".wav"):
-                        file_path = os.path.join(extract_path, file)
-                        # transcript = transcribe_audio(file_path)
-                        # feedback = analyze_feedback(transcript)
-                        phone_number_from_filename = file.split(".")[0]  # Extract phone number from filename
-                        upload_mp3_and_feedback_to_bitrix24(file_path, phone_number_from_filename)#, feedback)
+def _deliver_chunk(prepared, summary):
+    """Upload prepared recordings to Bitrix24 and record the outcomes.
+
+    Each upload is recorded in the ledger as soon as it finishes, so when
+    attaching fails the retry attaches the same file instead of uploading
+    a second copy. Duplicate audio is attached to its own entity as the
+    file its original was uploaded as.
+    """
+    object_for_source, checksums = prepared["object_for_source"], prepared["checksums"]
+    uploaded = ledger.uploaded_files([obj["id"] for obj in object_for_source.values()])
+    file_ids = {source: uploaded[obj["id"]] for source, obj in object_for_source.items() if obj["id"] in uploaded}
+
+    def record_upload(source, file_id):
+        obj = object_for_source.get(source)
+        if obj is not None:
+            ledger.mark([obj["id"]], Recording.Status.UPLOADED, bitrix_file_id=file_id, checksum=checksums[source])
+
+    def deliver(recordings, file_ids):
+        results = upload_recordings_to_bitrix24(
+            recordings, folders=_upload_folders(object_for_source), file_ids=file_ids, on_uploaded=record_upload,
+        )
+        for result in results:
+            summary[result["status"]] += 1
+            summary["uploaded"] += int(bool(result.get("file_id")) and result["file_path"] not in file_ids)
+        return results
+
+    results = deliver(prepared["recordings"], file_ids)
+    handled = _record_upload_results(results, object_for_source, checksums)
+    _save_transcripts(results, object_for_source, prepared["transcribed"])
+
+    duplicates = prepared["duplicates"]
+    if duplicates:
+        # After the originals, so audio first uploaded in this chunk has a file ID by now. A recording
+        # whose original never reached Bitrix24 is uploaded itself.
+        reused = ledger.uploaded_checksums({checksums[source] for source, _, _ in duplicates})
+        reused.update({checksums[result["file_path"]]: result["file_id"] for result in results if result.get("file_id")})
+        file_ids.update({
+            source: reused[checksums[source]]
+            for source, _, _ in duplicates
+            if source not in file_ids and checksums[source] in reused
+        })
+        handled |= _record_upload_results(deliver(duplicates, file_ids), object_for_source, checksums)
+
+    missing = [obj["id"] for obj in prepared["objects"] if obj["id"] not in handled]
+    if missing:
+        ledger.mark(missing, Recording.Status.FAILED, error="Recording missing from bulk download ZIP")
+
+def _new_summary():
+    return {
+        "found": 0, "skipped": 0, "downloaded": 0, "uploaded": 0,
+        "attached": 0, "no_lead": 0, "duplicate": 0, "failed": 0,
+        "transcoded": 0, "bytes_saved": 0,
+    }
 
-        return {"message": "Processing complete"}
+class _SyncRun:
+    """The stages of one sync run and the per-region summaries they share.
+
+    Stages hand work down as ``(region, objects, ...)`` tuples; each adds its
+    counts to the region's summary under a lock and reports progress.
+    """
+
+    def __init__(self, token, regions, progress=None, shard=None):
+        self.token = token
+        self.progress = progress or (lambda region, summary: None)
+        self.shard = shard
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"  # Ledger lease owner
+        self.started = timezone.now()
+        self.summaries = {region: _new_summary() for region in regions}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def add(self, region, counts):
+        with self._lock:
+            summary = self.summaries[region]
+            for key, value in counts.items():
+                summary[key] = summary.get(key, 0) + value
+            snapshot = dict(summary)
+        self.progress(region, snapshot)
+
+    def _fail(self, region, objects, error):
+        ledger.mark([obj["id"] for obj in objects], Recording.Status.FAILED, error=str(error))
+        self.add(region, {"failed": len(objects)})
+
+    def _pages_to_chunks(self, region, filter_query, seen):
+        for content in iter_object_pages(self.token, region, filter_query):
+            content = [obj for obj in content if ledger.in_shard(obj["id"], self.shard)]
+            objects = [obj for obj in ledger.record_found(region, content) if obj["id"] not in seen]
+            objects = ledger.lease(objects, self.owner) if objects else objects  # Skip what other runs hold
+            seen.update(obj["id"] for obj in objects)
+            self.add(region, {"found": len(content), "skipped": len(content) - len(objects)})
+            for i in range(0, len(objects), settings.BULK_CHUNK_SIZE):
+                yield region, objects[i:i + settings.BULK_CHUNK_SIZE]
+
+    def find(self, item):
+        """Stage 1: page through a region's objects, yielding chunks that still need work.
+
+        A regular sweep then also retries the region's failed recordings whose
+        backoff has passed (see ``ledger.mark``); backfill slices and targeted
+        runs leave that to the sweeps.
+        """
+        region, object_id, since, until = item
+        seen = set()
+        try:
+            region_since = since or (None if object_id or until else ledger.sweep_since(region, self.shard))
+            yield from self._pages_to_chunks(region, build_filter_query(object_id, since=region_since, until=until), seen)
+
+            if not (object_id or since or until):
+                retry_ids = [
+                    i for i in ledger.retryable_ids(region)
+                    if i not in seen and ledger.in_shard(i, self.shard)
+                ]
+                for i in range(0, len(retry_ids), settings.OBJECTS_PAGE_SIZE):
+                    yield from self._pages_to_chunks(region, build_filter_query(retry_ids[i:i + settings.OBJECTS_PAGE_SIZE]), seen)
+        except Exception as e:
+            logger.error(f"Error syncing region {region}: {e}", exc_info=True)
+            with self._lock:
+                self.errors[region] = e
+                self.summaries[region]["error"] = str(e)
+
+    def bulk_download(self, item):
+        """Stage 2: run an 8x8 bulk download job for a chunk and fetch its ZIP."""
+        region, objects = item
+        try:
+            zip_path = _bulk_download_chunk(self.token, region, [obj["id"] for obj in objects])
+        except Exception as e:
+            logger.error(f"Bulk download of {len(objects)} objects failed: {e}")
+            self._fail(region, objects, e)
+            return
+        yield region, objects, zip_path
+
+    def prepare(self, item):
+        """Stage 3: extract, deduplicate, rename and optionally transcode/transcribe a ZIP."""
+        region, objects, zip_path = item
+        counts = _new_summary()
+        try:
+            prepared = _prepare_chunk(objects, zip_path, counts)
+        except Exception as e:
+            logger.error(f"Error preparing {zip_path}: {e}", exc_info=True)
+            self._fail(region, objects, e)
+            _cleanup_chunk(zip_path)
+            return
+        finally:
+            self.add(region, counts)
+        yield region, prepared
+
+    def deliver(self, item):
+        """Stage 4: upload and attach the recordings in Bitrix24, then remove the chunk's files."""
+        region, prepared = item
+        counts = _new_summary()
+        try:
+            _deliver_chunk(prepared, counts)
+        except Exception as e:
+            logger.error(f"Error uploading {prepared['zip_path']}: {e}", exc_info=True)
+            self._fail(region, prepared["objects"], e)
+        finally:
+            _cleanup_chunk(prepared["zip_path"])
+            self.add(region, counts)
+
+def fetch_and_download_call_recordings(object_id=None, since=None, until=None, progress=None, regions=None, shard=None):
+    """Fetch, download, extract, transcribe, and analyze call recordings.
+
+    A sweep (no ``object_id``, ``since`` or ``until``) lists the recordings
+    created since the previous completed sweep of each region, with an
+    overlap (see ``ledger.sweep_since``), and moves that checkpoint on once
+    the region is done; otherwise recordings from ``since`` up to ``until``
+    are listed. Recordings that were already processed are skipped. ``object_id`` limits the run to one recording, or
+    to a list of them that share bulk downloads. ``regions`` restricts the
+    run to some of the account's regions, ``shard=(index, count)`` to a
+    stable slice of the object IDs. ``progress(region, summary)`` receives
+    each region's running summary. Recordings are leased in the ledger while
+    they are worked on, so concurrent runs never process the same one.
+
+    The work runs as a pipeline of stages connected by bounded queues: find
+    (REGION_WORKERS regions at a time), bulk download (BULK_MAX_IN_FLIGHT
+    jobs), prepare and deliver (PIPELINE_PREPARE_WORKERS and
+    PIPELINE_UPLOAD_WORKERS ZIPs). All stages run at once, and at most
+    PIPELINE_MAX_READY_ZIPS downloaded ZIPs wait before each of the last two,
+    so a slow Bitrix24 portal holds back downloads instead of filling the
+    disk. A failing region is reported in its summary without stopping the
+    others.
+    """
+    try:
+        stages_before = metrics.stage_totals()
+        token = get_access_token()
+        available = get_my_regions(token)
+        regions = [region for region in available if region in regions] if regions else available
+        run = _SyncRun(token, regions, progress, shard)
+
+        engine = pipeline.Pipeline([
+            pipeline.Stage("find", run.find, workers=settings.REGION_WORKERS),
+            pipeline.Stage("bulk_download", run.bulk_download, workers=settings.BULK_MAX_IN_FLIGHT,
+                           queue_size=settings.PIPELINE_QUEUE_SIZE),
+            pipeline.Stage("prepare", run.prepare, workers=settings.PIPELINE_PREPARE_WORKERS,
+                           queue_size=settings.PIPELINE_MAX_READY_ZIPS),
+            pipeline.Stage("deliver", run.deliver, workers=settings.PIPELINE_UPLOAD_WORKERS,
+                           queue_size=settings.PIPELINE_MAX_READY_ZIPS),
+        ], on_thread_exit=connections.close_all)  # Worker threads get their own DB connections
+        try:
+            engine.run((region, object_id, since, until) for region in regions)
+        finally:
+            ledger.release(run.owner)  # Whatever this run did not finish is free for the next one
+
+        # Only full sweeps move the checkpoint: webhook jobs and backfill slices cover a few recordings
+        # or a fixed range, and must not make the next sweep skip older recordings it has not seen
+        if not (object_id or since or until):
+            for region in regions:
+                if region not in run.errors:
+                    ledger.finish_sweep(region, shard, run.started)
+
+        if run.errors and len(run.errors) == len(regions):
+            raise next(iter(run.errors.values()))  # Nothing succeeded, surface the failure to the caller
+
+        totals = _new_summary()
+        for summary in run.summaries.values():
+            for key in totals:
+                totals[key] += summary[key]
+
+        return {
+            "message": "Processing complete",
+            "summary": totals,
+            "regions": run.summaries,
+            "http_stats": http_client.get_stats(),
+            "stage_seconds": {
+                stage: round(seconds - stages_before.get(stage, 0.0), 3)
+                for stage, seconds in metrics.stage_totals().items()
+            },
+        }
     except Exception as e:
-        print(f"Error: {e}")
-        raise
\ No newline at end of file
+        logger.error(f"Error: {e}")
+        raise
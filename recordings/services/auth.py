@@ -0,0 +1,83 @@
+import logging
+import threading
+import time
+
+from django.core.cache import cache as django_cache
+
+logger = logging.getLogger(__name__)
+
+
+class TokenManager:
+    """Caches an OAuth access token and refreshes it shortly before it expires.
+
+    ``fetch_token`` is called with no arguments and must return
+    ``(access_token, expires_in_seconds)``. Only one thread fetches at a time;
+    while a refresh-ahead is in flight other threads keep using the current
+    token. With ``shared_cache_key`` the token is also kept in Django's cache so
+    every worker process reuses the same token.
+    """
+
+    def __init__(self, fetch_token, refresh_margin=60, shared_cache_key=None):
+        self._fetch_token = fetch_token
+        self.refresh_margin = refresh_margin
+        self.shared_cache_key = shared_cache_key
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+
+    def _is_fresh(self, now):
+        return self._token is not None and now < self._expires_at - self.refresh_margin
+
+    def get_token(self):
+        """Return a valid access token, fetching a new one only when required."""
+        now = time.time()
+        if self._is_fresh(now):
+            return self._token
+
+        if self._token is not None and now < self._expires_at:
+            # Token still works: let a single thread refresh it ahead of expiry
+            if self._lock.acquire(blocking=False):
+                try:
+                    self._refresh()
+                except Exception as e:
+                    logger.warning(f"Token refresh-ahead failed, using current token: {e}")
+                finally:
+                    self._lock.release()
+            return self._token
+
+        with self._lock:
+            if self._is_fresh(time.time()):
+                return self._token
+            self._refresh()
+            return self._token
+
+    def _refresh(self):
+        """Adopt a newer token from the shared cache or fetch one. Caller holds the lock."""
+        now = time.time()
+        if self.shared_cache_key:
+            shared = django_cache.get(self.shared_cache_key)
+            if shared and now < shared["expires_at"] - self.refresh_margin:
+                self._token, self._expires_at = shared["access_token"], shared["expires_at"]
+                return
+
+        access_token, expires_in = self._fetch_token()
+        self._token, self._expires_at = access_token, now + expires_in
+        logger.info(f"Access token refreshed, expires in {expires_in}s")
+
+        if self.shared_cache_key:
+            django_cache.set(
+                self.shared_cache_key,
+                {"access_token": access_token, "expires_at": self._expires_at},
+                timeout=max(int(expires_in), 1),
+            )
+
+    def invalidate(self, token=None):
+        """Drop the cached token (only if it is still ``token`` when given), e.g. after a 401."""
+        with self._lock:
+            if token is not None and token != self._token:
+                return  # Another thread already replaced it
+            self._token, self._expires_at = None, 0.0
+            if self.shared_cache_key:
+                shared = django_cache.get(self.shared_cache_key)
+                if shared and (token is None or shared["access_token"] == token):
+                    django_cache.delete(self.shared_cache_key)
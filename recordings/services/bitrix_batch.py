@@ -0,0 +1,88 @@
+import logging
+from urllib.parse import quote
+
+from django.conf import settings
+
+from . import bitrix_client
+
+logger = logging.getLogger(__name__)
+
+BATCH_LIMIT = 50  # Bitrix24 accepts at most 50 commands per batch request
+
+
+def build_query(params, prefix=None):
+    """Encode nested params the way PHP's http_build_query does (filter[PHONE]=...)."""
+    if isinstance(params, dict):
+        items = params.items()
+    else:
+        items = enumerate(params)
+
+    parts = []
+    for key, value in items:
+        name = f"{prefix}[{key}]" if prefix else str(key)
+        if isinstance(value, (dict, list, tuple)):
+            parts.append(build_query(value, name))
+        else:
+            parts.append(f"{quote(name, safe='[]')}={quote(str(value), safe='')}")
+    return "&".join(part for part in parts if part)
+
+
+def call_batch(commands, halt=False, idempotent=False):
+    """Run ``{key: (method, params)}`` commands through Bitrix24's batch method.
+
+    Commands are sent in groups of 50. Pass ``idempotent=True`` for read-only
+    batches so they are retried on transient errors. Returns ``(results, errors)``,
+    both keyed by the command key.
+    """
+    results, errors = {}, {}
+    keys = list(commands)
+
+    for i in range(0, len(keys), BATCH_LIMIT):
+        cmd = {}
+        for key in keys[i:i + BATCH_LIMIT]:
+            method, params = commands[key]
+            cmd[key] = f"{method}?{build_query(params)}"
+
+        response = bitrix_client.post(f"{settings.BITRIX24_API_URL}/batch.json", json={"halt": int(halt), "cmd": cmd}, idempotent=idempotent)
+        response.raise_for_status()
+
+        body = response.json().get("result", {})
+        # PHP serializes an empty map as [], so only merge real dicts
+        if isinstance(body.get("result"), dict):
+            results.update(body["result"])
+        if isinstance(body.get("result_error"), dict):
+            errors.update(body["result_error"])
+
+    if errors:
+        logger.warning(f"Bitrix24 batch errors: {errors}")
+    return results, errors
+
+
+def recording_field(entity_type):
+    """The custom field holding the recording on ``entity_type`` entities, or "" when none is configured."""
+    return {
+        "lead": settings.BITRIX24_RECORDING_FIELD,
+        "contact": settings.BITRIX24_CONTACT_RECORDING_FIELD,
+        "deal": settings.BITRIX24_DEAL_RECORDING_FIELD,
+    }.get(entity_type, "")
+
+
+def attach_files_and_comments(attachments):
+    """Attach uploaded files to CRM entities and add feedback comments in batched calls.
+
+    ``attachments`` is a list of dicts with ``entity_type`` ("lead", "contact" or
+    "deal"), ``entity_id``, ``file_id`` and an optional ``comment``. The file
+    goes in the entity type's ``recording_field``, which must be configured.
+    """
+    commands = {}
+    for i, item in enumerate(attachments):
+        commands[f"attach_{i}"] = (
+            f"crm.{item['entity_type']}.update",
+            {"id": item["entity_id"], "fields": {recording_field(item["entity_type"]): item["file_id"]}},
+        )
+        if item.get("comment"):
+            commands[f"comment_{i}"] = (
+                "crm.timeline.comment.add",
+                {"fields": {"ENTITY_ID": item["entity_id"], "ENTITY_TYPE": item["entity_type"], "COMMENT": item["comment"]}},
+            )
+    return call_batch(commands)
@@ -0,0 +1,54 @@
+import logging
+import random
+
+from django.conf import settings
+
+from . import http_client
+from .rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+BITRIX_RETRY_STATUSES = http_client.RETRY_STATUSES - {429, 503}
+
+# Shared by every thread so the whole process stays within the portal's REST limits
+limiter = TokenBucket(rate=settings.BITRIX24_RATE_LIMIT, capacity=settings.BITRIX24_RATE_BURST)
+
+
+def is_limit_exceeded(response):
+    """True when Bitrix24 rejected a call with QUERY_LIMIT_EXCEEDED."""
+    if response.status_code not in (429, 503):
+        return False
+    try:
+        return response.json().get("error") == "QUERY_LIMIT_EXCEEDED"
+    except ValueError:
+        return response.status_code == 429
+
+
+def request(method, url, **kwargs):
+    """Send a Bitrix24 call through the shared rate limiter.
+
+    On QUERY_LIMIT_EXCEEDED every caller is paused with exponential backoff and
+    the call is retried, up to BITRIX24_LIMIT_RETRIES times.
+    """
+    backoff = 1.0
+    for attempt in range(settings.BITRIX24_LIMIT_RETRIES + 1):
+        limiter.acquire()
+        # QUERY_LIMIT_EXCEEDED (429/503) is handled here so the whole process backs off together
+        response = http_client.request(method, url, retry_statuses=BITRIX_RETRY_STATUSES, **kwargs)
+        if not is_limit_exceeded(response) or attempt == settings.BITRIX24_LIMIT_RETRIES:
+            return response
+
+        delay = backoff + random.uniform(0, backoff / 2)
+        logger.warning(f"Bitrix24 query limit exceeded, pausing {delay:.1f}s")
+        limiter.penalize(delay)
+        backoff = min(backoff * 2, 60)
+        http_client.rewind_files(kwargs.get("files"))
+    return response
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
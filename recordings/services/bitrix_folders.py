@@ -0,0 +1,113 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import bitrix_client
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Storage and folder IDs don't change during a run, resolve them once and reuse
+_folder_cache = TTLCache(
+    ttl=settings.BITRIX24_FOLDER_CACHE_TTL,
+    maxsize=512,
+    shared_prefix="bitrix24:folder" if settings.BITRIX24_FOLDER_SHARED_CACHE else None,
+)
+_create_lock = threading.Lock()
+
+NOT_FOUND_ERRORS = {"ERROR_NOT_FOUND", "NOT_FOUND"}
+
+
+def is_not_found(response):
+    """True when a Bitrix24 response reports a missing storage or folder."""
+    try:
+        return response.json().get("error") in NOT_FOUND_ERRORS
+    except ValueError:
+        return False
+
+
+def get_storage():
+    """Return the target Bitrix24 Disk storage (cached)."""
+    storage = _folder_cache.get("storage")
+    if storage is not None:
+        return storage
+
+    response = bitrix_client.get(
+        f"{settings.BITRIX24_API_URL}/disk.storage.get.json",
+        params={"id": settings.BITRIX24_STORAGE_ID},
+    )
+    response.raise_for_status()
+    storage = response.json().get("result")
+    if not storage or "ID" not in storage or "ROOT_OBJECT_ID" not in storage:
+        raise ValueError(f"Bitrix24 storage {settings.BITRIX24_STORAGE_ID} not available: {response.json()}")
+
+    _folder_cache.set("storage", storage)
+    logger.info(f"✅ Retrieved Storage ID: {storage['ID']}")
+    return storage
+
+
+def subfolder_path(call_time=None, agent=None):
+    """Render BITRIX24_FOLDER_LAYOUT (e.g. "Recordings/%Y-%m-%d" or "Recordings/{agent}") for one call.
+
+    Dates are those of the (aware) ``call_time`` in TIME_ZONE, or of today
+    without one.
+    """
+    layout = settings.BITRIX24_FOLDER_LAYOUT
+    if not layout:
+        return ""
+    path = timezone.localtime(call_time).strftime(layout)
+    agent = (agent or "unknown").replace("/", "-")  # An agent is one folder, never a nested path
+    return path.replace("{agent}", agent).strip("/")
+
+
+def _find_or_create_child(parent_id, name):
+    """Return the ID of folder ``name`` under ``parent_id``, creating it if missing."""
+    response = bitrix_client.post(
+        f"{settings.BITRIX24_API_URL}/disk.folder.getchildren.json",
+        json={"id": parent_id, "filter": {"NAME": name, "TYPE": "folder"}},
+        idempotent=True,
+    )
+    response.raise_for_status()
+    children = response.json().get("result") or []
+    if children:
+        return children[0]["ID"]
+
+    response = bitrix_client.post(
+        f"{settings.BITRIX24_API_URL}/disk.folder.addsubfolder.json",
+        json={"id": parent_id, "data": {"NAME": name}},
+    )
+    response.raise_for_status()
+    folder_id = response.json()["result"]["ID"]
+    logger.info(f"✅ Created folder {name} ({folder_id})")
+    return folder_id
+
+
+def get_folder_id(path=""):
+    """Resolve the upload folder for ``path`` below the storage root, creating it lazily."""
+    folder_id = _folder_cache.get(f"path:{path}")
+    if folder_id is not None:
+        return folder_id
+
+    folder_id = get_storage()["ROOT_OBJECT_ID"]  # The storage's top folder; its ID is not a folder ID
+    resolved = ""
+    for name in filter(None, path.split("/")):
+        resolved = f"{resolved}/{name}" if resolved else name
+        cached = _folder_cache.get(f"path:{resolved}")
+        if cached is None:
+            with _create_lock:  # Don't let concurrent uploads create the same folder twice
+                cached = _folder_cache.get(f"path:{resolved}")
+                if cached is None:
+                    cached = _find_or_create_child(folder_id, name)
+                    _folder_cache.set(f"path:{resolved}", cached)
+        folder_id = cached
+
+    _folder_cache.set(f"path:{path}", folder_id)
+    return folder_id
+
+
+def invalidate():
+    """Forget every cached storage and folder ID, e.g. after a "folder not found" error."""
+    logger.info("Invalidating cached Bitrix24 folder IDs")
+    _folder_cache.clear()
@@ -0,0 +1,157 @@
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from ..models import UploadSession
+from . import bitrix_client, metrics, transcode
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    """Bitrix24 did not accept a file upload."""
+
+
+class _RejectedChunk(UploadError):
+    """The upload URL refused a chunk (e.g. it expired), so starting over may help."""
+
+
+class _ChunkingUnsupported(UploadError):
+    """The upload URL stored the first chunk as a whole file, so it does not take Content-Range chunks."""
+
+    def __init__(self, file_id, upload_name):
+        super().__init__(f"Bitrix24 stored the first chunk of {upload_name} as file {file_id}")
+        self.file_id = file_id
+
+
+# Set once the portal has shown it ignores Content-Range, so this process stops trying
+_chunking_unsupported = False
+
+
+def _file_id(response, upload_name):
+    response.raise_for_status()
+    result = response.json().get("result")
+    if not isinstance(result, dict) or "ID" not in result:
+        raise UploadError(f"Upload of {upload_name} returned no file ID: {response.text[:200]}")
+    return result["ID"]
+
+
+def _send_whole(upload_url, file_data, upload_name, size):
+    files = {"file": (upload_name, file_data, transcode.content_type(upload_name))}
+    file_id = _file_id(bitrix_client.post(upload_url, files=files), upload_name)
+    metrics.add_bytes("upload", size)
+    return file_id
+
+
+def _resumable_session(key, size):
+    """The stored session for ``key`` when it can still be continued, dropping expired ones."""
+    cutoff = timezone.now() - timedelta(seconds=settings.BITRIX24_UPLOAD_RESUME_TTL)
+    UploadSession.objects.filter(created_at__lt=cutoff).delete()
+    return UploadSession.objects.filter(key=key, size=size).first()
+
+
+def _check_partial(response, upload_name, start, end):
+    """Raise unless ``response`` acknowledges a chunk that is not the last one."""
+    response.raise_for_status()
+    try:
+        payload = response.json()
+    except ValueError:
+        raise UploadError(f"Chunk {start}-{end} of {upload_name} got a non-JSON reply: {response.text[:200]}")
+    if not isinstance(payload, dict) or payload.get("error"):
+        raise UploadError(f"Chunk {start}-{end} of {upload_name} failed: {response.text[:200]}")
+    result = payload.get("result")
+    if isinstance(result, dict) and result.get("ID"):
+        raise _ChunkingUnsupported(result["ID"], upload_name)
+
+
+def _delete_file(file_id):
+    """Best-effort removal of the truncated file a chunk left behind."""
+    try:
+        bitrix_client.post(f"{settings.BITRIX24_API_URL}/disk.file.delete.json", json={"id": file_id})
+    except Exception as e:
+        logger.warning(f"Could not delete truncated Bitrix24 file {file_id}: {e}")
+
+
+def _send_chunks(session, file_data, upload_name):
+    """Send the file from ``session.offset`` on, one Content-Range chunk per request."""
+    content_type = transcode.content_type(upload_name)
+    file_data.seek(session.offset)
+    while True:
+        start = session.offset
+        chunk = file_data.read(settings.BITRIX24_UPLOAD_CHUNK_SIZE)
+        end = start + len(chunk) - 1
+        # Resending a byte range overwrites it, so the HTTP client may retry each chunk
+        response = bitrix_client.post(
+            session.upload_url,
+            files={"file": (upload_name, chunk, content_type)},
+            headers={"Content-Range": f"bytes {start}-{end}/{session.size}"},
+            idempotent=True,
+        )
+        if 400 <= response.status_code < 500:
+            raise _RejectedChunk(f"Chunk {start}-{end} of {upload_name} rejected with HTTP {response.status_code}")
+        if end + 1 >= session.size:
+            file_id = _file_id(response, upload_name)
+            metrics.add_bytes("upload", len(chunk))
+            session.delete()
+            return file_id
+
+        _check_partial(response, upload_name, start, end)
+        metrics.add_bytes("upload", len(chunk))
+        session.offset = end + 1
+        session.save(update_fields=["offset", "updated_at"])
+        logger.debug(f"Uploaded {session.offset}/{session.size} bytes of {upload_name}")
+
+
+def upload_file(file_data, upload_name, get_upload_url, key):
+    """Upload an open, seekable file to Bitrix24 and return its file ID.
+
+    ``get_upload_url()`` requests a fresh upload URL. Files are sent in one
+    request unless BITRIX24_CHUNKED_UPLOAD is on and they are at least
+    BITRIX24_CHUNKED_UPLOAD_THRESHOLD bytes; those are streamed in
+    BITRIX24_UPLOAD_CHUNK_SIZE chunks, each retried on its own, with the
+    acknowledged offset stored under ``key`` so a later attempt at the same
+    file resumes where this one stopped (for up to BITRIX24_UPLOAD_RESUME_TTL
+    seconds). If the portal turns out to store the first chunk as a whole
+    file, that file is deleted and this upload, and every later one in the
+    process, is sent in one request. Raises UploadError or a
+    RequestException when the upload fails.
+    """
+    global _chunking_unsupported
+    key = key[:255]
+    file_data.seek(0, os.SEEK_END)
+    size = file_data.tell()
+    file_data.seek(0)
+    if (
+        not settings.BITRIX24_CHUNKED_UPLOAD
+        or _chunking_unsupported
+        or size < settings.BITRIX24_CHUNKED_UPLOAD_THRESHOLD
+    ):
+        return _send_whole(get_upload_url(), file_data, upload_name, size)
+
+    try:
+        return _send_chunked(file_data, upload_name, get_upload_url, key, size)
+    except _ChunkingUnsupported as e:
+        logger.warning(f"{e}; Bitrix24 does not accept chunked uploads, sending whole files from now on")
+        _chunking_unsupported = True
+        UploadSession.objects.filter(key=key).delete()
+        _delete_file(e.file_id)
+        file_data.seek(0)
+        return _send_whole(get_upload_url(), file_data, upload_name, size)
+
+
+def _send_chunked(file_data, upload_name, get_upload_url, key, size):
+    """Resume the stored upload session for ``key``, or start a new one."""
+    session = _resumable_session(key, size)
+    if session:
+        logger.info(f"Resuming upload of {upload_name} at {session.offset}/{size} bytes")
+        try:
+            return _send_chunks(session, file_data, upload_name)
+        except _RejectedChunk as e:
+            logger.warning(f"{e}; restarting the upload")
+
+    UploadSession.objects.filter(key=key).delete()  # A new upload URL starts a new resume window
+    session = UploadSession.objects.create(key=key, upload_url=get_upload_url(), size=size)
+    return _send_chunks(session, file_data, upload_name)
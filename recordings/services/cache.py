@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache as django_cache
+
+MISSING = object()  # Sentinel so callers can cache None (e.g. negative lookups)
+
+
+class TTLCache:
+    """Thread-safe in-process LRU cache whose entries expire after ``ttl`` seconds.
+
+    When ``shared_prefix`` is set, entries are written through to Django's cache
+    framework as well, so several worker processes can share the same values.
+    """
+
+    def __init__(self, ttl, maxsize=1024, shared_prefix=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.shared_prefix = shared_prefix
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _shared_key(self, key):
+        return f"{self.shared_prefix}:{key}"
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if now < expires_at:
+                    self._data.move_to_end(key)
+                    return value
+                del self._data[key]
+
+        if self.shared_prefix:
+            entry = django_cache.get(self._shared_key(key))
+            if entry is not None:
+                value, expires_at = entry
+                if now < expires_at:
+                    self._store(key, value, expires_at)
+                    return value
+        return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl
+        self._store(key, value, expires_at)
+        if self.shared_prefix:
+            django_cache.set(self._shared_key(key), (value, expires_at), timeout=max(int(ttl), 1))
+
+    def _store(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+        if self.shared_prefix:
+            django_cache.delete(self._shared_key(key))
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._data)
+            self._data.clear()
+        if self.shared_prefix:
+            django_cache.delete_many([self._shared_key(key) for key in keys])
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,134 @@
+import re
+
+from django.conf import settings
+
+from . import bitrix_batch
+from .cache import MISSING, TTLCache
+
+try:
+    import phonenumbers
+except ImportError:  # Optional: falls back to the simple normalization below
+    phonenumbers = None
+
+# phone (E.164) -> {"entity_type": ..., "entity_id": ...}, or None for a cached miss
+_entity_cache = TTLCache(ttl=settings.PHONE_CACHE_TTL, maxsize=settings.PHONE_CACHE_SIZE)
+
+
+def normalize_phone(phone):
+    """Normalize a phone number to E.164 (+15551234567), or return "" if it has no digits."""
+    if phonenumbers is not None:
+        try:
+            region = None if phone.strip().startswith("+") else settings.PHONE_DEFAULT_REGION
+            parsed = phonenumbers.parse(phone, region)
+            return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
+        except phonenumbers.NumberParseException:
+            pass
+
+    phone = phone.strip()
+    digits = re.sub(r"\D", "", phone)
+    if not digits:
+        return ""
+    if phone.startswith("+"):
+        return f"+{digits}"
+    if digits.startswith("00"):
+        return f"+{digits[2:]}"
+    return f"+{settings.PHONE_DEFAULT_COUNTRY_CODE}{digits.lstrip('0')}"
+
+
+def _pick_entity(key, results):
+    """Choose the entity to attach to: a lead, else the contact's latest deal, else the contact.
+
+    Contacts and deals are skipped while their entity type has no recording field.
+    """
+    matches = results.get(f"dup_{key}")
+    if not isinstance(matches, dict):
+        matches = {}  # No duplicates comes back as an empty PHP array
+    if matches.get("LEAD"):
+        return {"entity_type": "lead", "entity_id": str(matches["LEAD"][0])}
+    if not settings.BITRIX24_ENTITY_FALLBACK or not matches.get("CONTACT"):
+        return None
+
+    deals = results.get(f"deal_{key}") or []
+    if deals and bitrix_batch.recording_field("deal"):
+        return {"entity_type": "deal", "entity_id": str(deals[0]["ID"])}
+    if bitrix_batch.recording_field("contact"):
+        return {"entity_type": "contact", "entity_id": str(matches["CONTACT"][0])}
+    return None
+
+
+def _contact_only(matches):
+    """The contact ID of a duplicate lookup that found a contact but no lead, else None."""
+    if not isinstance(matches, dict) or matches.get("LEAD") or not matches.get("CONTACT"):
+        return None
+    return matches["CONTACT"][0]
+
+
+def _lookup_error(key, results, errors):
+    """The batch error that left phone ``key`` unresolved, or None when its answer is complete."""
+    if f"dup_{key}" in errors:
+        return errors[f"dup_{key}"]
+    if f"dup_{key}" not in results:
+        return "Bitrix24 returned no result"
+    return errors.get(f"deal_{key}")  # Only looked up for contacts that may need a deal
+
+
+def resolve_entities(phone_numbers):
+    """Map phone numbers to the CRM entity their recordings belong to.
+
+    Numbers are normalized to E.164 and looked up in a TTL cache first (misses
+    are cached too, for PHONE_NEGATIVE_TTL seconds). Everything not cached is
+    resolved in one batched ``crm.duplicate.findbycomm`` pass, which matches
+    numbers regardless of how they were formatted in Bitrix24; a second batch
+    looks up the deals of the numbers that only matched a contact. Returns
+    ``{phone: {"entity_type", "entity_id"} or None}`` keyed by the numbers given;
+    a number whose lookup failed in the batch (e.g. QUERY_LIMIT_EXCEEDED)
+    maps to ``{"error": ...}`` instead and is not cached, so it can be retried.
+    """
+    normalized = {phone: normalize_phone(phone) for phone in phone_numbers}
+    entities, to_fetch = {}, []
+    for e164 in dict.fromkeys(normalized.values()):
+        if not e164:
+            entities[e164] = None
+            continue
+        cached = _entity_cache.get(e164, MISSING)
+        if cached is MISSING:
+            to_fetch.append(e164)
+        else:
+            entities[e164] = cached
+
+    if to_fetch:
+        commands = {
+            f"dup_{i}": ("crm.duplicate.findbycomm", {"type": "PHONE", "values": [e164]})
+            for i, e164 in enumerate(to_fetch)
+        }
+        results, errors = bitrix_batch.call_batch(commands, idempotent=True)
+        if settings.BITRIX24_ENTITY_FALLBACK and bitrix_batch.recording_field("deal"):
+            # Deals only matter for numbers that matched a contact and no lead
+            deal_commands = {
+                f"deal_{i}": ("crm.deal.list", {
+                    "filter": {"CONTACT_ID": contact_id},
+                    "order": {"DATE_CREATE": "DESC"},
+                    "select": ["ID"],
+                })
+                for i in range(len(to_fetch))
+                if (contact_id := _contact_only(results.get(f"dup_{i}")))
+            }
+            if deal_commands:
+                deal_results, deal_errors = bitrix_batch.call_batch(deal_commands, idempotent=True)
+                results.update(deal_results)
+                errors.update(deal_errors)
+
+        for i, e164 in enumerate(to_fetch):
+            error = _lookup_error(i, results, errors)
+            if error is not None:
+                entities[e164] = {"error": f"CRM lookup failed: {error}"}
+                continue
+            entity = _pick_entity(i, results)
+            entities[e164] = entity
+            _entity_cache.set(e164, entity, ttl=None if entity else settings.PHONE_NEGATIVE_TTL)
+
+    return {phone: entities[e164] for phone, e164 in normalized.items()}
+
+
+def clear_cache():
+    _entity_cache.clear()
@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from .resilience import CircuitBreaker, backoff_delay, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# One pooled Session per host, reused across the whole pipeline and across Django requests
+_sessions = {}
+_breakers = {}
+_sessions_lock = threading.Lock()
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_session(host):
+    """Return the shared keep-alive Session for ``host``, creating it on first use."""
+    session = _sessions.get(host)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+                pool_block=settings.HTTP_POOL_BLOCK,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["Connection"] = "keep-alive"
+            _sessions[host] = session
+        return session
+
+
+def _record(host, elapsed, failed):
+    with _stats_lock:
+        stats = _stats.setdefault(host, {"requests": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        stats["requests"] += 1
+        stats["errors"] += int(failed)
+        stats["total_seconds"] += elapsed
+        stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+
+
+def get_breaker(host):
+    """Return the circuit breaker guarding ``host``."""
+    breaker = _breakers.get(host)
+    if breaker is None:
+        with _sessions_lock:
+            breaker = _breakers.setdefault(host, CircuitBreaker(
+                host,
+                failure_threshold=settings.HTTP_BREAKER_THRESHOLD,
+                reset_timeout=settings.HTTP_BREAKER_RESET,
+            ))
+    return breaker
+
+
+def rewind_files(files):
+    """Rewind multipart file objects that were already sent, so a retry resends them whole."""
+    for value in (files or {}).values():
+        file_obj = value[1] if isinstance(value, tuple) else value
+        if hasattr(file_obj, "seek"):
+            file_obj.seek(0)
+
+
+def request(method, url, idempotent=None, retry_statuses=RETRY_STATUSES, **kwargs):
+    """Send a request through the pooled Session for the URL's host.
+
+    Connection errors and ``retry_statuses`` responses are retried with jittered
+    exponential backoff (honoring Retry-After) for idempotent calls; by default
+    only non-POST methods count as idempotent. 429/503 are always retried since
+    the server did not process the call. Repeated failures open the host's
+    circuit breaker, which then fails fast with CircuitOpenError.
+    """
+    kwargs.setdefault("timeout", (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT))
+    if idempotent is None:
+        idempotent = method.upper() != "POST"
+    host = urlsplit(url).netloc
+    session = get_session(host)
+    breaker = get_breaker(host)
+
+    for attempt in range(settings.HTTP_RETRIES + 1):
+        last_attempt = attempt == settings.HTTP_RETRIES
+        trial = breaker.before_call()
+
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            _record(host, time.perf_counter() - start, failed=True)
+            breaker.record_failure()
+            if not idempotent or last_attempt:
+                raise
+            delay = backoff_delay(attempt, settings.HTTP_RETRY_BACKOFF, settings.HTTP_RETRY_MAX_DELAY)
+        else:
+            failed = response.status_code >= 500
+            _record(host, time.perf_counter() - start, failed=failed)
+            if failed and response.status_code != 503:  # 503 is also used for throttling
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+
+            retryable = response.status_code in retry_statuses and (
+                idempotent or response.status_code in (429, 503)
+            )
+            if not retryable or last_attempt:
+                return response
+
+            delay = retry_after_seconds(response)
+            if delay is None:
+                delay = backoff_delay(attempt, settings.HTTP_RETRY_BACKOFF, settings.HTTP_RETRY_MAX_DELAY)
+            delay = min(delay, settings.HTTP_RETRY_MAX_DELAY)
+            response.close()
+        finally:
+            if trial:
+                breaker.end_trial()  # Also after an unexpected error, which would otherwise keep the circuit open
+
+        logger.warning(f"Retrying {method} {host} in {delay:.1f}s (attempt {attempt + 1})")
+        time.sleep(delay)
+        rewind_files(kwargs.get("files"))
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def _connections_opened(session):
+    """Count TCP connections the Session's urllib3 pools have opened so far."""
+    opened = 0
+    for adapter in session.adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+    return opened
+
+
+def get_stats():
+    """Per-host call counts, latency and connection reuse since process start."""
+    with _stats_lock:
+        snapshot = {host: dict(stats) for host, stats in _stats.items()}
+
+    for host, stats in snapshot.items():
+        session = _sessions.get(host)
+        opened = _connections_opened(session) if session else 0
+        stats["avg_ms"] = round(stats["total_seconds"] / stats["requests"] * 1000, 2) if stats["requests"] else 0.0
+        stats["max_ms"] = round(stats.pop("max_seconds") * 1000, 2)
+        stats["connections_opened"] = opened
+        stats["connection_reuse_rate"] = round(1 - opened / stats["requests"], 3) if stats["requests"] else 0.0
+    return snapshot
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def close_sessions():
+    """Close every pooled Session (e.g. at worker shutdown)."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,194 @@
+import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, Q, Value, When
+from django.utils import timezone
+
+from ..models import SyncJob
+from . import metrics
+from .api_service import fetch_and_download_call_recordings, fetch_recording
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_sync(object_id="", delay=0):
+    """Queue a sync job, or return the queued/running one for the same target.
+
+    A job with a ``delay`` (in seconds) is not started before it has passed,
+    so that other single-recording jobs queued meanwhile can share its run.
+    Returns ``(job, created)``.
+    """
+    return _enqueue(SyncJob.Kind.SYNC, object_id or "", delay)
+
+
+def enqueue_fetch(object_id):
+    """Queue a download of ``object_id`` into the recording cache, or return the one already queued/running.
+
+    Returns ``(job, created)``.
+    """
+    return _enqueue(SyncJob.Kind.FETCH, object_id, 0)
+
+
+def _enqueue(kind, object_id, delay):
+    existing = SyncJob.objects.filter(kind=kind, object_id=object_id, status__in=SyncJob.ACTIVE_STATUSES).first()
+    if existing:
+        return existing, False
+
+    run_after = timezone.now() + timedelta(seconds=delay) if delay else None
+    try:
+        with transaction.atomic():
+            return SyncJob.objects.create(kind=kind, object_id=object_id, run_after=run_after), True
+    except IntegrityError:
+        # Another request queued the same target between our check and insert
+        return SyncJob.objects.get(kind=kind, object_id=object_id, status__in=SyncJob.ACTIVE_STATUSES), False
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def requeue_stale_jobs():
+    """Put running jobs whose worker stopped sending heartbeats back in the queue."""
+    cutoff = timezone.now() - timedelta(seconds=settings.SYNC_JOB_STALE_AFTER)
+    count = SyncJob.objects.filter(status=SyncJob.Status.RUNNING, heartbeat_at__lt=cutoff).update(
+        status=SyncJob.Status.QUEUED, worker=""
+    )
+    if count:
+        logger.warning(f"Requeued {count} stale sync jobs")
+    return count
+
+
+def claim_next_job(worker=None):
+    """Atomically take the oldest queued job for this worker, or return None.
+
+    Fetch jobs go first, since a client is waiting for each of them.
+    """
+    worker = worker or worker_name()
+    due = Q(run_after__isnull=True) | Q(run_after__lte=timezone.now())
+    fetch_first = Case(When(kind=SyncJob.Kind.FETCH, then=Value(0)), default=Value(1))
+    queued = SyncJob.objects.filter(due, status=SyncJob.Status.QUEUED)
+    for job in queued.order_by(fetch_first, "created_at")[:10]:
+        now = timezone.now()
+        claimed = SyncJob.objects.filter(pk=job.pk, status=SyncJob.Status.QUEUED).update(
+            status=SyncJob.Status.RUNNING, worker=worker, started_at=now, heartbeat_at=now
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def claim_batch(job, worker=None):
+    """Claim the other queued single-recording jobs to sync together with ``job``.
+
+    Everything queued behind it, up to SYNC_BATCH_MAX recordings in total, is
+    taken even when its batching window has not passed yet, so notifications
+    that arrive close together share one bulk download.
+    """
+    if not job.object_id or job.kind != SyncJob.Kind.SYNC:
+        return []
+    worker = worker or worker_name()
+    candidates = list(
+        SyncJob.objects.filter(kind=SyncJob.Kind.SYNC, status=SyncJob.Status.QUEUED)
+        .exclude(object_id="")
+        .exclude(pk=job.pk)
+        .order_by("created_at")
+        .values_list("pk", flat=True)[:settings.SYNC_BATCH_MAX - 1]
+    )
+    if not candidates:
+        return []
+
+    now = timezone.now()
+    SyncJob.objects.filter(pk__in=candidates, status=SyncJob.Status.QUEUED).update(
+        status=SyncJob.Status.RUNNING, worker=worker, started_at=now, heartbeat_at=now
+    )
+    # Another worker may have claimed some of them first
+    return list(SyncJob.objects.filter(pk__in=candidates, status=SyncJob.Status.RUNNING, worker=worker, started_at=now))
+
+
+def _send_heartbeats(job_pks, stop):
+    """Keep running jobs' heartbeats fresh while long bulk-download waits are in progress."""
+    try:
+        while not stop.wait(settings.SYNC_JOB_HEARTBEAT):
+            SyncJob.objects.filter(pk__in=job_pks).update(heartbeat_at=timezone.now())
+            metrics.save_snapshot(worker_name())
+    finally:
+        connection.close()
+
+
+@contextmanager
+def _heartbeats(job_pks):
+    """Send heartbeats for ``job_pks`` while the block runs."""
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_send_heartbeats, args=(list(job_pks), stop), daemon=True)
+    heartbeat.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        heartbeat.join()
+        metrics.save_snapshot(worker_name())
+
+
+def _run_fetch(job):
+    """Download the recording of a claimed fetch job into the recording cache."""
+    jobs = SyncJob.objects.filter(pk=job.pk)
+    try:
+        with _heartbeats([job.pk]):
+            path = fetch_recording(job.object_id)
+    except Exception as e:
+        logger.error(f"Fetch job {job.pk} failed: {e}", exc_info=True)
+        jobs.update(status=SyncJob.Status.FAILED, error=str(e), finished_at=timezone.now())
+        return
+    if path is None:
+        jobs.update(status=SyncJob.Status.FAILED, error="Recording not found", finished_at=timezone.now())
+        return
+    jobs.update(status=SyncJob.Status.DONE, found=1, downloaded=1, finished_at=timezone.now())
+
+
+def run_job(job, batch=()):
+    """Run the sync pipeline for a claimed job, recording progress as it goes.
+
+    Jobs in ``batch`` (see ``claim_batch``) are synced in the same run and
+    share its progress and result. Fetch jobs only download their recording.
+    """
+    if job.kind == SyncJob.Kind.FETCH:
+        _run_fetch(job)
+        return
+    jobs = SyncJob.objects.filter(pk__in=[job.pk, *(other.pk for other in batch)])
+    object_ids = [job.object_id, *(other.object_id for other in batch)] if job.object_id else None
+    region_summaries = {}
+    lock = threading.Lock()
+
+    def progress(region, summary):
+        with lock:
+            region_summaries[region] = dict(summary)
+            totals = {
+                key: sum(s.get(key, 0) for s in region_summaries.values())
+                for key in ("found", "downloaded", "uploaded", "failed")
+            }
+            jobs.update(heartbeat_at=timezone.now(), **totals)
+
+    try:
+        with _heartbeats(jobs.values_list("pk", flat=True)):
+            result = fetch_and_download_call_recordings(object_ids, progress=progress)
+    except Exception as e:
+        logger.error(f"Sync job {job.pk} failed: {e}", exc_info=True)
+        jobs.update(
+            status=SyncJob.Status.FAILED, error=str(e), finished_at=timezone.now()
+        )
+        return
+
+    summary = result.get("summary", {})
+    jobs.update(
+        status=SyncJob.Status.DONE,
+        result=result,
+        finished_at=timezone.now(),
+        **{key: summary.get(key, 0) for key in ("found", "downloaded", "uploaded", "failed")},
+    )
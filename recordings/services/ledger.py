@@ -0,0 +1,238 @@
+import os
+import re
+import zlib
+from datetime import datetime, time, timedelta, timezone
+
+from django.conf import settings
+from django.db.models import Case, DateTimeField, F, Min, Q, Value, When
+from django.utils import timezone as django_timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from ..models import Recording, SyncCheckpoint
+
+PHONE_PATTERN = re.compile(r"\+(\d+)")
+
+
+def parse_8x8_time(value):
+    """Parse an 8x8 timestamp (epoch milliseconds or ISO 8601) into an aware datetime."""
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+    parsed = parse_datetime(value)
+    if parsed and django_timezone.is_naive(parsed):
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def parse_day_or_time(value):
+    """Parse an ISO 8601 date (as midnight UTC) or date-time (UTC unless given); None when it is neither."""
+    try:
+        parsed = parse_8x8_time(value)
+        if parsed is None and value:
+            day = parse_date(value)
+            parsed = datetime.combine(day, time.min, tzinfo=timezone.utc) if day else None
+    except ValueError:
+        return None  # Well-formed but not a real date, e.g. 2024-02-30
+    return parsed
+
+
+def format_8x8_time(value):
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def phone_from_name(name):
+    match = PHONE_PATTERN.search(name or "")
+    return f"+{match.group(1)}" if match else ""
+
+
+def object_agent(obj):
+    """The agent of an 8x8 recording, from the first BITRIX24_FOLDER_AGENT_TAGS tag it has, or ""."""
+    tags = {tag.get("key"): tag.get("value") for tag in obj.get("tags") or () if isinstance(tag, dict)}
+    return next((str(tags[key]) for key in settings.BITRIX24_FOLDER_AGENT_TAGS if tags.get(key)), "")
+
+
+def _sweep_key(region, shard):
+    return "sweep region={} shard={}".format(region, "{}/{}".format(*shard) if shard else "all")
+
+
+def sweep_since(region, shard=None):
+    """Oldest ``created_time`` the next sweep of ``region`` (and ``shard``) has to list.
+
+    That is where the last completed sweep left off, minus SYNC_SWEEP_OVERLAP
+    so recordings that became AVAILABLE a while after they were created are
+    still picked up. None means no sweep of the region has completed yet.
+    """
+    checkpoint = SyncCheckpoint.objects.filter(key=_sweep_key(region, shard), finished=True).first()
+    if checkpoint is None:
+        return None
+    return checkpoint.position - timedelta(seconds=settings.SYNC_SWEEP_OVERLAP)
+
+
+def finish_sweep(region, shard, started):
+    """Advance the sweep checkpoint of ``region`` after a sweep that started at ``started`` completed.
+
+    Only full sweeps call this; targeted runs (single recordings, webhooks)
+    and backfills never move it. Recordings of the region still unfinished
+    after the sweep hold the checkpoint back, so the next sweep lists them
+    again.
+    """
+    unfinished = (
+        Recording.objects.filter(region=region, created_time__isnull=False)
+        .exclude(status__in=Recording.DONE_STATUSES)
+        .aggregate(oldest=Min("created_time"))["oldest"]
+    )
+    position = min(started, unfinished) if unfinished else started
+    SyncCheckpoint.objects.update_or_create(
+        key=_sweep_key(region, shard), defaults={"position": position, "finished": True},
+    )
+    return position
+
+
+def record_found(region, objects):
+    """Add newly found 8x8 objects to the ledger and return the ones that still need work."""
+    existing = {
+        rec.object_id: rec
+        for rec in Recording.objects.filter(object_id__in=[obj["id"] for obj in objects])
+    }
+
+    new_rows = [
+        Recording(
+            object_id=obj["id"],
+            region=region,
+            object_name=obj.get("objectName", ""),
+            phone_number=phone_from_name(obj.get("objectName")),
+            size=obj.get("size"),
+            created_time=parse_8x8_time(obj.get("createdTime")),
+        )
+        for obj in objects
+        if obj["id"] not in existing
+    ]
+    Recording.objects.bulk_create(new_rows, ignore_conflicts=True)
+
+    return [obj for obj in objects if obj["id"] not in existing or _needs_work(existing[obj["id"]])]
+
+
+def in_shard(object_id, shard):
+    """True when ``object_id`` belongs to shard ``(index, count)`` (always true without a shard)."""
+    if not shard:
+        return True
+    index, count = shard
+    return zlib.crc32(object_id.encode()) % count == index
+
+
+def lease(objects, owner, seconds=None):
+    """Claim the ledger rows of ``objects`` for ``owner`` and return the ones it now holds.
+
+    Rows leased by another owner are skipped until their lease expires
+    (after SYNC_LEASE_SECONDS), so runs in several processes or hosts can
+    share one backlog without processing a recording twice. ``mark`` releases
+    the lease once a recording reaches a final status.
+    """
+    now = django_timezone.now()
+    object_ids = [obj["id"] for obj in objects]
+    Recording.objects.filter(object_id__in=object_ids).filter(
+        Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now) | Q(leased_by=owner)
+    ).update(leased_by=owner, lease_expires_at=now + timedelta(seconds=seconds or settings.SYNC_LEASE_SECONDS))
+    held = set(Recording.objects.filter(object_id__in=object_ids, leased_by=owner).values_list("object_id", flat=True))
+    return [obj for obj in objects if obj["id"] in held]
+
+
+def release(owner):
+    """Drop every lease ``owner`` still holds."""
+    Recording.objects.filter(leased_by=owner).update(leased_by="", lease_expires_at=None)
+
+
+def _needs_work(rec):
+    if rec.status == Recording.Status.FAILED:
+        due = rec.next_retry_at is None or rec.next_retry_at <= django_timezone.now()
+        return rec.attempts < settings.SYNC_MAX_ATTEMPTS and due
+    return rec.status not in Recording.DONE_STATUSES
+
+
+def retryable_ids(region):
+    """Object IDs in ``region`` that failed and whose retry is due."""
+    return list(
+        Recording.objects.filter(
+            Q(next_retry_at__isnull=True) | Q(next_retry_at__lte=django_timezone.now()),
+            region=region,
+            status=Recording.Status.FAILED,
+            attempts__lt=settings.SYNC_MAX_ATTEMPTS,
+        ).values_list("object_id", flat=True)
+    )
+
+
+def _next_retry(now):
+    """Retry time of a recording failing at ``now``: SYNC_RETRY_BACKOFF seconds, doubled per earlier failure.
+
+    None once it has used up SYNC_MAX_ATTEMPTS.
+    """
+    return Case(
+        *[
+            When(attempts=n, then=Value(now + timedelta(seconds=settings.SYNC_RETRY_BACKOFF * 2 ** n)))
+            for n in range(settings.SYNC_MAX_ATTEMPTS - 1)
+        ],
+        default=Value(None),
+        output_field=DateTimeField(),
+    )
+
+
+def mark(object_ids, status, **fields):
+    """Move ledger rows to ``status``, stamping the matching stage timestamp.
+
+    A failure counts as an attempt and puts off the row's next retry (see ``_next_retry``).
+    """
+    stamp = {
+        Recording.Status.DOWNLOADED: "downloaded_at",
+        Recording.Status.UPLOADED: "uploaded_at",
+        Recording.Status.ATTACHED: "attached_at",
+    }.get(status)
+    now = django_timezone.now()
+    if stamp:
+        fields[stamp] = now
+    if status == Recording.Status.FAILED:
+        fields["attempts"] = F("attempts") + 1
+        fields["next_retry_at"] = _next_retry(now)
+    else:
+        fields["next_retry_at"] = None
+    if status in Recording.DONE_STATUSES:
+        fields.update(leased_by="", lease_expires_at=None)
+    Recording.objects.filter(object_id__in=object_ids).update(status=status, updated_at=now, **fields)
+
+
+def uploaded_files(object_ids):
+    """``{object ID: Bitrix24 file ID}`` of the recordings that an earlier attempt already uploaded."""
+    return dict(
+        Recording.objects.filter(object_id__in=object_ids)
+        .exclude(bitrix_file_id="")
+        .values_list("object_id", "bitrix_file_id")
+    )
+
+
+def attached_checksums(checksums):
+    """Map the checksums that already reached Bitrix24 to the object ID that carried them."""
+    return dict(
+        Recording.objects.filter(
+            checksum__in=checksums,
+            status__in=(Recording.Status.UPLOADED, Recording.Status.ATTACHED),
+        ).values_list("checksum", "object_id")
+    )
+
+
+def uploaded_checksums(checksums):
+    """Map the checksums that already reached Bitrix24 to the file ID they were uploaded as."""
+    return dict(
+        Recording.objects.filter(
+            checksum__in=checksums,
+            status__in=(Recording.Status.UPLOADED, Recording.Status.ATTACHED),
+        ).exclude(bitrix_file_id="").values_list("checksum", "bitrix_file_id")
+    )
+
+
+def recording_filename(obj, original_name):
+    """Collision-free file name: phone number, call time and object ID, keeping the extension."""
+    extension = os.path.splitext(original_name)[1].lower()
+    phone = phone_from_name(original_name) or phone_from_name(obj.get("objectName")) or "unknown"
+    created = parse_8x8_time(obj.get("createdTime"))
+    stamp = created.strftime("%Y%m%d-%H%M%S") if created else "unknown-time"
+    return f"{phone}_{stamp}_{obj['id']}{extension}"
@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+
+from ..models import MetricsSnapshot, Recording, SyncJob
+from . import http_client
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("recordings.slow")
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+HELP = {
+    "recordings_stage_seconds": ("histogram", "Time spent in each pipeline stage."),
+    "recordings_stage_errors_total": ("counter", "Pipeline stage runs that raised."),
+    "recordings_bytes_total": ("counter", "Recording bytes transferred, by direction."),
+    "recordings_in_flight": ("gauge", "Work currently in progress, by stage."),
+    "recordings_queue_depth": ("gauge", "Items waiting in the pipeline queue in front of each stage."),
+    "recordings_http_requests_total": ("counter", "HTTP requests sent, by host."),
+    "recordings_http_errors_total": ("counter", "HTTP requests that failed or returned 5xx, by host."),
+    "recordings_http_request_seconds_total": ("counter", "Time spent waiting on HTTP requests, by host."),
+    "recordings_http_connections_opened": ("gauge", "TCP connections opened by the pooled sessions, by host."),
+    "recordings_sync_jobs": ("gauge", "Sync jobs in the queue, by status."),
+    "recordings_ledger": ("gauge", "Recordings in the ledger, by status."),
+}
+
+
+def _label_key(labels):
+    return ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+
+class Registry:
+    """Thread-safe counters, gauges and histograms for one process.
+
+    Series are keyed by metric name and rendered label string, so a snapshot
+    is plain JSON that other processes can render too.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def add_gauge(self, name, value, **labels):
+        with self._lock:
+            series = self.gauges.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, buckets=STAGE_BUCKETS, **labels):
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            hist = series.setdefault(_label_key(labels), {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0})
+            index = bisect_left(buckets, value)
+            if index < len(buckets):
+                hist["buckets"][index] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def snapshot(self):
+        """A JSON-serializable copy of every series, plus this process's HTTP client stats."""
+        with self._lock:
+            data = {
+                "counters": {name: dict(series) for name, series in self.counters.items()},
+                "gauges": {name: dict(series) for name, series in self.gauges.items()},
+                "histograms": {
+                    name: {key: {**hist, "buckets": list(hist["buckets"])} for key, hist in series.items()}
+                    for name, series in self.histograms.items()
+                },
+            }
+        for host, stats in http_client.get_stats().items():
+            key = _label_key({"host": host})
+            data["counters"].setdefault("recordings_http_requests_total", {})[key] = stats["requests"]
+            data["counters"].setdefault("recordings_http_errors_total", {})[key] = stats["errors"]
+            data["counters"].setdefault("recordings_http_request_seconds_total", {})[key] = stats["total_seconds"]
+            data["gauges"].setdefault("recordings_http_connections_opened", {})[key] = stats["connections_opened"]
+        return data
+
+
+registry = Registry()
+_listeners = []
+
+
+def stage_totals():
+    """Seconds spent per stage so far in this process, e.g. to diff around one sync."""
+    with registry._lock:
+        series = registry.histograms.get("recordings_stage_seconds", {})
+        return {key.split('"')[1]: hist["sum"] for key, hist in series.items()}
+
+
+@contextmanager
+def span(stage, **context):
+    """Time a pipeline stage into the stage histogram and log it if it was slow.
+
+    ``context`` (e.g. region or zip name) only goes to the logs, not to labels.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        registry.inc("recordings_stage_errors_total", stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe("recordings_stage_seconds", elapsed, stage=stage)
+        details = " ".join(f"{key}={value}" for key, value in context.items())
+        for callback in list(_listeners):
+            callback(stage, elapsed)
+        logger.debug(f"stage={stage} seconds={elapsed:.3f} {details}".rstrip())
+        if elapsed >= settings.METRICS_SLOW_STAGE_SECONDS:
+            slow_logger.warning(f"Slow stage {stage}: {elapsed:.1f}s {details}".rstrip())
+
+
+def add_listener(callback):
+    """Call ``callback(stage, seconds)`` after every span, e.g. to keep raw samples for percentiles."""
+    _listeners.append(callback)
+
+
+def remove_listener(callback):
+    _listeners.remove(callback)
+
+
+def timed(stage):
+    """Decorator form of ``span``."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def in_flight(stage):
+    """Count work in progress (e.g. bulk jobs or uploads) in the in-flight gauge."""
+    registry.add_gauge("recordings_in_flight", 1, stage=stage)
+    try:
+        yield
+    finally:
+        registry.add_gauge("recordings_in_flight", -1, stage=stage)
+
+
+def add_bytes(direction, count):
+    registry.inc("recordings_bytes_total", count, direction=direction)
+
+
+def save_snapshot(worker):
+    """Store this process's metrics so the web process can expose them too."""
+    MetricsSnapshot.objects.update_or_create(worker=worker, defaults={"data": registry.snapshot()})
+
+
+def _render_series(lines, kind, name, series, worker):
+    extra = f'worker="{worker}"'
+    for key, value in sorted(series.items()):
+        labels = f"{key},{extra}" if key else extra
+        if kind != "histogram":
+            lines.append(f"{name}{{{labels}}} {value}")
+            continue
+        cumulative = 0
+        for bound, count in zip(STAGE_BUCKETS, value["buckets"]):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {value["count"]}')
+        lines.append(f"{name}_sum{{{labels}}} {value['sum']}")
+        lines.append(f"{name}_count{{{labels}}} {value['count']}")
+
+
+def render(worker):
+    """Prometheus text exposition of this process plus recent snapshots from sync workers."""
+    cutoff = timezone.now() - timedelta(seconds=settings.METRICS_SNAPSHOT_TTL)
+    MetricsSnapshot.objects.filter(updated_at__lt=cutoff).delete()
+    snapshots = {snapshot.worker: snapshot.data for snapshot in MetricsSnapshot.objects.exclude(worker=worker)}
+    snapshots[worker] = registry.snapshot()
+
+    shared = {
+        "recordings_sync_jobs": {
+            _label_key({"status": row["status"]}): row["n"]
+            for row in SyncJob.objects.values("status").annotate(n=Count("id"))
+        },
+        "recordings_ledger": {
+            _label_key({"status": row["status"]}): row["n"]
+            for row in Recording.objects.values("status").annotate(n=Count("id"))
+        },
+    }
+
+    lines = []
+    for name, (kind, help_text) in HELP.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if name in shared:
+            lines.extend(f"{name}{{{key}}} {value}" for key, value in sorted(shared[name].items()))
+            continue
+        group = {"histogram": "histograms", "counter": "counters", "gauge": "gauges"}[kind]
+        for worker_name, data in sorted(snapshots.items()):
+            _render_series(lines, kind, name, data.get(group, {}).get(name, {}), worker_name)
+    return "\n".join(lines) + "\n"
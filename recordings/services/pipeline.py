@@ -0,0 +1,104 @@
+import logging
+import queue
+import threading
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()  # End-of-input marker passed down each queue
+
+
+class Stage:
+    """One step of a Pipeline: ``workers`` threads calling ``func(item)``.
+
+    ``func`` returns an iterable of items for the next stage (or None). Items
+    wait for this stage in a queue of at most ``queue_size`` entries; when it
+    is full, the stage before blocks, which is what keeps memory and disk use
+    bounded while a slow stage catches up.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue_size = queue_size or self.workers * 2
+
+
+class Pipeline:
+    """Runs items through Stages connected by bounded queues, all stages at once.
+
+    An exception escaping a stage cancels the run: queued items are drained
+    without being processed and ``run`` re-raises the first error. Stages that
+    can fail per item should handle that themselves. ``on_thread_exit`` is
+    called in every worker thread before it ends (e.g. to close its DB
+    connection).
+    """
+
+    def __init__(self, stages, on_thread_exit=None):
+        self.stages = stages
+        self.on_thread_exit = on_thread_exit
+
+    def run(self, items):
+        self._queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        self._remaining = [stage.workers for stage in self.stages]
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._errors = []
+
+        threads = [
+            threading.Thread(target=self._work, args=(index,), name=f"{stage.name}-{n}", daemon=True)
+            for index, stage in enumerate(self.stages)
+            for n in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for item in items:
+                if self._cancelled.is_set():
+                    break
+                self._put(0, item)
+        finally:
+            for _ in range(self.stages[0].workers):
+                self._queues[0].put(_DONE)
+            for thread in threads:
+                thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+    def _put(self, index, item):
+        self._queues[index].put(item)
+        metrics.registry.add_gauge("recordings_queue_depth", 1, stage=self.stages[index].name)
+
+    def _work(self, index):
+        stage = self.stages[index]
+        has_next = index + 1 < len(self.stages)
+        try:
+            while True:
+                item = self._queues[index].get()
+                if item is _DONE:
+                    break
+                metrics.registry.add_gauge("recordings_queue_depth", -1, stage=stage.name)
+                if self._cancelled.is_set():
+                    continue  # Drain, so upstream stages blocked on a full queue can finish
+
+                try:
+                    for result in stage.func(item) or ():
+                        if has_next and not self._cancelled.is_set():
+                            self._put(index + 1, result)
+                except Exception as e:
+                    logger.error(f"Pipeline stage {stage.name} failed: {e}", exc_info=True)
+                    with self._lock:
+                        self._errors.append(e)
+                    self._cancelled.set()
+        finally:
+            with self._lock:
+                self._remaining[index] -= 1
+                last = self._remaining[index] == 0
+            if last and has_next:
+                for _ in range(self.stages[index + 1].workers):
+                    self._queues[index + 1].put(_DONE)
+            if self.on_thread_exit:
+                self.on_thread_exit()
@@ -0,0 +1,109 @@
+import glob
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+from . import zip_stream
+
+logger = logging.getLogger(__name__)
+
+_evict_lock = threading.Lock()
+
+
+def enabled():
+    return settings.RECORDING_CACHE_MAX_BYTES > 0
+
+
+def _entry_base(object_id):
+    """Cache path of ``object_id`` without its extension, fanned out over 256 subdirectories."""
+    fan = hashlib.sha1(object_id.encode()).hexdigest()[:2]
+    return os.path.join(settings.RECORDING_CACHE_DIR, fan, re.sub(r"[^A-Za-z0-9._-]", "_", object_id))
+
+
+def get(object_id):
+    """Path of the cached audio of ``object_id``, or None. A hit counts as a use for LRU eviction."""
+    if not enabled():
+        return None
+    for path in glob.glob(glob.escape(_entry_base(object_id)) + ".*"):
+        if path.endswith(".part"):
+            continue
+        if time.time() - os.path.getmtime(path) > settings.RECORDING_CACHE_MAX_AGE:
+            continue  # Expired, the next eviction removes it
+        try:
+            os.utime(path)  # The modification time doubles as the last-used time
+        except OSError:
+            continue  # Evicted meanwhile
+        return path
+    return None
+
+
+def put(object_id, source):
+    """Copy a recording (a path or a ZipMember) into the cache and return its cached path.
+
+    The file is written under a temporary name and renamed into place, so
+    readers in other threads or processes never see a partial file; the
+    temporary file is removed when the copy fails.
+    """
+    name = source.upload_name if isinstance(source, zip_stream.ZipMember) else os.path.basename(source)
+    path = _entry_base(object_id) + os.path.splitext(name)[1].lower()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part = None
+    try:
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".part", delete=False) as dst:
+            part = dst.name
+            if isinstance(source, zip_stream.ZipMember):
+                source.copy_to(dst)  # From its spooled copy, which the upload reads too
+            else:
+                with open(source, "rb") as src:
+                    shutil.copyfileobj(src, dst, settings.DOWNLOAD_CHUNK_SIZE)
+        os.replace(part, path)
+    finally:
+        if part and os.path.exists(part):
+            os.remove(part)  # The copy failed; don't leave the partial file for eviction to find
+    return path
+
+
+def evict():
+    """Trim the cache and return the number of bytes freed.
+
+    Entries unused for RECORDING_CACHE_MAX_AGE seconds go first, then the
+    least recently used ones until the cache fits in RECORDING_CACHE_MAX_BYTES.
+    """
+    if not os.path.isdir(settings.RECORDING_CACHE_DIR):
+        return 0
+    with _evict_lock:
+        entries = []
+        for root, _, files in os.walk(settings.RECORDING_CACHE_DIR):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+        for mtime, size, path in sorted(entries):  # Least recently used first
+            stale = now - mtime > settings.RECORDING_CACHE_MAX_AGE
+            if not stale and total - freed <= settings.RECORDING_CACHE_MAX_BYTES:
+                break
+            if path.endswith(".part") and not stale:
+                continue  # Still being written
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            freed += size
+
+    if freed:
+        logger.info(f"Evicted {freed} bytes from the recording cache")
+    return freed
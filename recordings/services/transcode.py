@@ -0,0 +1,132 @@
+import logging
+import mimetypes
+import multiprocessing
+import os
+import shutil
+import subprocess
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+from . import zip_stream
+
+logger = logging.getLogger(__name__)
+
+# Output extension and ffmpeg encoder for each TRANSCODE_FORMAT
+FORMATS = {
+    "opus": (".ogg", "libopus"),
+    "mp3": (".mp3", "libmp3lame"),
+}
+
+CONTENT_TYPES = {
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".ogg": "audio/ogg",
+    ".opus": "audio/ogg",
+}
+
+_pool = None
+
+
+def content_type(name):
+    """MIME type to upload a recording with, based on its file name."""
+    extension = os.path.splitext(name)[1].lower()
+    return CONTENT_TYPES.get(extension) or mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # Spawned, not forked: the parent runs upload and region threads
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.TRANSCODE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def _encode(ffmpeg, source, output, codec, bitrate):
+    """Encode one recording to mono ``codec``. Runs in a pool process.
+
+    ``source`` is a file path or a ``(zip_path, member_name)`` pair that is
+    piped to ffmpeg straight out of the archive. Returns the input and output
+    sizes in bytes.
+    """
+    args = [ffmpeg, "-hide_banner", "-loglevel", "error", "-y", "-i", "pipe:0" if isinstance(source, tuple) else source,
+            "-vn", "-ac", "1", "-c:a", codec, "-b:a", bitrate, output]
+    if not isinstance(source, tuple):
+        subprocess.run(args, check=True)
+        return os.path.getsize(source), os.path.getsize(output)
+
+    zip_path, name = source
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        original_size = zip_ref.getinfo(name).file_size
+        with zip_ref.open(name) as member:
+            process = subprocess.Popen(args, stdin=subprocess.PIPE)
+            try:
+                shutil.copyfileobj(member, process.stdin)
+            except BrokenPipeError:
+                pass  # ffmpeg gave up early, its exit code says why
+            finally:
+                process.stdin.close()
+    if process.wait():
+        raise subprocess.CalledProcessError(process.returncode, args)
+    return original_size, os.path.getsize(output)
+
+
+def _source_name(source):
+    return source.upload_name if isinstance(source, zip_stream.ZipMember) else os.path.basename(source)
+
+
+def transcode_many(sources, workdir):
+    """Re-encode recordings to mono TRANSCODE_FORMAT at TRANSCODE_BITRATE in a process pool.
+
+    Only recordings with one of the TRANSCODE_EXTENSIONS are converted; their
+    encoded copies are written to ``workdir``, keeping the upload name apart
+    from the extension. Returns ``(sources, stats)``: the list to upload in
+    the same order (originals where nothing was, or could be, converted) and
+    ``{"transcoded", "bytes_before", "bytes_after"}``.
+    """
+    stats = {"transcoded": 0, "bytes_before": 0, "bytes_after": 0}
+    extension, codec = FORMATS[settings.TRANSCODE_FORMAT]
+    extensions = tuple(ext.lower() for ext in settings.TRANSCODE_EXTENSIONS)
+    todo = [i for i, source in enumerate(sources) if _source_name(source).lower().endswith(extensions)]
+    if not todo:
+        return list(sources), stats
+
+    ffmpeg = shutil.which(settings.FFMPEG_BINARY)
+    if not ffmpeg:
+        logger.warning("TRANSCODE_RECORDINGS is on but ffmpeg was not found, uploading recordings as they are")
+        return list(sources), stats
+
+    os.makedirs(workdir, exist_ok=True)
+    futures = {}
+    for i in todo:
+        source = sources[i]
+        output = os.path.join(workdir, os.path.splitext(_source_name(source))[0] + extension)
+        if isinstance(source, zip_stream.ZipMember):
+            source = (source.zip_path, source.name)
+        futures[i] = (output, _get_pool().submit(
+            _encode, ffmpeg, source, output, codec, settings.TRANSCODE_BITRATE,
+        ))
+
+    transcoded = list(sources)
+    for i, (output, future) in futures.items():
+        try:
+            before, after = future.result()
+        except Exception as e:
+            logger.error(f"Error transcoding {sources[i]}: {e}", exc_info=True)
+            continue
+        transcoded[i] = output
+        stats["transcoded"] += 1
+        stats["bytes_before"] += before
+        stats["bytes_after"] += after
+
+    if stats["bytes_before"]:
+        saved = stats["bytes_before"] - stats["bytes_after"]
+        logger.info(
+            f"Transcoded {stats['transcoded']} recordings: {stats['bytes_before']} -> {stats['bytes_after']} bytes "
+            f"({saved / stats['bytes_before']:.0%} smaller)"
+        )
+    return transcoded, stats
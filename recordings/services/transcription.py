@@ -0,0 +1,191 @@
+import abc
+import logging
+import math
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import openai
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import metrics, zip_stream
+from .rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Caps API calls across every recording and segment being transcribed at once
+_api_slots = threading.BoundedSemaphore(settings.TRANSCRIPTION_CONCURRENCY)
+_limiter = TokenBucket(rate=settings.TRANSCRIPTION_RATE_LIMIT, capacity=settings.TRANSCRIPTION_CONCURRENCY)
+_backend = None
+
+
+class TranscriptionError(Exception):
+    """A recording could not be prepared for transcription."""
+
+
+class TranscriptionBackend(abc.ABC):
+    """Turns one audio file into text. Point TRANSCRIPTION_BACKEND at a subclass to swap it."""
+
+    @abc.abstractmethod
+    def transcribe(self, audio_file):
+        """Return the text spoken in ``audio_file``, an open binary file."""
+
+
+class OpenAIWhisperBackend(TranscriptionBackend):
+    """OpenAI's hosted Whisper API."""
+
+    def transcribe(self, audio_file):
+        response = openai.Audio.transcribe(settings.TRANSCRIPTION_MODEL, audio_file, api_key=settings.OPENAI_API_KEY)
+        return response.get("text", "")
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.TRANSCRIPTION_BACKEND)()
+    return _backend
+
+
+def _ffmpeg():
+    return shutil.which(settings.FFMPEG_BINARY)
+
+
+def _run_ffmpeg(*args):
+    subprocess.run([_ffmpeg(), "-hide_banner", "-loglevel", "error", "-y", *args], check=True)
+
+
+@contextmanager
+def _local_path(source, workdir):
+    """Yield a file path for a path or a ZipMember (spooled out of the archive)."""
+    if not isinstance(source, zip_stream.ZipMember):
+        yield source
+        return
+    path = os.path.join(workdir, source.filename)
+    with source.open() as member, open(path, "wb") as f:
+        shutil.copyfileobj(member, f)
+    yield path
+
+
+def _duration(path):
+    """Length of the recording in seconds."""
+    if path.lower().endswith(".wav"):
+        with wave.open(path, "rb") as wav:
+            return wav.getnframes() / wav.getframerate()
+    if not _ffmpeg():
+        raise TranscriptionError(f"ffmpeg is needed to measure {path}")
+    ffprobe = os.path.join(os.path.dirname(_ffmpeg()), "ffprobe")
+    output = subprocess.run(
+        [ffprobe, "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return float(output.strip())
+
+
+def _downmix(path, workdir):
+    """Convert to 16 kHz mono MP3, which is all speech recognition needs."""
+    out = os.path.join(workdir, "downmixed.mp3")
+    _run_ffmpeg("-i", path, "-ac", "1", "-ar", "16000", "-b:a", settings.TRANSCRIPTION_BITRATE, out)
+    return out
+
+
+def _cut(path, start, length, out):
+    """Write ``length`` seconds of ``path`` starting at ``start`` to ``out``."""
+    if _ffmpeg():
+        _run_ffmpeg("-ss", f"{start:.3f}", "-t", f"{length:.3f}", "-i", path, "-c", "copy", out)
+        return
+    if not path.lower().endswith(".wav"):
+        raise TranscriptionError(f"ffmpeg is needed to split {path}")
+    with wave.open(path, "rb") as src, wave.open(out, "wb") as dst:
+        dst.setparams(src.getparams())
+        src.setpos(int(start * src.getframerate()))
+        dst.writeframes(src.readframes(int(length * src.getframerate())))
+
+
+def split_audio(path, workdir):
+    """Split a recording larger than TRANSCRIPTION_MAX_BYTES into overlapping segments."""
+    size = os.path.getsize(path)
+    if size <= settings.TRANSCRIPTION_MAX_BYTES:
+        return [path]
+
+    duration = _duration(path)
+    overlap = settings.TRANSCRIPTION_SEGMENT_OVERLAP
+    count = math.ceil(size / settings.TRANSCRIPTION_MAX_BYTES * 1.1)  # 10% headroom for the overlap
+    step = duration / count
+    extension = os.path.splitext(path)[1]
+
+    segments = []
+    for i in range(count):
+        start = max(0.0, i * step - overlap)
+        out = os.path.join(workdir, f"segment_{i:03d}{extension}")
+        _cut(path, start, step + overlap, out)
+        segments.append(out)
+    return segments
+
+
+def _words(text):
+    return [re.sub(r"\W", "", word.lower()) for word in text.split()]
+
+
+def stitch(texts, max_overlap_words=40):
+    """Join segment transcripts, dropping the words repeated by the overlapping audio."""
+    words = texts[0].split() if texts else []
+    for text in texts[1:]:
+        following = text.split()
+        tail, head = _words(" ".join(words[-max_overlap_words:])), _words(text)
+        overlap = 0
+        for k in range(min(len(tail), len(head)), 0, -1):
+            if tail[-k:] == head[:k]:
+                overlap = k
+                break
+        words.extend(following[overlap:])
+    return " ".join(words)
+
+
+def _transcribe_file(path, backend):
+    with _api_slots:
+        _limiter.acquire()
+        with open(path, "rb") as audio_file:
+            return backend.transcribe(audio_file)
+
+
+def transcribe(source, backend=None):
+    """Transcribe one recording (a path or a ZipMember).
+
+    The audio is optionally downmixed to 16 kHz mono first, and recordings over
+    the API's size limit are split into overlapping segments that are
+    transcribed in parallel and stitched back together in order.
+    """
+    backend = backend or get_backend()
+    with metrics.span("transcribe"), tempfile.TemporaryDirectory() as workdir, _local_path(source, workdir) as path:
+        if settings.TRANSCRIPTION_DOWNMIX and _ffmpeg():
+            path = _downmix(path, workdir)
+
+        segments = split_audio(path, workdir)
+        if len(segments) == 1:
+            return _transcribe_file(segments[0], backend)
+
+        with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+            texts = list(executor.map(lambda segment: _transcribe_file(segment, backend), segments))
+        return stitch(texts)
+
+
+def transcribe_many(sources, backend=None):
+    """Transcribe several recordings concurrently. Returns texts in order, None where one failed."""
+    backend = backend or get_backend()
+
+    def safe_transcribe(source):
+        try:
+            return transcribe(source, backend)
+        except Exception as e:
+            logger.error(f"Error transcribing {source}: {e}", exc_info=True)
+            return None
+
+    with ThreadPoolExecutor(max_workers=settings.TRANSCRIPTION_CONCURRENCY) as executor:
+        return list(executor.map(safe_transcribe, sources))
@@ -0,0 +1,211 @@
+import re
+import unicodedata
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField, Q
+from django.db.models.expressions import RawSQL
+
+from ..models import Recording, Transcript
+from .cache import TTLCache
+from .crm_lookup import normalize_phone
+
+FTS_TABLE = "recordings_transcript_fts"
+VOCAB_TABLE = "recordings_transcript_fts_vocab"
+
+STORED_FIELDS = ("phone_number", "entity_type", "entity_id", "call_time", "text", "sentiment", "score", "feedback")
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# prefix -> the indexed words it stands for
+_prefix_cache = TTLCache(ttl=settings.SEARCH_PREFIX_CACHE_TTL)
+
+
+class QueryError(ValueError):
+    """A search the index cannot answer quickly, or a malformed cursor; the message is meant for the user."""
+
+
+def _has_fts():
+    return connection.vendor == "sqlite"
+
+
+def save(entries):
+    """Store transcripts and their analysis, replacing earlier ones for the same recordings.
+
+    ``entries`` maps object IDs to dicts of STORED_FIELDS values; recordings
+    missing from the ledger are ignored.
+    """
+    pks = dict(Recording.objects.filter(object_id__in=list(entries)).values_list("object_id", "pk"))
+    rows = [Transcript(recording_id=pks[object_id], **entry) for object_id, entry in entries.items() if object_id in pks]
+    Transcript.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=["recording"], update_fields=[*STORED_FIELDS, "updated_at"],
+    )
+    return len(rows)
+
+
+def _terms(query):
+    terms = [term for term in re.findall(r"[\w*]+", query) if term.strip("*")]
+    for term in terms:
+        if term.endswith("*") and len(term.strip("*")) < settings.SEARCH_MIN_PREFIX:
+            raise QueryError(f"{term} is too short; type at least {settings.SEARCH_MIN_PREFIX} letters before the *")
+    return terms
+
+
+def _fold(word):
+    """``word`` the way the FTS5 tokenizer stores it: lowercase and without diacritics."""
+    decomposed = unicodedata.normalize("NFKD", word.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def _expand_prefix(prefix):
+    """The indexed words starting with ``prefix``, at most SEARCH_MAX_PREFIX_TERMS of them."""
+    words = _prefix_cache.get(prefix)
+    if words is None:
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT term FROM {VOCAB_TABLE} WHERE term >= %s AND term < %s LIMIT %s",
+                [prefix, upper, settings.SEARCH_MAX_PREFIX_TERMS + 1],
+            )
+            words = [row[0] for row in cursor.fetchall()]
+        _prefix_cache.set(prefix, words)
+    if len(words) > settings.SEARCH_MAX_PREFIX_TERMS:
+        raise QueryError(f"{prefix}* matches too many words; type more of the word")
+    return words
+
+
+def fts_query(query):
+    """Turn free text into an FTS5 query matching every word (``word*`` matches prefixes).
+
+    Each word is quoted, so FTS5 operators and punctuation typed by a user can
+    never make the query invalid. A ``word*`` becomes the OR of the words it
+    stands for (see ``_expand_prefix``); returns "" when one of them stands
+    for no word at all, since nothing can match. Raises QueryError for a
+    prefix that is too short or too common.
+    """
+    parts = []
+    for term in _terms(query):
+        if not term.endswith("*"):
+            parts.append(f'"{term.strip("*")}"')
+            continue
+        words = _expand_prefix(_fold(term.strip("*")))
+        if not words:
+            return ""
+        parts.append("(" + " OR ".join(f'"{word}"' for word in words) + ")")
+    return " AND ".join(parts)
+
+
+def _match_count(match, limit):
+    """Number of transcripts matching ``match``, counting no further than ``limit``."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT count(*) FROM (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s LIMIT %s)",
+            [match, limit],
+        )
+        return cursor.fetchone()[0]
+
+
+def _encode_cursor(transcript):
+    micros = "" if transcript.call_time is None else str((transcript.call_time - EPOCH) // timedelta(microseconds=1))
+    return f"{micros}.{transcript.pk}"
+
+
+def _after_cursor(cursor):
+    """Filter for the transcripts after ``cursor`` in newest-call-first order (calls without a time last)."""
+    try:
+        micros, _, pk = cursor.partition(".")
+        pk = int(pk)
+        call_time = EPOCH + timedelta(microseconds=int(micros)) if micros else None
+    except (ValueError, OverflowError):
+        raise QueryError("Invalid cursor")
+    if call_time is None:
+        return Q(call_time__isnull=True, id__lt=pk)
+    # The plain range on call_time lets the call-time index do the skipping
+    return Q(call_time__lte=call_time) & (Q(call_time__lt=call_time) | Q(id__lt=pk)) | Q(call_time__isnull=True)
+
+
+def search(query="", phone="", lead="", since=None, until=None, sentiment="", cursor="", limit=20):
+    """One page of the transcripts matching every word of ``query`` and the filters, newest calls first.
+
+    ``lead`` matches the Bitrix24 entity ID the recording was attached to.
+    Pages are keyed on (call time, ID): pass the ``next_cursor`` of one page
+    as ``cursor`` to get the next, which costs the same however deep it is.
+    Returns ``(count, exact, transcripts, next_cursor)``; ``count`` stops at
+    SEARCH_COUNT_LIMIT (``exact`` is then False) and ``next_cursor`` is None
+    on the last page. Raises QueryError for a bad cursor or prefix.
+
+    On SQLite the words are looked up in the FTS5 index. The matching
+    transcripts are collected first, then probed while walking the call-time
+    index; very common words are instead checked row by row, which finds a
+    page of them quickly. Other databases fall back to case-insensitive
+    lookups, which scan the table.
+    """
+    transcripts = Transcript.objects.select_related("recording")
+    filtered = bool(phone or lead or since or until or sentiment)
+    if phone:
+        transcripts = transcripts.filter(phone_number=normalize_phone(phone))
+    if lead:
+        transcripts = transcripts.filter(entity_id=lead)
+    if since:
+        transcripts = transcripts.filter(call_time__gte=since)
+    if until:
+        transcripts = transcripts.filter(call_time__lt=until)
+    if sentiment:
+        transcripts = transcripts.filter(sentiment=sentiment.capitalize())
+
+    count = exact = None
+    if query and _has_fts():
+        match = fts_query(query)
+        if not match:
+            return 0, True, [], None
+        matches = _match_count(match, settings.SEARCH_MATERIALIZE_LIMIT + 1)
+        if matches > settings.SEARCH_MATERIALIZE_LIMIT and " OR " not in match:
+            # Common words: check rows one by one while walking the call-time index. Not for
+            # expanded prefixes, whose many small doclists make each check slow.
+            transcripts = transcripts.alias(hit=RawSQL(
+                f"EXISTS (SELECT 1 FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"AND rowid = {Transcript._meta.db_table}.id)",
+                [match], output_field=BooleanField(),
+            )).filter(hit=True)
+        else:
+            # Collect the matching IDs up front; the unary + keeps SQLite walking the call-time
+            # index and probing the IDs, instead of fetching every matching row to sort it
+            transcripts = transcripts.alias(hit=RawSQL(
+                f"+{Transcript._meta.db_table}.id IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)",
+                [match], output_field=BooleanField(),
+            )).filter(hit=True)
+        if not filtered:
+            count = _match_count(match, settings.SEARCH_COUNT_LIMIT)
+            exact = count < settings.SEARCH_COUNT_LIMIT
+    elif query:
+        for term in _terms(query):
+            term = term.strip("*")
+            transcripts = transcripts.filter(Q(text__icontains=term) | Q(feedback__icontains=term))
+
+    if count is None:
+        count = transcripts.order_by()[:settings.SEARCH_COUNT_LIMIT].count()
+        exact = count < settings.SEARCH_COUNT_LIMIT
+    if cursor:
+        transcripts = transcripts.filter(_after_cursor(cursor))
+    page = list(transcripts.order_by("-call_time", "-id")[:limit + 1])
+    next_cursor = _encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return count, exact, page[:limit], next_cursor
+
+
+def snippets(transcripts, query, words=16):
+    """``{transcript pk: text excerpt with the matches in [brackets]}`` for one page of results."""
+    ids = [transcript.pk for transcript in transcripts]
+    if not ids or not _has_fts():
+        return {}
+    match = fts_query(query)
+    if not match:
+        return {}
+    placeholders = ",".join(["%s"] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, snippet({FTS_TABLE}, -1, '[', ']', '...', %s) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND rowid IN ({placeholders})",
+            [words, match, *ids],
+        )
+        return dict(cursor.fetchall())
@@ -0,0 +1,109 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import zipfile
+
+from django.conf import settings
+
+AUDIO_EXTENSIONS = (".mp3", ".wav")
+
+
+class ZipMember:
+    """An audio file inside a downloaded ZIP, uploaded without extracting it to disk."""
+
+    def __init__(self, zip_path, name):
+        self.zip_path = zip_path
+        self.name = name
+        self.sha256 = None  # Filled in the first time the member is read
+        self.upload_name = self.filename  # Name the file gets in Bitrix24
+        self._spooled = None
+
+    @property
+    def filename(self):
+        return os.path.basename(self.name)
+
+    def spool(self):
+        """Copy the member into a spooled buffer (in memory up to ZIP_SPOOL_MAX_BYTES), hashing it on the way.
+
+        Later reads use the copy instead of the archive. Returns the SHA-256.
+        """
+        if self._spooled is None:
+            spooled = tempfile.SpooledTemporaryFile(max_size=settings.ZIP_SPOOL_MAX_BYTES)
+            digest = hashlib.sha256()
+            # A ZipFile per read keeps concurrent readers from sharing a file position
+            with zipfile.ZipFile(self.zip_path, "r") as zip_ref, zip_ref.open(self.name) as member:
+                for chunk in iter(lambda: member.read(settings.DOWNLOAD_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    spooled.write(chunk)
+            self._spooled, self.sha256 = spooled, digest.hexdigest()
+        return self.sha256
+
+    def copy_to(self, dst):
+        """Write the member's contents to the file ``dst``, keeping the spooled copy for ``open``."""
+        self.spool()
+        self._spooled.seek(0)
+        shutil.copyfileobj(self._spooled, dst, settings.DOWNLOAD_CHUNK_SIZE)
+
+    def open(self):
+        """The spooled copy of the member, rewound; the caller closes it.
+
+        The copy is handed over, so a second ``open`` reads the archive again.
+        """
+        self.spool()
+        spooled, self._spooled = self._spooled, None
+        spooled.seek(0)
+        return spooled
+
+    def __str__(self):
+        return f"{self.zip_path}:{self.name}"
+
+
+def iter_audio_members(zip_path):
+    """Yield a ZipMember for every MP3/WAV file in the archive."""
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        names = [info.filename for info in zip_ref.infolist() if not info.is_dir()]
+    for name in names:
+        if name.lower().endswith(AUDIO_EXTENSIONS):
+            yield ZipMember(zip_path, name)
+
+
+def extract_audio(zip_path, extract_dir):
+    """Extract the archive's MP3/WAV files below ``extract_dir``, hashing them as they are written.
+
+    Returns ``{path: SHA-256}`` sorted by path.
+    """
+    checksums = {}
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        for info in zip_ref.infolist():
+            if info.is_dir() or not info.filename.lower().endswith(AUDIO_EXTENSIONS):
+                continue
+            # Like ZipFile.extract, never write outside extract_dir
+            parts = [part for part in info.filename.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+            path = os.path.join(extract_dir, *parts)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            digest = hashlib.sha256()
+            with zip_ref.open(info) as member, open(path, "wb") as f:
+                for chunk in iter(lambda: member.read(settings.DOWNLOAD_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    f.write(chunk)
+            checksums[path] = digest.hexdigest()
+    return dict(sorted(checksums.items()))
+
+
+def open_audio(source):
+    """Open a recording given either a file path or a ZipMember."""
+    if isinstance(source, ZipMember):
+        return source.open()
+    return open(source, "rb")
+
+
+def cleanup(*paths):
+    """Remove downloaded archives and extraction folders once they have been synced."""
+    for path in paths:
+        if not path or not os.path.exists(path):
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
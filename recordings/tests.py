@@ -1,3 +1,1070 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import wave
+import zipfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone as django_timezone
+
+from .fake_apis import FakeApis
+from .models import MetricsSnapshot, Recording, SyncCheckpoint, SyncJob, TranscriptAnalysis
+from .services import (
+    analysis, api_service, auth, bitrix_batch, bitrix_client, bitrix_folders, bitrix_upload, crm_lookup, http_client,
+    jobs, ledger, metrics, recording_cache, transcode, transcription, transcripts,
+)
+from .services import pipeline, rate_limit
+from .services.rate_limit import TokenBucket
+from .services.resilience import CircuitBreaker, CircuitOpenError
+
+
+class FakeApisTestCase(TransactionTestCase):
+    """Runs the real pipeline against the local 8x8 and Bitrix24 stand-ins in a scratch directory.
+
+    A TransactionTestCase, since the pipeline's worker threads use their own
+    database connections.
+    """
+
+    recordings = 20
+
+    def setUp(self):
+        self.fake = FakeApis(recordings=self.recordings, regions=("us-east",), bulk_delay=0, lead_ratio=1.0)
+        base_url = self.fake.start()
+        self.addCleanup(self.fake.stop)
+
+        workdir = tempfile.mkdtemp(prefix="recordings-test-")
+        self.addCleanup(shutil.rmtree, workdir, True)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(workdir)  # Bulk ZIPs and extracted files land in the working directory
+
+        overrides = override_settings(
+            EIGHTX8_API_URL=f"{base_url}/8x8",
+            BITRIX24_API_URL=f"{base_url}/bitrix",
+            TRANSCRIBE_RECORDINGS=False,
+            TRANSCODE_RECORDINGS=False,
+            RECORDING_CACHE_DIR=os.path.join(workdir, "cache"),
+            BULK_POLL_INITIAL=0.01,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        api_service._regions_cache.clear()
+        api_service.token_manager.invalidate()
+        crm_lookup.clear_cache()
+        bitrix_folders.invalidate()
+        self.addCleanup(setattr, bitrix_client, "limiter", bitrix_client.limiter)
+        bitrix_client.limiter = TokenBucket(rate=1e9, capacity=1e9)
+
+    def add_object(self, object_id, created):
+        """Make a new recording created at ``created`` available in the fake 8x8 account."""
+        self.fake.objects["us-east"].append({
+            "id": object_id,
+            "objectName": f"{created:%Y%m%d-%H%M%S}_+1666{len(object_id):07d}_call.wav",
+            "type": "callcenterrecording",
+            "objectState": "AVAILABLE",
+            "createdTime": int(created.timestamp() * 1000),
+            "size": self.fake.recording_bytes,
+        })
+
+
+class FolderLayoutTests(SimpleTestCase):
+    @override_settings(BITRIX24_FOLDER_LAYOUT="Recordings/%Y-%m-%d/{agent}", TIME_ZONE="America/New_York")
+    def test_path_uses_call_date_in_time_zone_and_agent(self):
+        call_time = datetime(2024, 3, 2, 2, 30, tzinfo=timezone.utc)  # Still March 1st in New York
+        self.assertEqual(bitrix_folders.subfolder_path(call_time, "Jane/Doe"), "Recordings/2024-03-01/Jane-Doe")
+        self.assertEqual(bitrix_folders.subfolder_path(call_time), "Recordings/2024-03-01/unknown")
+
+    @override_settings(BITRIX24_FOLDER_LAYOUT="")
+    def test_no_layout_uploads_to_the_storage_root(self):
+        self.assertEqual(bitrix_folders.subfolder_path(datetime.now(timezone.utc), "Jane"), "")
+
+    @override_settings(BITRIX24_FOLDER_AGENT_TAGS=["agentName", "agentId"])
+    def test_agent_comes_from_the_first_configured_tag(self):
+        obj = {"tags": [{"key": "agentId", "value": "42"}, {"key": "agentName", "value": "Jane"}]}
+        self.assertEqual(ledger.object_agent(obj), "Jane")
+        self.assertEqual(ledger.object_agent({"tags": [{"key": "agentId", "value": "42"}]}), "42")
+        self.assertEqual(ledger.object_agent({}), "")
+
+    @override_settings(BITRIX24_FOLDER_LAYOUT="Recordings/%Y-%m-%d/{agent}", TIME_ZONE="UTC")
+    def test_each_recording_goes_to_the_folder_of_its_call(self):
+        objects = {
+            "a.wav": {"id": "a", "createdTime": "2024-03-01T10:00:00Z", "tags": [{"key": "agentName", "value": "Jane"}]},
+            "b.wav": {"id": "b", "createdTime": "2024-03-02T10:00:00Z", "tags": [{"key": "agentName", "value": "Joe"}]},
+        }
+        entity = {"entity_type": "lead", "entity_id": "1"}
+        with mock.patch.object(api_service.crm_lookup, "resolve_entities", return_value={"+1": entity, "+2": entity}), \
+                mock.patch.object(api_service, "upload_mp3", side_effect=lambda path, folder: f"{folder}/{path}") as upload, \
+                mock.patch.object(api_service.bitrix_batch, "attach_files_and_comments", return_value=({}, {})):
+            api_service.upload_recordings_to_bitrix24(
+                [("a.wav", "+1", None), ("b.wav", "+2", None)], folders=api_service._upload_folders(objects),
+            )
+        self.assertCountEqual(
+            [call.args[1] for call in upload.call_args_list],
+            ["Recordings/2024-03-01/Jane", "Recordings/2024-03-02/Joe"],
+        )
+
+
+class BitrixFolderTests(FakeApisTestCase):
+    recordings = 0
+
+    def test_folders_are_created_below_the_storage_root_folder(self):
+        folder_id = bitrix_folders.get_folder_id("Recordings/2024-03-01")
+        self.assertEqual(self.fake.folder_path(folder_id), "Recordings/2024-03-01")
+        bitrix_folders.invalidate()
+        self.assertEqual(bitrix_folders.get_folder_id("Recordings/2024-03-01"), folder_id)  # Found, not created again
+        self.assertEqual(bitrix_folders.get_folder_id(""), self.fake.root_folder_id)
+        self.assertIn("/upload/", api_service._request_upload_url("Recordings/2024-03-01"))
+
+
+class LedgerTests(TestCase):
+    def _row(self, object_id, status, created=None, **fields):
+        return Recording.objects.create(
+            object_id=object_id, region="us-east", status=status,
+            created_time=created or django_timezone.now() - timedelta(days=1), **fields,
+        )
+
+    def test_found_objects_skip_finished_rows(self):
+        self._row("attached", Recording.Status.ATTACHED)
+        self._row("pending", Recording.Status.PENDING)
+        self._row("given-up", Recording.Status.FAILED, attempts=99)
+        objects = [{"id": object_id} for object_id in ("attached", "pending", "given-up", "new")]
+        self.assertEqual([obj["id"] for obj in ledger.record_found("us-east", objects)], ["pending", "new"])
+        self.assertTrue(Recording.objects.filter(object_id="new", status=Recording.Status.PENDING).exists())
+
+    @override_settings(SYNC_RETRY_BACKOFF=60, SYNC_MAX_ATTEMPTS=3)
+    def test_failures_back_off_exponentially_until_given_up(self):
+        self._row("flaky", Recording.Status.PENDING)
+        delays = []
+        for _ in range(3):
+            before = django_timezone.now()
+            ledger.mark(["flaky"], Recording.Status.FAILED)
+            retry_at = Recording.objects.get(object_id="flaky").next_retry_at
+            delays.append(round((retry_at - before).total_seconds()) if retry_at else None)
+        self.assertEqual(delays, [60, 120, None])
+
+    def test_only_due_failures_are_retried(self):
+        now = django_timezone.now()
+        self._row("due", Recording.Status.FAILED, attempts=1, next_retry_at=now - timedelta(seconds=1))
+        self._row("waiting", Recording.Status.FAILED, attempts=1, next_retry_at=now + timedelta(hours=1))
+        self.assertEqual(ledger.retryable_ids("us-east"), ["due"])
+        found = ledger.record_found("us-east", [{"id": "due"}, {"id": "waiting"}])
+        self.assertEqual([obj["id"] for obj in found], ["due"])
+
+    def test_no_checkpoint_until_a_sweep_completes(self):
+        self._row("attached", Recording.Status.ATTACHED)  # E.g. synced alone through the recording endpoint
+        self.assertIsNone(ledger.sweep_since("us-east"))
+
+    @override_settings(SYNC_SWEEP_OVERLAP=600)
+    def test_next_sweep_overlaps_the_last_one(self):
+        started = django_timezone.now()
+        ledger.finish_sweep("us-east", None, started)
+        self.assertEqual(ledger.sweep_since("us-east"), started - timedelta(seconds=600))
+        self.assertIsNone(ledger.sweep_since("us-east", (0, 2)))  # Each shard has its own checkpoint
+        self.assertIsNone(ledger.sweep_since("eu-west"))
+
+    def test_unfinished_recordings_hold_the_checkpoint_back(self):
+        created = django_timezone.now() - timedelta(days=3)
+        self._row("pending", Recording.Status.PENDING, created=created)
+        self.assertEqual(ledger.finish_sweep("us-east", None, django_timezone.now()), created)
+
+
+    def test_leases_keep_other_runs_out_until_they_expire(self):
+        for object_id in ("a", "b"):
+            self._row(object_id, Recording.Status.PENDING)
+        objects = [{"id": "a"}, {"id": "b"}]
+        self.assertEqual(ledger.lease(objects, "run-1"), objects)
+        self.assertEqual(ledger.lease(objects, "run-2"), [])
+
+        Recording.objects.filter(object_id="a").update(lease_expires_at=django_timezone.now() - timedelta(seconds=1))
+        self.assertEqual(ledger.lease(objects, "run-2"), [{"id": "a"}])  # Expired, so "run-1" is presumed gone
+        ledger.mark(["b"], Recording.Status.ATTACHED)
+        self.assertEqual(ledger.lease(objects, "run-3"), [{"id": "b"}])  # Released when it was finished
+
+
+class SweepTests(FakeApisTestCase):
+    def test_targeted_sync_does_not_hide_older_recordings_from_the_sweep(self):
+        newest = self.fake.objects["us-east"][-1]["id"]
+        result = api_service.fetch_and_download_call_recordings(newest)
+        self.assertEqual(result["summary"]["attached"], 1)
+        self.assertFalse(SyncCheckpoint.objects.exists())
+
+        result = api_service.fetch_and_download_call_recordings()
+        self.assertEqual(result["summary"]["found"], self.recordings)
+        self.assertEqual(result["summary"]["attached"], self.recordings - 1)
+        self.assertEqual(Recording.objects.filter(status=Recording.Status.ATTACHED).count(), self.recordings)
+
+    @override_settings(WEBHOOK_SECRET="s3cret", SYNC_BATCH_WINDOW=0)
+    def test_webhook_for_a_new_recording_before_the_first_sweep(self):
+        self.add_object("new", django_timezone.now() - timedelta(minutes=1))
+        response = self.client.post(
+            "/recordings/webhook/", {"id": "new"}, content_type="application/json", HTTP_X_WEBHOOK_TOKEN="s3cret",
+        )
+        self.assertEqual(response.status_code, 202)
+        call_command("run_sync_worker", "--once", stdout=io.StringIO())
+        self.assertEqual(Recording.objects.get(object_id="new").status, Recording.Status.ATTACHED)
+        self.assertFalse(SyncCheckpoint.objects.exists())
+
+        result = api_service.fetch_and_download_call_recordings()
+        self.assertEqual(result["summary"]["attached"], self.recordings)
+        self.assertEqual(Recording.objects.filter(status=Recording.Status.ATTACHED).count(), self.recordings + 1)
+
+    def test_sweep_picks_up_recordings_that_became_available_late(self):
+        api_service.fetch_and_download_call_recordings()
+        self.add_object("late", django_timezone.now() - timedelta(minutes=10))  # Created before the sweep ran
+
+        result = api_service.fetch_and_download_call_recordings()
+        self.assertEqual(result["summary"]["found"], 1)  # Only the overlap window is listed again
+        self.assertEqual(result["summary"]["attached"], 1)
+        self.assertEqual(Recording.objects.get(object_id="late").status, Recording.Status.ATTACHED)
+
+
+class SyncCommandTests(FakeApisTestCase):
+    def _attached(self):
+        return set(Recording.objects.filter(status=Recording.Status.ATTACHED).values_list("object_id", flat=True))
+
+    def test_shards_split_the_recordings_between_them(self):
+        call_command("sync_recordings", "--shard", "0/2", stdout=io.StringIO())
+        first = self._attached()
+        call_command("sync_recordings", "--shard", "1/2", stdout=io.StringIO())
+        second = self._attached() - first
+
+        self.assertTrue(first and second)
+        self.assertFalse(first & second)
+        self.assertEqual(first | second, {obj["id"] for obj in self.fake.objects["us-east"]})
+        self.assertEqual(self.fake.calls["bitrix upload"], self.recordings)
+
+    def test_workers_take_sub_shards_of_their_shard(self):
+        process = mock.Mock(**{"wait.return_value": 0})
+        with mock.patch("subprocess.Popen", return_value=process) as popen:
+            call_command("sync_recordings", "--shard", "1/2", "--workers", "2", stdout=io.StringIO())
+        shards = [call.args[0][call.args[0].index("--shard") + 1] for call in popen.call_args_list]
+        self.assertEqual(shards, ["1/4", "3/4"])
+        for obj in self.fake.objects["us-east"]:
+            in_workers = [ledger.in_shard(obj["id"], (index, 4)) for index in (1, 3)]
+            self.assertEqual(sum(in_workers), int(ledger.in_shard(obj["id"], (1, 2))))
+
+    def test_backfill_resumes_after_the_last_finished_slice(self):
+        since = ledger.parse_8x8_time(self.fake.objects["us-east"][0]["createdTime"])
+        args = [
+            "--since", since.isoformat(), "--until", (since + timedelta(seconds=20)).isoformat(),
+            "--slice-hours", str(10 / 3600),  # Two slices of 10 recordings each
+        ]
+        sync = api_service.fetch_and_download_call_recordings
+        calls = []
+
+        def fail_second_slice(**kwargs):
+            calls.append(kwargs)
+            if len(calls) == 2:
+                raise RuntimeError("portal down")
+            return sync(**kwargs)
+
+        with mock.patch.object(api_service, "fetch_and_download_call_recordings", side_effect=fail_second_slice):
+            with self.assertRaises(CommandError):
+                call_command("sync_recordings", *args, stdout=io.StringIO())
+        self.assertEqual(len(self._attached()), 10)
+
+        out = io.StringIO()
+        call_command("sync_recordings", *args, stdout=out)
+        self.assertIn(f"Resuming backfill since={ledger.format_8x8_time(since)}", out.getvalue())
+        self.assertIn("found 10,", out.getvalue())  # Only the slice that failed is listed again
+        self.assertEqual(len(self._attached()), self.recordings)
+        self.assertEqual(self.fake.calls["bitrix upload"], self.recordings)
+
+
+@override_settings(WEBHOOK_SECRET="s3cret", SYNC_BATCH_WINDOW=60)
+class WebhookTests(FakeApisTestCase):
+    recordings = 5
+    url = "/recordings/webhook/"
+
+    def _post(self, body, token="s3cret"):
+        return self.client.post(self.url, body, content_type="application/json", HTTP_X_WEBHOOK_TOKEN=token)
+
+    def test_calls_without_the_secret_are_refused(self):
+        self.assertEqual(self._post({"id": "obj-0000001"}, token="guess").status_code, 403)
+        with override_settings(WEBHOOK_SECRET=""):
+            self.assertEqual(self._post({"id": "obj-0000001"}).status_code, 403)
+        self.assertFalse(SyncJob.objects.exists())
+
+    def test_malformed_notifications_are_rejected(self):
+        for body in ("not json", {"objects": "obj-0000001"}, {"id": "../etc/passwd"}, [42]):
+            response = self._post(body)
+            self.assertEqual(response.status_code, 400, body)
+            self.assertFalse(response.json()["success"])
+        self.assertFalse(SyncJob.objects.exists())
+
+    def test_notifications_close_together_share_one_bulk_download(self):
+        object_ids = [obj["id"] for obj in self.fake.objects["us-east"][:3]]
+        for object_id in object_ids:
+            self.assertEqual(self._post({"id": object_id}).status_code, 202)
+        SyncJob.objects.update(run_after=None)  # The batching window has passed
+
+        call_command("run_sync_worker", "--once", stdout=io.StringIO())
+        self.assertEqual(self.fake.calls["8x8 bulk start"], 1)
+        self.assertEqual(
+            set(Recording.objects.filter(status=Recording.Status.ATTACHED).values_list("object_id", flat=True)),
+            set(object_ids),
+        )
+        self.assertEqual({job.status for job in SyncJob.objects.all()}, {SyncJob.Status.DONE})
+
+
+class EightByEightTests(FakeApisTestCase):
+    recordings = 25
+
+    def test_pages_are_prefetched_while_the_caller_works(self):
+        token = api_service.get_access_token()
+        pages = api_service.iter_object_pages(token, "us-east", api_service.build_filter_query(), page_size=10)
+        first = next(pages)
+        deadline = time.monotonic() + 5
+        while self.fake.calls.get("8x8 objects") != 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.fake.calls["8x8 objects"], 2)  # The second page is on its way already
+
+        objects = first + [obj for page in pages for obj in page]
+        self.assertEqual(len(first), 10)
+        self.assertEqual([obj["id"] for obj in objects], [obj["id"] for obj in self.fake.objects["us-east"]])
+        self.assertEqual(self.fake.calls["8x8 objects"], 3)  # Nothing asked for after the last page
+
+    def _start_bulk(self):
+        token = api_service.get_access_token()
+        object_id = self.fake.objects["us-east"][0]["id"]
+        zip_name = api_service.create_bulk_download(token, "us-east", [object_id])["zipName"]
+        return token, zip_name
+
+    def test_failed_bulk_download_fails_its_recordings(self):
+        self.fake.bulk_state = "FAILED"
+        token, zip_name = self._start_bulk()
+        with self.assertRaisesRegex(api_service.BulkDownloadError, "FAILED"):
+            api_service.wait_for_bulk_download(token, "us-east", zip_name)
+
+        result = api_service.fetch_and_download_call_recordings()
+        self.assertEqual(result["summary"]["failed"], self.recordings)
+        self.assertEqual(
+            set(Recording.objects.values_list("status", flat=True)), {Recording.Status.FAILED},
+        )
+
+    @override_settings(BULK_POLL_TIMEOUT=0.2, BULK_POLL_INITIAL=0.05)
+    def test_bulk_download_gives_up_after_the_timeout(self):
+        self.fake.bulk_delay = 60
+        token, zip_name = self._start_bulk()
+        started = time.monotonic()
+        with self.assertRaisesRegex(api_service.BulkDownloadError, "not ready"):
+            api_service.wait_for_bulk_download(token, "us-east", zip_name)
+        self.assertLess(time.monotonic() - started, 2)
+
+    @override_settings(BULK_POLL_INITIAL=5)
+    def test_polling_follows_the_servers_retry_after(self):
+        self.fake.bulk_delay, self.fake.bulk_retry_after = 0.3, 0.1
+        token, zip_name = self._start_bulk()
+        with mock.patch.object(api_service.time, "sleep", wraps=time.sleep) as sleep:
+            self.assertEqual(api_service.wait_for_bulk_download(token, "us-east", zip_name)["status"], "DONE")
+        self.assertTrue(sleep.call_args_list)
+        self.assertEqual({call.args[0] for call in sleep.call_args_list}, {0.1})
+
+
+class FakeApisFilterTests(SimpleTestCase):
+    def test_in_list_is_not_split_on_its_commas(self):
+        fake = FakeApis(recordings=5, regions=("us-east",))
+        ids = [obj["id"] for obj in fake.objects["us-east"][:3]]
+        found = fake.filter_objects("us-east", f"type==callcenterrecording,id=in=({','.join(ids)})")
+        self.assertEqual([obj["id"] for obj in found], ids)
+
+
+class CleanupTests(FakeApisTestCase):
+    recordings = 5
+
+    def assertWorkdirEmpty(self):
+        leftovers = [os.path.join(root, name) for root, _, files in os.walk(os.getcwd()) for name in files]
+        self.assertEqual([path for path in leftovers if "cache" not in path], [])
+
+    @override_settings(ZIP_STREAMING=False)
+    def test_files_are_removed_when_uploads_fail(self):
+        error = api_service.bitrix_upload.UploadError("portal down")
+        with mock.patch.object(api_service, "upload_mp3", side_effect=error):
+            result = api_service.fetch_and_download_call_recordings()
+        self.assertEqual(result["summary"]["failed"], self.recordings)
+        self.assertWorkdirEmpty()
+
+    def test_files_are_removed_when_preparing_fails(self):
+        with mock.patch.object(api_service, "_match_objects", side_effect=RuntimeError("corrupt ZIP")):
+            result = api_service.fetch_and_download_call_recordings()
+        self.assertEqual(result["summary"]["failed"], self.recordings)
+        self.assertWorkdirEmpty()
+
+
+class RetryTests(FakeApisTestCase):
+    recordings = 5
+
+    def test_retry_attaches_the_file_uploaded_before_attaching_failed(self):
+        error = api_service.requests.exceptions.ConnectionError("portal went away")
+        with mock.patch.object(api_service.bitrix_batch, "attach_files_and_comments", side_effect=error):
+            api_service.fetch_and_download_call_recordings()
+        rows = Recording.objects.all()
+        self.assertEqual({row.status for row in rows}, {Recording.Status.FAILED})
+        file_ids = {row.object_id: row.bitrix_file_id for row in rows}
+        self.assertTrue(all(file_ids.values()))
+        uploads = self.fake.calls["bitrix upload"]
+
+        rows.update(next_retry_at=django_timezone.now())
+        result = api_service.fetch_and_download_call_recordings()
+        self.assertEqual(result["summary"]["attached"], self.recordings)
+        self.assertEqual(result["summary"]["uploaded"], 0)
+        self.assertEqual(self.fake.calls["bitrix upload"], uploads)
+        self.assertEqual({row.object_id: row.bitrix_file_id for row in Recording.objects.all()}, file_ids)
+
+    def test_backfill_slices_leave_retries_to_the_sweeps(self):
+        failed = self.fake.objects["us-east"][0]["id"]
+        Recording.objects.create(
+            object_id=failed, region="us-east", status=Recording.Status.FAILED, attempts=1,
+            next_retry_at=django_timezone.now() - timedelta(seconds=1),
+        )
+        now = django_timezone.now()
+        result = api_service.fetch_and_download_call_recordings(since=now - timedelta(hours=1), until=now)
+        self.assertEqual(result["summary"]["found"], 0)
+        self.assertEqual(Recording.objects.get(object_id=failed).attempts, 1)
+
+        api_service.fetch_and_download_call_recordings()
+        self.assertEqual(Recording.objects.get(object_id=failed).status, Recording.Status.ATTACHED)
+
+
+class DuplicateAudioTests(FakeApisTestCase):
+    recordings = 3
+
+    def test_same_audio_is_uploaded_once_and_attached_to_every_entity(self):
+        with mock.patch("recordings.fake_apis.synthetic_wav", return_value=b"RIFF same audio"):
+            result = api_service.fetch_and_download_call_recordings()
+            self.assertEqual(result["summary"]["duplicate"], self.recordings - 1)
+            self.add_object("later", django_timezone.now() - timedelta(minutes=1))
+            api_service.fetch_and_download_call_recordings()
+
+        self.assertEqual(self.fake.calls["bitrix upload"], 1)
+        self.assertEqual(self.fake.calls["crm.lead.update"], self.recordings + 1)
+        rows = Recording.objects.all()
+        self.assertEqual({row.status for row in rows}, {Recording.Status.ATTACHED})
+        self.assertEqual(len({row.bitrix_file_id for row in rows}), 1)
+
+
+class SinglePassTests(FakeApisTestCase):
+    recordings = 3
+
+    @override_settings(RECORDING_CACHE_ON_SYNC=True)
+    def test_each_recording_is_read_from_the_zip_once(self):
+        open_member = zipfile.ZipFile.open
+        for streaming in (True, False):
+            reads = Counter()
+
+            def counting_open(zip_ref, name, mode="r", *args, **kwargs):
+                if mode == "r":
+                    reads[getattr(name, "filename", name)] += 1
+                return open_member(zip_ref, name, mode, *args, **kwargs)
+
+            Recording.objects.all().delete()
+            SyncCheckpoint.objects.all().delete()
+            with override_settings(ZIP_STREAMING=streaming), mock.patch.object(zipfile.ZipFile, "open", counting_open):
+                result = api_service.fetch_and_download_call_recordings()
+            self.assertEqual(result["summary"]["attached"], self.recordings)
+            self.assertEqual(sorted(reads.values()), [1] * self.recordings, streaming)
+            self.assertTrue(all(recording_cache.get(obj["id"]) for obj in self.fake.objects["us-east"]))
+
+
+@override_settings(BITRIX24_CHUNKED_UPLOAD_THRESHOLD=8, BITRIX24_UPLOAD_CHUNK_SIZE=4)
+class ChunkedUploadTests(FakeApisTestCase):
+    recordings = 0
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(setattr, bitrix_upload, "_chunking_unsupported", False)
+        with open("call.mp3", "wb") as f:
+            f.write(b"0123456789")
+
+    def test_files_go_up_whole_unless_chunking_is_enabled(self):
+        self.assertTrue(api_service.upload_mp3("call.mp3"))
+        self.assertEqual(self.fake.calls["bitrix upload"], 1)
+
+    @override_settings(BITRIX24_CHUNKED_UPLOAD=True)
+    def test_chunked_upload(self):
+        self.assertTrue(api_service.upload_mp3("call.mp3"))
+        self.assertEqual(self.fake.calls["bitrix upload"], 3)
+
+    @override_settings(BITRIX24_CHUNKED_UPLOAD=True)
+    def test_falls_back_to_whole_files_when_the_portal_ignores_content_range(self):
+        self.fake.chunked_uploads = False
+        self.assertTrue(api_service.upload_mp3("call.mp3"))
+        self.assertEqual(self.fake.calls["bitrix upload"], 2)  # The first chunk, then the whole file
+        self.assertEqual(self.fake.calls["bitrix disk.file.delete.json"], 1)
+
+        api_service.upload_mp3("call.mp3")
+        self.assertEqual(self.fake.calls["bitrix upload"], 3)
+
+    @override_settings(BITRIX24_CHUNKED_UPLOAD=True)
+    def test_refused_chunk_is_an_error(self):
+        refused = mock.Mock(status_code=200, text='{"error": "ACCESS_DENIED"}')
+        refused.json.return_value = {"error": "ACCESS_DENIED"}
+        with mock.patch.object(bitrix_upload.bitrix_client, "post", return_value=refused):
+            with self.assertRaises(bitrix_upload.UploadError):
+                bitrix_upload.upload_file(io.BytesIO(b"0123456789"), "call.mp3", lambda: "http://upload", "call")
+
+
+class RecordingCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix="recordings-cache-")
+        self.addCleanup(shutil.rmtree, self.cache_dir, True)
+        overrides = override_settings(RECORDING_CACHE_DIR=self.cache_dir)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.source = os.path.join(self.cache_dir, "call.mp3")
+        with open(self.source, "wb") as f:
+            f.write(b"audio")
+
+    def test_failed_copy_leaves_no_partial_file(self):
+        with mock.patch.object(recording_cache.shutil, "copyfileobj", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                recording_cache.put("obj-1", self.source)
+        files = [name for _, _, names in os.walk(self.cache_dir) for name in names]
+        self.assertEqual(files, ["call.mp3"])
+
+    def test_put_then_get(self):
+        path = recording_cache.put("obj-1", self.source)
+        self.assertEqual(recording_cache.get("obj-1"), path)
+
+
+class RecordingEndpointTests(FakeApisTestCase):
+    recordings = 3
+
+    def setUp(self):
+        super().setUp()
+        self.object_id = self.fake.objects["us-east"][0]["id"]
+        Recording.objects.create(object_id=self.object_id, region="us-east")
+        self.url = f"/recordings/recording/{self.object_id}/"
+
+    @override_settings(RECORDING_FETCH_RETRY_AFTER=10)
+    def test_cache_miss_queues_one_fetch_job(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response["Retry-After"], "10")
+        self.assertEqual(response.json()["kind"], "fetch")
+        self.assertTrue(self.client.get(self.url).json()["coalesced"])
+
+        call_command("run_sync_worker", "--once", stdout=io.StringIO())
+        job = self.client.get(response.json()["status_url"]).json()["data"]
+        self.assertEqual(job["status"], "done")
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b"".join(response.streaming_content)), self.fake.recording_bytes)
+
+    def test_ranges_of_a_cached_recording(self):
+        self.client.get(self.url)
+        call_command("run_sync_worker", "--once", stdout=io.StringIO())
+        size = self.fake.recording_bytes
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{size}")
+        self.assertEqual(len(b"".join(response.streaming_content)), 10)
+
+        response = self.client.get(self.url, HTTP_RANGE=f"bytes={size}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{size}")
+
+    def test_recordings_missing_from_the_ledger_are_not_fetched(self):
+        response = self.client.get("/recordings/recording/obj-0000002/")
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(SyncJob.objects.exists())
+
+
+class SearchTests(TestCase):
+    url = "/recordings/search/"
+
+    def setUp(self):
+        transcripts._prefix_cache.clear()
+        start = datetime(2024, 3, 1, tzinfo=timezone.utc)
+        rows = [
+            ("+15550000001", "7", "Negative", "Customer asked for a refund", start),
+            ("+15550000001", "7", "Positive", "Refund sent, customer was happy", start + timedelta(hours=1)),
+            ("+15550000002", "8", "Negative", "Refused the refund twice", start + timedelta(hours=2)),
+            ("+15550000002", "8", "Neutral", "Refund questions about the invoice", start + timedelta(hours=2)),
+            ("+15550000003", "9", "Neutral", "Refund status call", None),
+            ("+15550000003", "9", "Positive", "Thanked the agent", start + timedelta(hours=3)),
+        ]
+        entries = {}
+        for index, (phone, lead, sentiment, text, call_time) in enumerate(rows):
+            Recording.objects.create(object_id=f"obj-{index}", region="us-east")
+            entries[f"obj-{index}"] = {
+                "phone_number": phone, "entity_type": "lead", "entity_id": lead, "call_time": call_time,
+                "text": text, "sentiment": sentiment, "score": None, "feedback": "",
+            }
+        transcripts.save(entries)
+
+    def _ids(self, **params):
+        return [result["object_id"] for result in self.client.get(self.url, params).json()["results"]]
+
+    def _all_pages(self, **params):
+        ids, url, pages = [], f"{self.url}?q={params.pop('q')}&page_size=2", 0
+        while url:
+            body = self.client.get(url, params).json()
+            ids += [result["object_id"] for result in body["results"]]
+            url, params, pages = body["next_url"], {}, pages + 1
+        return ids, pages
+
+    def test_cursor_pages_cover_every_match_once(self):
+        expected = ["obj-3", "obj-2", "obj-1", "obj-0", "obj-4"]  # Newest first, calls without a time last
+        self.assertEqual(self._all_pages(q="refund"), (expected, 3))
+        self.assertEqual(self._all_pages(q="ref*"), (expected, 3))
+        with override_settings(SEARCH_MATERIALIZE_LIMIT=1):  # Checked row by row instead
+            self.assertEqual(self._all_pages(q="refund"), (expected, 3))
+
+    def test_filters(self):
+        self.assertEqual(self._ids(q="refund", phone="(555) 000-0001"), ["obj-1", "obj-0"])
+        self.assertEqual(self._ids(q="refund", lead="8", sentiment="negative"), ["obj-2"])
+        self.assertEqual(self._ids(since="2024-03-01T02:00:00Z"), ["obj-5", "obj-3", "obj-2"])
+        self.assertEqual(self._ids(q="refund happy"), ["obj-1"])
+
+    @override_settings(SEARCH_COUNT_LIMIT=3)
+    def test_count_stops_at_the_limit(self):
+        body = self.client.get(self.url, {"q": "refund"}).json()
+        self.assertEqual((body["count"], body["count_exact"]), (3, False))
+        body = self.client.get(self.url, {"q": "refund", "phone": "+15550000002"}).json()
+        self.assertEqual((body["count"], body["count_exact"]), (2, True))
+
+    @override_settings(SEARCH_MAX_PREFIX_TERMS=1)
+    def test_slow_searches_are_rejected(self):
+        for params in ({"q": "re*"}, {"q": "ref*"}, {"q": "refund", "cursor": "soon"}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertFalse(response.json()["success"])
+        self.assertEqual(self._ids(q="refus*"), ["obj-2"])
+
+
+class FakeClock:
+    """Stands in for the ``time`` module: ``sleep`` advances ``monotonic`` instantly."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RateLimitTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(rate_limit, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _acquire_times(self, bucket, count):
+        times = []
+        for _ in range(count):
+            bucket.acquire()
+            times.append(self.clock.now)
+        return times
+
+    def test_requests_are_spaced_after_the_burst(self):
+        bucket = TokenBucket(rate=2, capacity=3)
+        self.assertEqual(self._acquire_times(bucket, 5), [0, 0, 0, 0.5, 1.0])
+
+    def test_penalty_pauses_callers_and_empties_the_bucket(self):
+        bucket = TokenBucket(rate=2, capacity=3)
+        bucket.penalize(5)
+        self.assertEqual(self._acquire_times(bucket, 2), [5.5, 6.0])
+
+    @override_settings(BITRIX24_LIMIT_RETRIES=3)
+    def test_throttled_batch_is_retried_not_failed(self):
+        limited = mock.Mock(status_code=503)
+        limited.json.return_value = {"error": "QUERY_LIMIT_EXCEEDED", "error_description": "Too many requests"}
+        ok = mock.Mock(status_code=200)
+        ok.json.return_value = {"result": {"result": {"dup_0": []}, "result_error": []}}
+        self.addCleanup(setattr, bitrix_client, "limiter", bitrix_client.limiter)
+        bitrix_client.limiter = TokenBucket(rate=4, capacity=4)
+
+        with mock.patch.object(bitrix_client.http_client, "request", side_effect=[limited, limited, ok]) as send, \
+                mock.patch.object(bitrix_client.random, "uniform", return_value=0):
+            results, errors = bitrix_batch.call_batch({"dup_0": ("crm.duplicate.findbycomm", {})})
+        self.assertEqual((results, errors), ({"dup_0": []}, {}))
+        self.assertEqual(send.call_count, 3)
+        self.assertEqual(self.clock.now, 1 + 0.25 + 2 + 0.25)  # Backed off 1s then 2s, refilling from empty each time
+
+
+class PipelineTests(SimpleTestCase):
+    def _start(self, stages, items):
+        """Run a Pipeline on a thread; returns the thread and a list that receives its error."""
+        errors = []
+
+        def run():
+            try:
+                pipeline.Pipeline(stages).run(items)
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread, errors
+
+    def test_slow_stage_blocks_the_stage_before_it(self):
+        produced, consumed, release = [], [], threading.Event()
+
+        def slow(item):
+            release.wait(5)
+            consumed.append(item)
+
+        stages = [
+            pipeline.Stage("fast", lambda item: produced.append(item) or [item], queue_size=1),
+            pipeline.Stage("slow", slow, queue_size=1),
+        ]
+        thread, errors = self._start(stages, range(10))
+        time.sleep(0.2)
+        self.assertEqual(produced, [0, 1, 2])  # One being handled, one queued, one waiting to be queued
+        release.set()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual((consumed, errors), (list(range(10)), []))
+
+    def test_failing_stage_stops_the_others(self):
+        seen = []
+
+        def check(item):
+            if item == 3:
+                raise ValueError("bad item")
+            return [item]
+
+        stages = [
+            pipeline.Stage("source", lambda item: [item]),
+            pipeline.Stage("check", check, workers=2),
+            pipeline.Stage("sink", lambda item: seen.append(item) or time.sleep(0.001)),
+        ]
+        thread, errors = self._start(stages, range(100000))
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([str(e) for e in errors], ["bad item"])
+        self.assertNotIn(3, seen)
+        self.assertLess(len(seen), 1000)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def _half_open(self):
+        breaker = CircuitBreaker("example.test", failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "half_open")
+        return breaker
+
+    def test_one_trial_call_at_a_time(self):
+        breaker = self._half_open()
+        self.assertTrue(breaker.before_call())
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+    def test_unexpected_error_in_the_trial_call_lets_the_next_one_through(self):
+        breaker = self._half_open()
+        session = mock.Mock(request=mock.Mock(side_effect=ValueError("unexpected")))
+        with mock.patch.object(http_client, "get_breaker", return_value=breaker), \
+                mock.patch.object(http_client, "get_session", return_value=session):
+            with self.assertRaises(ValueError):
+                http_client.get("http://example.test/")
+        self.assertTrue(breaker.before_call())
+
+
+class BatchErrorTests(SimpleTestCase):
+    def setUp(self):
+        crm_lookup.clear_cache()
+        self.addCleanup(crm_lookup.clear_cache)
+
+    def test_failed_lookups_are_reported_and_not_cached(self):
+        limit = {"error": "QUERY_LIMIT_EXCEEDED", "error_description": "Too many requests"}
+        results = {"dup_0": {"LEAD": [7]}}
+        with mock.patch.object(crm_lookup.bitrix_batch, "call_batch", return_value=(results, {"dup_1": limit})):
+            entities = crm_lookup.resolve_entities(["+15550000001", "+15550000002"])
+        self.assertEqual(entities["+15550000001"], {"entity_type": "lead", "entity_id": "7"})
+        self.assertIn("QUERY_LIMIT_EXCEEDED", entities["+15550000002"]["error"])
+
+        with mock.patch.object(crm_lookup.bitrix_batch, "call_batch", return_value=({"dup_0": []}, {})) as batch:
+            entities = crm_lookup.resolve_entities(["+15550000001", "+15550000002"])
+        batch.assert_called_once()
+        self.assertEqual(list(batch.call_args.args[0]), ["dup_0"])  # Only the failed number again
+        self.assertIsNone(entities["+15550000002"])
+
+    @override_settings(BITRIX24_ENTITY_FALLBACK=True, BITRIX24_DEAL_RECORDING_FIELD="UF_DEAL")
+    def test_deals_are_looked_up_only_for_contacts(self):
+        lookups = {"dup_0": {"LEAD": [1]}, "dup_1": [], "dup_2": {"CONTACT": [3]}, "deal_2": [{"ID": 9}]}
+        with mock.patch.object(crm_lookup.bitrix_batch, "call_batch", return_value=(lookups, {})) as batch:
+            entities = crm_lookup.resolve_entities(["+15550000001", "+15550000002", "+15550000003"])
+        self.assertEqual([list(call.args[0]) for call in batch.call_args_list], [["dup_0", "dup_1", "dup_2"], ["deal_2"]])
+        self.assertEqual(batch.call_args.args[0]["deal_2"][1]["filter"], {"CONTACT_ID": 3})
+        self.assertEqual(entities["+15550000003"], {"entity_type": "deal", "entity_id": "9"})
+
+    @override_settings(BITRIX24_ENTITY_FALLBACK=True, BITRIX24_DEAL_RECORDING_FIELD="UF_DEAL")
+    def test_failed_deal_lookup_of_a_contact_is_an_error(self):
+        results = {"dup_0": {"CONTACT": [3]}}
+        with mock.patch.object(crm_lookup.bitrix_batch, "call_batch", return_value=(results, {"deal_0": "boom"})):
+            entities = crm_lookup.resolve_entities(["+15550000003"])
+        self.assertIn("boom", entities["+15550000003"]["error"])
+
+    @override_settings(BITRIX24_RECORDING_FIELD="UF_LEAD", BITRIX24_CONTACT_RECORDING_FIELD="UF_CONTACT")
+    def test_contacts_and_deals_get_their_own_recording_field(self):
+        lookups = {"dup_0": {"CONTACT": [3]}, "deal_0": [{"ID": 9}], "dup_1": {"LEAD": [5]}}
+        for deal_field, expected in (("", ("contact", "3", "UF_CONTACT")), ("UF_DEAL", ("deal", "9", "UF_DEAL"))):
+            crm_lookup.clear_cache()
+            batches = []
+
+            def call_batch(commands, **kwargs):
+                batches.append(commands)
+                return lookups, {}
+
+            with override_settings(BITRIX24_DEAL_RECORDING_FIELD=deal_field), \
+                    mock.patch.object(crm_lookup.bitrix_batch, "call_batch", side_effect=call_batch), \
+                    mock.patch.object(api_service, "upload_mp3", return_value="99"):
+                results = api_service.upload_recordings_to_bitrix24([("a.wav", "+15550000003", None), ("b.wav", "+15550000005", None)])
+            self.assertEqual([result["status"] for result in results], ["attached", "attached"])
+            entity_type, entity_id, field = expected
+            self.assertEqual(batches[-1]["attach_0"], (f"crm.{entity_type}.update", {"id": entity_id, "fields": {field: "99"}}))
+            self.assertEqual(batches[-1]["attach_1"], ("crm.lead.update", {"id": "5", "fields": {"UF_LEAD": "99"}}))
+
+    @override_settings(BITRIX24_CONTACT_RECORDING_FIELD="", BITRIX24_DEAL_RECORDING_FIELD="")
+    def test_contacts_without_a_recording_field_are_skipped(self):
+        with mock.patch.object(crm_lookup.bitrix_batch, "call_batch", return_value=({"dup_0": {"CONTACT": [3]}}, {})):
+            self.assertEqual(crm_lookup.resolve_entities(["+15550000003"]), {"+15550000003": None})
+        entity = {"+1": {"entity_type": "contact", "entity_id": "3"}}  # Found while a field was configured
+        with mock.patch.object(api_service.crm_lookup, "resolve_entities", return_value=entity), \
+                mock.patch.object(api_service, "upload_mp3") as upload:
+            results = api_service.upload_recordings_to_bitrix24([("a.wav", "+1", None)])
+        upload.assert_not_called()
+        self.assertEqual(results[0]["status"], "failed")
+
+    def test_lookup_and_attach_errors_fail_the_recording(self):
+        entities = {
+            "+1": {"error": "CRM lookup failed: QUERY_LIMIT_EXCEEDED"},
+            "+2": {"entity_type": "lead", "entity_id": "5"},
+        }
+        with mock.patch.object(api_service.crm_lookup, "resolve_entities", return_value=entities), \
+                mock.patch.object(api_service, "upload_mp3", return_value="99") as upload, \
+                mock.patch.object(api_service.bitrix_batch, "attach_files_and_comments",
+                                  return_value=({}, {"attach_0": "ACCESS_DENIED"})):
+            results = api_service.upload_recordings_to_bitrix24([("a.wav", "+1", None), ("b.wav", "+2", None)])
+        upload.assert_called_once()
+        self.assertEqual([result["status"] for result in results], ["failed", "failed"])
+        self.assertIn("QUERY_LIMIT_EXCEEDED", results[0]["error"])
+        self.assertEqual(results[1]["error"], "ACCESS_DENIED")
+
+
+class TokenManagerTests(SimpleTestCase):
+    def test_token_is_refreshed_ahead_of_expiry(self):
+        tokens = iter(["t1", "t2"])
+        fetch = mock.Mock(side_effect=lambda: (next(tokens), 100))
+        manager = auth.TokenManager(fetch, refresh_margin=10)
+        with mock.patch.object(auth.time, "time", return_value=1000.0) as clock:
+            self.assertEqual(manager.get_token(), "t1")
+            clock.return_value = 1080.0
+            self.assertEqual(manager.get_token(), "t1")
+            clock.return_value = 1095.0  # Within the margin, but still valid
+            self.assertEqual(manager.get_token(), "t2")
+            self.assertEqual(fetch.call_count, 2)
+
+            fetch.side_effect = RuntimeError("token endpoint down")
+            clock.return_value = 1190.0
+            self.assertEqual(manager.get_token(), "t2")  # A failed refresh-ahead keeps the current token
+            clock.return_value = 1200.0
+            with self.assertRaises(RuntimeError):
+                manager.get_token()
+
+    def test_concurrent_callers_share_one_refresh(self):
+        fetched, release = [], threading.Event()
+
+        def fetch():
+            fetched.append(threading.get_ident())
+            release.wait(5)
+            return f"t{len(fetched)}", 100
+
+        manager = auth.TokenManager(fetch)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            futures = [pool.submit(manager.get_token) for _ in range(8)]
+            time.sleep(0.05)  # Let the other callers queue up behind the first refresh
+            release.set()
+            self.assertEqual([future.result() for future in futures], ["t1"] * 8)
+        self.assertEqual(len(fetched), 1)
+
+
+class TokenRetryTests(FakeApisTestCase):
+    recordings = 0
+
+    def test_401_fetches_a_new_token_and_retries_once(self):
+        url = f"{settings.EIGHTX8_API_URL}/storage/us-east/v3/regions"
+        api_service._request_8x8("GET", url)
+        self.fake.revoke_tokens()
+        self.assertEqual(api_service._request_8x8("GET", url).status_code, 200)
+        self.assertEqual(self.fake.calls["8x8 /oauth/v2/token"], 2)
+
+        self.fake.reject_tokens = True
+        with self.assertRaises(api_service.requests.exceptions.HTTPError):
+            api_service._request_8x8("GET", url)
+        self.assertEqual(self.fake.calls["8x8 /oauth/v2/token"], 3)
+        self.assertEqual(self.fake.calls["8x8 regions"], 5)  # 1, then 401 and retry, then 401 twice
+
+
+class TranscriptionTests(SimpleTestCase):
+    def _wav(self, seconds, rate=8000):
+        """A mono 16-bit WAV whose samples hold the second they belong to."""
+        path = os.path.join(self.workdir, "call.wav")
+        with wave.open(path, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(rate)
+            wav.writeframes(b"".join(second.to_bytes(2, "little") * rate for second in range(seconds)))
+        return path
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="transcription-test-")
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+
+    @override_settings(TRANSCRIPTION_MAX_BYTES=50_000, TRANSCRIPTION_SEGMENT_OVERLAP=1, FFMPEG_BINARY="no-such-ffmpeg")
+    def test_large_recording_is_split_into_overlapping_segments(self):
+        segments = transcription.split_audio(self._wav(10), self.workdir)  # 160 kB: 4 segments of 2.5 s
+
+        starts, lengths = [], []
+        for segment in segments:
+            with wave.open(segment, "rb") as wav:
+                lengths.append(wav.getnframes() / wav.getframerate())
+                starts.append(int.from_bytes(wav.readframes(1), "little"))
+        self.assertEqual(starts, [0, 1, 4, 6])  # Each segment reaches 1 s back into the one before
+        self.assertEqual(lengths, [3.5, 3.5, 3.5, 3.5])
+
+    @override_settings(TRANSCRIPTION_MAX_BYTES=50_000)
+    def test_small_recording_is_not_split(self):
+        path = self._wav(1)
+        self.assertEqual(transcription.split_audio(path, self.workdir), [path])
+
+    def test_backend_without_transcribe_fails_when_created(self):
+        class Incomplete(transcription.TranscriptionBackend):
+            pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_stitch_drops_words_repeated_by_the_overlap(self):
+        texts = ["Thanks for calling, how can I", "How can I help you today?", "You today? My order is late."]
+        self.assertEqual(
+            transcription.stitch(texts), "Thanks for calling, how can I help you today? My order is late.",
+        )
+        self.assertEqual(transcription.stitch(["Hello.", "Goodbye."]), "Hello. Goodbye.")
+        self.assertEqual(transcription.stitch([]), "")
+
+
+class AnalysisTests(TransactionTestCase):
+    """A TransactionTestCase, since analyses are cached from worker threads."""
+
+    reply = 'Here you go: {"sentiment": "Positive", "score": 3, "feedback": "Polite and clear."} Anything else?'
+
+    def test_identical_and_cached_transcripts_are_analyzed_once(self):
+        with mock.patch.object(analysis, "_chat", return_value=self.reply) as chat:
+            results = analysis.analyze_many(["first call", "second call", "first call"])
+            self.assertEqual(chat.call_count, 2)
+            self.assertEqual(results[0], {"sentiment": "Positive", "score": 1.0, "feedback": "Polite and clear."})
+            self.assertEqual(results[0], results[2])
+
+            self.assertEqual(analysis.analyze_many(["second call", "first call"]), results[1:])
+            self.assertEqual(chat.call_count, 2)  # Both came from the database this time
+        self.assertEqual(TranscriptAnalysis.objects.count(), 2)
+
+    def test_failed_analysis_is_none_and_not_cached(self):
+        with mock.patch.object(analysis, "_chat", side_effect=RuntimeError("API down")):
+            self.assertEqual(analysis.analyze_many(["a call"]), [None])
+        self.assertFalse(TranscriptAnalysis.objects.exists())
+
+    def test_reply_without_json_keeps_the_text_as_feedback(self):
+        self.assertEqual(
+            analysis._parse("  The agent was rude.  "),
+            {"sentiment": "Unknown", "score": None, "feedback": "The agent was rude."},
+        )
+        self.assertIsNone(analysis._parse('{"sentiment": "Neutral", "score": "n/a"}')["score"])
+
+    @override_settings(ANALYSIS_MAX_CHARS=10, ANALYSIS_OVERFLOW="truncate")
+    def test_long_transcript_keeps_its_start_and_end(self):
+        self.assertEqual(
+            analysis._fit_to_budget("abcdefghijklmnopqrstuvwxyz"),
+            "abcde\n[... middle of the call omitted ...]\nvwxyz",
+        )
+        self.assertEqual(analysis._fit_to_budget("short"), "short")
+
+    @override_settings(ANALYSIS_MAX_CHARS=40, ANALYSIS_OVERFLOW="summarize")
+    def test_long_transcript_is_summarized_part_by_part(self):
+        with mock.patch.object(analysis, "_chat", side_effect=lambda prompt: "ok") as chat:
+            fitted = analysis._fit_to_budget("x" * 100)
+        self.assertEqual(chat.call_count, 3)
+        self.assertEqual(fitted, "Part 1: ok\n\nPart 2: ok\n\nPart 3: ok")
+
+
+class TranscodeTests(SimpleTestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="transcode-test-")
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+        self.sources = []
+        for name in ("call.wav", "call.mp3"):
+            path = os.path.join(self.workdir, name)
+            with wave.open(path, "wb") as wav:
+                wav.setnchannels(2)
+                wav.setsampwidth(2)
+                wav.setframerate(8000)
+                wav.writeframes(bytes(8000 * 4))  # One second of silence
+            self.sources.append(path)
+
+    @skipUnless(shutil.which(settings.FFMPEG_BINARY), "ffmpeg is not installed")
+    def test_matching_recordings_are_encoded_in_the_process_pool(self):
+        self.addCleanup(setattr, transcode, "_pool", None)
+        self.addCleanup(lambda: transcode._pool and transcode._pool.shutdown())
+
+        output = os.path.join(self.workdir, "out")
+        sources, stats = transcode.transcode_many(self.sources, output)
+
+        self.assertEqual(sources, [os.path.join(output, "call.ogg"), self.sources[1]])  # Only .wav is re-encoded
+        self.assertEqual(stats["transcoded"], 1)
+        self.assertEqual(stats["bytes_before"], os.path.getsize(self.sources[0]))
+        self.assertEqual(stats["bytes_after"], os.path.getsize(sources[0]))
+        self.assertLess(stats["bytes_after"], stats["bytes_before"])
+
+    @override_settings(FFMPEG_BINARY="no-such-ffmpeg")
+    def test_recordings_are_uploaded_as_they_are_without_ffmpeg(self):
+        sources, stats = transcode.transcode_many(self.sources, os.path.join(self.workdir, "out"))
+        self.assertEqual(sources, self.sources)
+        self.assertEqual(stats, {"transcoded": 0, "bytes_before": 0, "bytes_after": 0})
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.registry.clear()
+        self.addCleanup(metrics.registry.clear)
+
+    def test_endpoint_merges_worker_snapshots_and_forgets_silent_workers(self):
+        with metrics.span("upload"):
+            metrics.add_bytes("upload", 2048)
+        MetricsSnapshot.objects.create(worker="sync-1", data={
+            "counters": {"recordings_bytes_total": {'direction="download"': 4096}},
+        })
+        MetricsSnapshot.objects.create(worker="sync-2", data={
+            "counters": {"recordings_bytes_total": {'direction="download"': 1}},
+        })
+        MetricsSnapshot.objects.filter(worker="sync-2").update(updated_at=django_timezone.now() - timedelta(hours=2))
+        Recording.objects.create(object_id="obj-1", region="us-east", status=Recording.Status.ATTACHED)
+
+        with override_settings(METRICS_SNAPSHOT_TTL=3600):
+            response = self.client.get("/recordings/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        lines = response.content.decode().splitlines()
+
+        own = f'worker="{jobs.worker_name()}"'
+        self.assertIn(f'recordings_bytes_total{{direction="upload",{own}}} 2048', lines)
+        self.assertIn('recordings_bytes_total{direction="download",worker="sync-1"} 4096', lines)
+        self.assertIn(f'recordings_stage_seconds_count{{stage="upload",{own}}} 1', lines)
+        self.assertIn('recordings_ledger{status="attached"} 1', lines)
+        self.assertIn("# TYPE recordings_stage_seconds histogram", lines)
+        self.assertNotIn("sync-2", response.content.decode())
+        self.assertEqual(list(MetricsSnapshot.objects.values_list("worker", flat=True)), ["sync-1"])
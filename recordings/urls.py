@@ -4,4 +4,8 @@ from . import views  # Import views
 urlpatterns = [
     path("list/", views.list_recordings, name="list_recordings"),
     path("recording/<str:object_id>/", views.get_recording, name="get_recording"),
-]
\ No newline at end of file
+    path("webhook/", views.recording_webhook, name="recording_webhook"),
+    path("search/", views.search_recordings, name="search_recordings"),
+    path("jobs/<int:job_id>/", views.job_status, name="job_status"),
+    path("metrics/", views.metrics_view, name="metrics"),
+]
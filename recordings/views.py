@@ -1,41 +1,274 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+import hmac
+import json
 import logging
-from .services.api_service import fetch_and_download_call_recordings
+import os
+import re
+from .models import Recording, SyncJob
+from .services import ledger, metrics, recording_cache, transcode, transcripts
+from .services.jobs import enqueue_fetch, enqueue_sync, worker_name
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+OBJECT_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def _job_info(request, job, created):
+    return {
+        "job_id": job.pk,
+        "kind": job.kind,
+        "object_id": job.object_id or None,
+        "status": job.status,
+        "coalesced": not created,
+        "status_url": request.build_absolute_uri(reverse("job_status", args=[job.pk])),
+    }
+
+def _job_accepted(request, job, created):
+    """202 response pointing the client at the job's progress endpoint."""
+    return JsonResponse({"success": True, **_job_info(request, job, created)}, status=202)
+
+def _notified_object_ids(payload):
+    """
+    Object IDs of the available recordings in an 8x8 notification.
+
+    The payload is one object (``{"id": ...}`` or ``{"objectId": ...}``) or
+    ``{"objects": [...]}``. Objects of another type, or not AVAILABLE yet,
+    are ignored; a malformed payload raises ValueError.
+    """
+    items = payload.get("objects", [payload]) if isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        raise ValueError("Expected an object or a list of objects")
+
+    object_ids = []
+    for item in items:
+        if isinstance(item, str):
+            item = {"id": item}
+        if not isinstance(item, dict):
+            raise ValueError("Expected an object or a list of objects")
+        if item.get("type", "callcenterrecording") != "callcenterrecording":
+            continue
+        if item.get("objectState", "AVAILABLE") != "AVAILABLE":
+            continue
+        object_id = str(item.get("id") or item.get("objectId") or "")
+        if not OBJECT_ID_PATTERN.match(object_id):
+            raise ValueError(f"Invalid object ID: {object_id!r}")
+        object_ids.append(object_id)
+    return list(dict.fromkeys(object_ids))
+
 def list_recordings(request):
     """
-    Fetch and return all call recordings.
+    Queue a sync of all new call recordings and return the job ID.
     """
     try:
-        # Fetch call recordings (without specific object_id)
-        recordings = fetch_and_download_call_recordings()
-        
-        if not recordings:
-            return JsonResponse({"success": True, "message": "No recordings found"}, status=200)
-
-        return JsonResponse({"success": True, "data": recordings}, status=200)
+        job, created = enqueue_sync()
+        return _job_accepted(request, job, created)
     except Exception as e:
-        logger.error(f"Error fetching recordings: {str(e)}", exc_info=True)
+        logger.error(f"Error queueing recordings sync: {str(e)}", exc_info=True)
         return JsonResponse({"success": False, "error": str(e)}, status=500)
 
-def get_recording(request, object_id):
+def _parse_range(header, size):
     """
-    Fetch and return a specific call recording's metadata.
+    The ``(start, end)`` byte positions (inclusive) of a single-range ``Range`` header.
+
+    Returns None when there is no usable header (serve the whole file) and
+    raises ValueError when the range lies outside the file.
     """
+    match = RANGE_PATTERN.match(header.strip()) if header else None
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        start, end = max(size - int(last), 0), size - 1  # The last N bytes
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+def _iter_file(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(settings.DOWNLOAD_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def _serve_audio(request, path):
+    """
+    Stream a cached recording, honoring ``Range`` so audio players can seek.
+    """
+    size = os.path.getsize(path)
+    content_type = transcode.content_type(path)
     try:
-        if not object_id:
-            return JsonResponse({"success": False, "error": "Missing object_id"}, status=400)
+        byte_range = _parse_range(request.headers.get("Range"), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
 
-        # Pass object_id to fetch a specific recording
-        recording = fetch_and_download_call_recordings(object_id)
+    if byte_range is None:
+        response = FileResponse(open(path, "rb"), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(_iter_file(path, start, end - start + 1), status=206, content_type=content_type)
+        response["Content-Length"] = str(end - start + 1)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Accept-Ranges"] = "bytes"
+    response["Cache-Control"] = "private, max-age=3600"
+    return response
 
-        if not recording:
-            return JsonResponse({"success": False, "error": "Recording not found"}, status=404)
+@csrf_exempt
+def get_recording(request, object_id):
+    """
+    GET: the recording's audio from the local recording cache. On a miss, queue a fetch from 8x8
+    and return 202 with the job and a Retry-After; GET again once the job is done.
+    POST: queue a sync of the recording to Bitrix24 and return the job ID.
+    """
+    if not object_id or not OBJECT_ID_PATTERN.match(object_id):
+        return JsonResponse({"success": False, "error": "Missing or invalid object_id"}, status=400)
 
-        return JsonResponse({"success": True, "data": recording}, status=200)
+    if request.method == "POST":
+        try:
+            job, created = enqueue_sync(object_id)
+            return _job_accepted(request, job, created)
+        except Exception as e:
+            logger.error(f"Error queueing recording {object_id}: {str(e)}", exc_info=True)
+            return JsonResponse({"success": False, "error": str(e)}, status=500)
+
+    try:
+        path = recording_cache.get(object_id)
+        if path is not None:
+            return _serve_audio(request, path)
+        if not recording_cache.enabled() or not Recording.objects.filter(object_id=object_id).exists():
+            return JsonResponse({"success": False, "error": "Recording not found"}, status=404)
+        # Bulk downloads take minutes, so a worker fetches the recording instead of this request
+        response = _job_accepted(request, *enqueue_fetch(object_id))
+        response["Retry-After"] = str(settings.RECORDING_FETCH_RETRY_AFTER)
+        return response
     except Exception as e:
         logger.error(f"Error fetching recording {object_id}: {str(e)}", exc_info=True)
         return JsonResponse({"success": False, "error": str(e)}, status=500)
+
+@csrf_exempt
+@require_POST
+def recording_webhook(request):
+    """
+    Queue the recordings announced by an 8x8 recording-available notification.
+
+    Jobs wait SYNC_BATCH_WINDOW seconds before they start, so notifications
+    arriving close together are synced by a single worker run. Calls must
+    carry WEBHOOK_SECRET in the X-Webhook-Token header; while it is unset,
+    every call is refused.
+    """
+    if not settings.WEBHOOK_SECRET:
+        logger.warning("Refused a webhook call: WEBHOOK_SECRET is not set")
+        return JsonResponse(
+            {"success": False, "error": "Webhooks are disabled until WEBHOOK_SECRET is set"}, status=403
+        )
+    token = request.headers.get("X-Webhook-Token", "")
+    if not hmac.compare_digest(token, settings.WEBHOOK_SECRET):
+        return JsonResponse({"success": False, "error": "Invalid webhook token"}, status=403)
+
+    try:
+        object_ids = _notified_object_ids(json.loads(request.body))
+    except ValueError as e:
+        return JsonResponse({"success": False, "error": f"Invalid notification: {e}"}, status=400)
+
+    try:
+        queued = [
+            _job_info(request, *enqueue_sync(object_id, delay=settings.SYNC_BATCH_WINDOW))
+            for object_id in object_ids
+        ]
+        return JsonResponse({"success": True, "jobs": queued}, status=202 if queued else 200)
+    except Exception as e:
+        logger.error(f"Error queueing notified recordings {object_ids}: {str(e)}", exc_info=True)
+        return JsonResponse({"success": False, "error": str(e)}, status=500)
+
+def job_status(request, job_id):
+    """
+    Return the progress of a sync job.
+    """
+    try:
+        job = SyncJob.objects.get(pk=job_id)
+    except SyncJob.DoesNotExist:
+        return JsonResponse({"success": False, "error": "Job not found"}, status=404)
+
+    return JsonResponse({"success": True, "data": job.as_dict()}, status=200)
+
+def _search_result(request, transcript, snippet):
+    return {
+        "object_id": transcript.recording.object_id,
+        "phone_number": transcript.phone_number,
+        "entity_type": transcript.entity_type or None,
+        "entity_id": transcript.entity_id or None,
+        "call_time": transcript.call_time,
+        "sentiment": transcript.sentiment or None,
+        "score": transcript.score,
+        "feedback": transcript.feedback,
+        "snippet": snippet or transcript.text[:300],
+        "recording_url": request.build_absolute_uri(reverse("get_recording", args=[transcript.recording.object_id])),
+    }
+
+def search_recordings(request):
+    """
+    Search stored call transcripts and AI feedback, newest calls first.
+
+    Query parameters: ``q`` (words that must all appear, ``word*`` for a
+    prefix), ``phone``, ``lead``, ``since``/``until`` (ISO dates or times),
+    ``sentiment``, ``page_size`` and ``cursor`` (the ``next_cursor`` of the
+    previous page).
+    """
+    params = request.GET
+    since, until = ledger.parse_day_or_time(params.get("since")), ledger.parse_day_or_time(params.get("until"))
+    if (params.get("since") and not since) or (params.get("until") and not until):
+        return JsonResponse({"success": False, "error": "since and until must be ISO 8601 dates or times"}, status=400)
+    try:
+        page_size = min(int(params.get("page_size") or settings.SEARCH_PAGE_SIZE), settings.SEARCH_MAX_PAGE_SIZE)
+        if page_size < 1:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({"success": False, "error": "page_size must be a positive number"}, status=400)
+
+    query = params.get("q", "").strip()
+    try:
+        count, exact, items, next_cursor = transcripts.search(
+            query,
+            phone=params.get("phone", ""),
+            lead=params.get("lead", ""),
+            since=since,
+            until=until,
+            sentiment=params.get("sentiment", ""),
+            cursor=params.get("cursor", ""),
+            limit=page_size,
+        )
+        snippets = transcripts.snippets(items, query) if query else {}
+    except transcripts.QueryError as e:
+        return JsonResponse({"success": False, "error": str(e)}, status=400)
+
+    next_url = None
+    if next_cursor:
+        next_params = params.copy()
+        next_params["cursor"] = next_cursor
+        next_url = request.build_absolute_uri(f"{request.path}?{next_params.urlencode()}")
+    return JsonResponse({
+        "success": True,
+        "count": count,
+        "count_exact": exact,  # False: at least ``count`` matches
+        "page_size": page_size,
+        "next_cursor": next_cursor,
+        "next_url": next_url,
+        "results": [_search_result(request, transcript, snippets.get(transcript.pk)) for transcript in items],
+    }, status=200)
+
+def metrics_view(request):
+    """
+    Pipeline metrics (stage timings, bytes, API calls, queue depths) in Prometheus text format.
+    """
+    return HttpResponse(metrics.render(worker_name()), content_type="text/plain; version=0.0.4; charset=utf-8")